@@ -1,133 +1,131 @@
 import time
 import aiohttp
 import asyncio
-import cv2
-import numpy as np
-import socket
-from datetime import datetime
-from utils import BATCH_SIZE, StreamClient, open_camera, CAMERA_LINK, TIME_PER_FRAME, save_detections, tracking_model, PERSON_DETECTION_THRESHOLD, tracker, TrackUpdate, track_user_ids, last_position, cut_the_frame_from_bbox, detect_face, face_model, FACE_DETECTION_THRESHOLD, send_frame_for_recognition, FACE_SIMILARITY_REQUEST_LINK, FACE_SIMILARITY_THRESHOLD, CAMERA_ID, visualize_tracks
+from utils import CAMERA_IDS, CAMERA_LINKS, CAMERA_EXCLUSION_POLYGONS, CAMERA_REFERENCE_SIZES, CAMERA_ROI_POLYGONS, CAMERA_SUB_LINKS, STREAM_BASE_PORT, TIME_PER_FRAME, CameraPipeline, DetectionWriter, InferenceMetrics, tracking_model, cut_the_frame_from_bbox, detect_faces, face_model, thresholds, DB_SETTINGS
+from settings_listener import SettingsListener
 
-# Initialize camera feed
-cap = open_camera(CAMERA_LINK)
+# One pipeline per camera handled by this worker, their frames go through the models as one batch
+pipelines = [
+    CameraPipeline(camera_id, camera_link, STREAM_BASE_PORT + i, sub_link, reference_size, roi_polygons, exclusion_polygons)
+    for i, (camera_id, camera_link, sub_link, reference_size, roi_polygons, exclusion_polygons) in enumerate(
+        zip(CAMERA_IDS, CAMERA_LINKS, CAMERA_SUB_LINKS, CAMERA_REFERENCE_SIZES, CAMERA_ROI_POLYGONS, CAMERA_EXCLUSION_POLYGONS)
+    )
+]
 
-# Frame dimensions
-frame_width = 1920
-frame_height = 1080
-frame_shape = (frame_height, frame_width, 3)
+# Frames processed and tracking model calls per camera, served by stream.py at /metrics
+metrics = InferenceMetrics(CAMERA_IDS)
 
-# Batch for storing data
-data_batch = []
+# How often to check the cameras again when none of them has a new frame yet
+NEW_FRAME_POLL_INTERVAL = min(0.01, TIME_PER_FRAME)
+
+# Detections are persisted by a background thread, BATCH_SIZE rows per COPY
+detection_writer = DetectionWriter()
+metrics.add_source("detection_writer", detection_writer.metrics)
+
+# Thresholds changed in the management settings apply without restarting the container
+settings_listener = SettingsListener(DB_SETTINGS, thresholds.reload)
 
 async def main():
     last_save_time = time.time()
+    detection_writer.start()
+    settings_listener.start()
 
-    # Initialize client
-    client = StreamClient()
-    if not await client.connect():
-        return
+    # Initialize clients
+    for pipeline in pipelines:
+        if not await pipeline.client.connect():
+            return
     try:
         async with aiohttp.ClientSession() as session:
-            while True:
-                frame = cap.read()
-                if frame is None:
-                    print("Waiting for frames...")
-                    time.sleep(0.1)
-                    continue
+            for pipeline in pipelines:
+                pipeline.start_recognition(session)
 
+            running = True
+            while running:
                 current_time = time.time()
 
-                # Process the frame every TIME_PER_FRAME
-                if current_time - last_save_time >= TIME_PER_FRAME:
-                    result = tracking_model(frame)[0]
-
-                    # Filter detections for people
-                    person_indices = (result.boxes.cls == 0) & (result.boxes.conf > PERSON_DETECTION_THRESHOLD)
-                    filtered_boxes = result.boxes[person_indices]
-
-                    if filtered_boxes.shape[0] > 1:
-                        try:
-                            tracker.update(filtered_boxes.cpu())
-                        except IndexError:
-                            print("index error")
-
-                    if filtered_boxes.shape[0] == 1:
-                        try:
-                            box = filtered_boxes[0]
-                            track_update = TrackUpdate(box.xywh.cpu().numpy(), box.conf.cpu().numpy(), box.cls.cpu().numpy())
-                            tracker.update(track_update)
-                        except IndexError:
-                            print("index error")
-
-                    for track in tracker.removed_stracks:
-                        if track.track_id in track_user_ids:
-                            track_user_ids.pop(track.track_id)
-
-                    for track in tracker.tracked_stracks:
-                        position = (float(track.xywh[0]), float(track.xywh[1]))
-
-                        if track.track_id in last_position and last_position[track.track_id] == position:
-                            continue
-
-                        last_position[track.track_id] = position
-
-                        if track.track_id not in track_user_ids:
-                            user_id = None
-                            cropped_frame = cut_the_frame_from_bbox(frame, track.xywh)
-                            face = detect_face(cropped_frame, face_model, FACE_DETECTION_THRESHOLD)
-
-                            if face is not None:
-                                face_cropped = cut_the_frame_from_bbox(cropped_frame, face.xywh[0].cpu().numpy())
-                                distance, detected_id, user_inside = await send_frame_for_recognition(face_cropped, session, FACE_SIMILARITY_REQUEST_LINK)
-
-                                if distance is not None and distance < FACE_SIMILARITY_THRESHOLD and user_inside:
-                                    user_id = detected_id
-                                    track_user_ids[track.track_id] = user_id
-                        else:
-                            user_id = track_user_ids[track.track_id]
-
-                        try:
-                            # Create detection data for shared memory
-                            detection_data = (
-                                user_id,
-                                CAMERA_ID,
-                                track.track_id,
-                                datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                                float(track.xywh[0]),
-                                float(track.xywh[1]),
-                                float(track.xywh[2]),
-                                float(track.xywh[3]),
-                            )
-
-                            # You can store detection_data to a database here if needed
-                            data_batch.append(detection_data)
-
-                        except Exception as e:
-                            print(f"Error in processing frame: {e}")
-
-                    last_save_time = current_time  # Update the last save time
-
-                    # Copy the frame to be visualized
-                    processed_frame = visualize_tracks(frame, tracker.tracked_stracks, track_user_ids)
-
-                    if len(data_batch) >= BATCH_SIZE:
-                        save_detections(data_batch)
-                        data_batch.clear()
-                
-                    # Send the processed frame
-                    if not client.send_frame(processed_frame):
-                        print("Lost connection to server, attempting to reconnect...")
-                        if await client.connect():
-                            continue
-                        else:
+                # Wait for the next frame slot without blocking the recognition requests in flight
+                if current_time - last_save_time < TIME_PER_FRAME:
+                    await asyncio.sleep(TIME_PER_FRAME - (current_time - last_save_time))
+                    continue
+
+                # Only cameras that decoded a frame since their last processed one take part in this slot
+                frames = []
+                for pipeline in pipelines:
+                    latest = pipeline.read_new_frame()
+                    if latest is not None:
+                        frames.append((pipeline, *latest))
+                if not frames:
+                    await asyncio.sleep(NEW_FRAME_POLL_INTERVAL)
+                    continue
+
+                # Motion gate: cameras with neither motion nor live tracks skip the tracking model
+                inferred = [pipeline.needs_inference(frame, current_time) for pipeline, _, frame in frames]
+                for (pipeline, _, _), needs_inference in zip(frames, inferred):
+                    metrics.record(pipeline.camera_id, needs_inference)
+
+                # Person detection on the latest frame of every camera with motion in a single batch
+                # Only the bounding crop of the camera's ROI goes through the model
+                inference_frames = [
+                    pipeline.region.crop(frame)
+                    for (pipeline, _, frame), needs_inference in zip(frames, inferred) if needs_inference
+                ]
+                inference_results = iter(tracking_model(inference_frames) if inference_frames else [])
+                results = [next(inference_results) if needs_inference else None for needs_inference in inferred]
+
+                moved_tracks = []
+                person_crops = []
+
+                for (pipeline, _, frame), result in zip(frames, results):
+                    # Skipped cameras get an empty update so their tracks still age out
+                    pipeline.update_tracker(result)
+
+                    tracks = pipeline.moved_tracks()
+                    moved_tracks.append(tracks)
+
+                    # Person crops come from the high resolution stream when inference runs on the sub-stream
+                    crop_frame, crop_scale = pipeline.crop_source(frame)
+                    for track in pipeline.tracks_needing_face(tracks, current_time):
+                        cropped_frame = cut_the_frame_from_bbox(crop_frame, track.xywh * crop_scale)
+                        if cropped_frame.size:
+                            person_crops.append((pipeline, track.track_id, cropped_frame))
+
+                # Face detection on the person crops of all cameras in a single batch
+                faces = detect_faces([cropped_frame for _, _, cropped_frame in person_crops], face_model, thresholds.face_detection)
+
+                for (pipeline, track_id, cropped_frame), face in zip(person_crops, faces):
+                    if face is not None:
+                        face_xywh, face_conf = face
+                        face_cropped = cut_the_frame_from_bbox(cropped_frame, face_xywh)
+                        pipeline.recognition_policy.observe(track_id, face_cropped, face_conf, current_time)
+
+                for (pipeline, captured_at, frame), tracks in zip(frames, moved_tracks):
+                    pipeline.submit_due_faces(current_time)
+                    detection_writer.put(pipeline.detection_rows(tracks, captured_at, frame.shape))
+
+                last_save_time = current_time  # Update the last save time
+                metrics.maybe_write(current_time)
+
+                # Send the processed frames
+                for pipeline, _, frame in frames:
+                    if not pipeline.client.send_frame(pipeline.processed_frame(frame)):
+                        print(f"Lost connection to server for camera {pipeline.camera_id}, attempting to reconnect...")
+                        if not await pipeline.client.connect():
+                            running = False
                             break
+
+                # Let the background recognition requests make progress even when inference takes a full frame slot
+                await asyncio.sleep(0)
+
+            for pipeline in pipelines:
+                await pipeline.recognition.close()
     except KeyboardInterrupt:
         print("\nShutting down client...")
-    finally:  
-        if data_batch:
-            save_detections(data_batch)
+    finally:
+        # Write what is still queued
+        detection_writer.close()
 
-        client.cleanup()
-        cap.release()
+        for pipeline in pipelines:
+            pipeline.close()
 
 if __name__ == '__main__':
     asyncio.run(main())
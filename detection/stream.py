@@ -1,61 +1,81 @@
-import time
 import socket
 import numpy as np
 import cv2
-from utils import ImprovedStreamServer, StreamServer
-from flask import Flask, Response
+from utils import FrameBroadcaster, read_metrics, get_raw_stream_server, get_stream_server, CAMERA_IDS, CAMERA_LINKS, STREAM_BASE_PORT
+from flask import Flask, Response, abort, jsonify, request
 
 # Flask application
 app = Flask(__name__)
-server = ImprovedStreamServer()
+
+# One frame server per camera handled by the worker, reading what the pipelines of process_frame.py send
+servers = {
+    camera_id: get_stream_server(camera_id, STREAM_BASE_PORT + i)
+    for i, camera_id in enumerate(CAMERA_IDS)
+}
+# Every viewer of a camera gets the same encoded frames from its broadcaster
+broadcasters = {camera_id: FrameBroadcaster(server) for camera_id, server in servers.items()}
+
+# Raw viewers share the camera frames decoded by process_frame.py instead of opening a camera connection each,
+# a shared capture is released by the broadcaster once its last viewer leaves
+raw_servers = {
+    camera_id: get_raw_stream_server(camera_id, camera_link)
+    for camera_id, camera_link in zip(CAMERA_IDS, CAMERA_LINKS)
+}
+raw_broadcasters = {
+    camera_id: FrameBroadcaster(server, on_idle=getattr(server, 'close', None))
+    for camera_id, server in raw_servers.items()
+}
+
+# Shown while a camera has no frames yet
+_, default_image = cv2.imencode(".jpg", np.zeros((480, 640, 3), dtype=np.uint8))
+DEFAULT_FRAME_BYTES = default_image.tobytes()
 
 @app.route('/video_feed')
-def video_feed():
+@app.route('/video_feed/<int:camera_id>')
+def video_feed(camera_id=None):
+    # Without a camera id serve the first camera of the worker
+    broadcaster = broadcasters.get(CAMERA_IDS[0] if camera_id is None else camera_id)
+    if broadcaster is None:
+        abort(404)
+
+    # Optional per viewer frame rate, e.g. /video_feed/1?fps=5
+    fps = request.args.get('fps', type=float)
+
     def generate():
-        while True:
-            frame = server.get_frame()
-            if frame is not None:
-                _, encoded_image = cv2.imencode(".jpg", frame)
-                frame_bytes = encoded_image.tobytes()
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-            else:
+        for frame_bytes in broadcaster.frames(fps=fps):
+            if frame_bytes is None:
                 # Provide a default frame
-                default_frame = np.zeros((480, 640, 3), dtype=np.uint8)
-                _, encoded_image = cv2.imencode(".jpg", default_frame)
-                frame_bytes = encoded_image.tobytes()
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-                time.sleep(0.1)
+                frame_bytes = DEFAULT_FRAME_BYTES
+            yield (b'--frame\r\n'
+                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
 
     return Response(generate(), mimetype="multipart/x-mixed-replace; boundary=frame")
 
 @app.route('/video_feed_raw')
-def video_feed_raw():
-    from utils import open_camera, CAMERA_LINK  # Import here to avoid circular import
+@app.route('/video_feed_raw/<int:camera_id>')
+def video_feed_raw(camera_id=None):
+    broadcaster = raw_broadcasters.get(CAMERA_IDS[0] if camera_id is None else camera_id)
+    if broadcaster is None:
+        abort(404)
 
-    # Open a separate camera stream for raw feed
-    raw_cap = open_camera(CAMERA_LINK)
+    fps = request.args.get('fps', type=float)
 
     def generate():
-        while True:
-            frame = raw_cap.read()
-            if frame is not None:
-                _, encoded_image = cv2.imencode(".jpg", frame)
-                frame_bytes = encoded_image.tobytes()
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-            else:
+        for frame_bytes in broadcaster.frames(fps=fps):
+            if frame_bytes is None:
                 # Provide a default frame
-                default_frame = np.zeros((480, 640, 3), dtype=np.uint8)
-                _, encoded_image = cv2.imencode(".jpg", default_frame)
-                frame_bytes = encoded_image.tobytes()
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-                time.sleep(0.1)
+                frame_bytes = DEFAULT_FRAME_BYTES
+            yield (b'--frame\r\n'
+                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
 
     return Response(generate(), mimetype="multipart/x-mixed-replace; boundary=frame")
 
+@app.route('/metrics')
+def metrics():
+    # Inference and motion gate counters written by process_frame.py
+    return jsonify(read_metrics())
+
 if __name__ == '__main__':
-    server.start_receiving()  # Start receiving frames in background thread
+    for server in servers.values():
+        server.start_receiving()  # Start receiving frames in background threads
     app.run(host='0.0.0.0', port=5000, debug=False, use_reloader=False)
@@ -0,0 +1,302 @@
+"""
+Tests of the detection worker building blocks, run inside the detection container: python -m unittest tests
+"""
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+from threading import Event, Thread
+from unittest import mock
+
+import numpy as np
+
+from utils import (
+    SAVE_FAILED, SAVE_OK, SAVE_REJECTED, DetectionRegion, DetectionWriter, MotionGate, RecognitionDispatcher,
+    SharedFrameRing, TrackRecognitionPolicy,
+)
+
+
+def face(height, width):
+    return np.zeros((height, width, 3), dtype=np.uint8)
+
+
+class TrackRecognitionPolicyTests(unittest.TestCase):
+    def setUp(self):
+        self.policy = TrackRecognitionPolicy(window=0.5, backoff_base=1.0, backoff_max=4.0)
+
+    def test_best_face_of_the_window_is_sent_when_it_closes(self):
+        small, large, blurry = face(20, 20), face(40, 40), face(60, 60)
+        self.policy.observe(1, small, 0.9, now=0.0)
+        self.policy.observe(1, large, 0.9, now=0.1)
+        # Larger but with a much lower confidence, scores below the 40x40 crop
+        self.policy.observe(1, blurry, 0.3, now=0.2)
+
+        self.assertEqual(self.policy.due_faces(now=0.4), {})
+        self.assertIs(self.policy.due_faces(now=0.5)[1], large)
+
+    def test_no_faces_collected_while_awaiting_the_result(self):
+        self.policy.observe(1, face(20, 20), 0.9, now=0.0)
+        self.policy.mark_sent([1], now=0.5)
+
+        self.assertFalse(self.policy.wants_face(1, now=1.0))
+        self.policy.observe(1, face(40, 40), 0.9, now=1.0)
+        self.assertEqual(self.policy.due_faces(now=2.0), {})
+
+    def test_lost_result_stops_blocking_after_backoff_max(self):
+        self.policy.observe(1, face(20, 20), 0.9, now=0.0)
+        self.policy.mark_sent([1], now=0.5)
+
+        self.assertFalse(self.policy.wants_face(1, now=4.4))
+        self.assertTrue(self.policy.wants_face(1, now=4.5))
+
+    def test_unrecognized_results_back_off_exponentially_up_to_the_cap(self):
+        delays = []
+        now = 0.0
+        for _ in range(5):
+            self.policy.observe(1, face(20, 20), 0.9, now=now)
+            now += 0.5
+            self.policy.mark_sent(self.policy.due_faces(now), now=now)
+            self.policy.record_result(1, False, now)
+            next_attempt = self.policy.states[1].next_attempt_time
+            delays.append(next_attempt - now)
+            self.assertFalse(self.policy.wants_face(1, now=next_attempt - 0.01))
+            self.assertTrue(self.policy.wants_face(1, now=next_attempt))
+            now = next_attempt
+
+        self.assertEqual(delays, [1.0, 2.0, 4.0, 4.0, 4.0])
+
+    def test_failed_request_retries_soon_without_counting_an_attempt(self):
+        self.policy.observe(1, face(20, 20), 0.9, now=0.0)
+        self.policy.mark_sent([1], now=0.5)
+        self.policy.record_error(1, now=0.6)
+
+        self.assertEqual(self.policy.states[1].attempts, 0)
+        self.assertFalse(self.policy.wants_face(1, now=1.5))
+        self.assertTrue(self.policy.wants_face(1, now=1.6))
+
+        # The next unrecognized result still starts at backoff_base
+        self.policy.observe(1, face(20, 20), 0.9, now=1.6)
+        self.policy.mark_sent([1], now=2.1)
+        self.policy.record_result(1, False, now=2.2)
+        self.assertEqual(self.policy.states[1].next_attempt_time, 3.2)
+
+    def test_recognized_and_forgotten_tracks_drop_their_state(self):
+        self.policy.observe(1, face(20, 20), 0.9, now=0.0)
+        self.policy.observe(2, face(20, 20), 0.9, now=0.0)
+        self.policy.mark_sent([1, 2], now=0.5)
+
+        self.policy.record_result(1, True, now=0.6)
+        self.policy.forget(2)
+        self.assertEqual(self.policy.states, {})
+        self.assertTrue(self.policy.wants_face(1, now=0.6))
+
+        # A late result of a forgotten track is ignored
+        self.policy.record_result(2, False, now=0.7)
+        self.assertEqual(self.policy.states, {})
+
+
+class RecognitionDispatcherTests(unittest.TestCase):
+    def dispatch(self, results):
+        recognized, failed = [], []
+        dispatcher = RecognitionDispatcher(
+            None, "http://recognition", lambda track_id, *result: recognized.append(track_id), failed.append
+        )
+
+        async def run():
+            with mock.patch("utils.send_frames_for_recognition", return_value=results):
+                dispatcher.submit({1: face(20, 20), 2: face(20, 20)})
+                await dispatcher.close()
+
+        asyncio.run(run())
+        self.assertFalse(dispatcher.pending_tracks)
+        return recognized, failed
+
+    def test_results_are_reported_to_on_result(self):
+        self.assertEqual(self.dispatch([(0.2, 5, True), (None, None, None)]), ([1, 2], []))
+
+    def test_failed_request_is_reported_to_on_error(self):
+        self.assertEqual(self.dispatch(None), ([], [1, 2]))
+
+
+class SharedFrameRingTests(unittest.TestCase):
+    def setUp(self):
+        self.name = f"test_frame_ring_{os.getpid()}"
+        self.writer = SharedFrameRing(self.name, create=True, slots=3, slot_size=64 * 48 * 3)
+        self.addCleanup(self.writer.close)
+        self.reader = SharedFrameRing(self.name, slots=3)
+        self.addCleanup(self.reader.close)
+
+    def frame(self, value):
+        return np.full((48, 64, 3), value % 256, dtype=np.uint8)
+
+    def test_latest_frame_round_trip(self):
+        self.assertIsNone(self.reader.read_latest())
+
+        for value in range(1, 6):
+            self.assertTrue(self.writer.write_frame(self.frame(value)))
+
+        frame_number, kind, data = self.reader.read_latest()
+        self.assertEqual((frame_number, kind), (5, SharedFrameRing.KIND_RAW))
+        np.testing.assert_array_equal(data, self.frame(5))
+        self.assertIsNone(self.reader.read_latest(after=5))
+
+    def test_too_big_frames_are_sent_as_jpeg(self):
+        big = np.zeros((96, 128, 3), dtype=np.uint8)
+        self.assertTrue(self.writer.write_frame(big))
+        _, kind, data = self.reader.read_latest()
+        self.assertEqual(kind, SharedFrameRing.KIND_JPEG)
+        self.assertIsInstance(data, bytes)
+
+    def test_slot_being_written_is_not_read(self):
+        self.writer.write_frame(self.frame(1))
+        offset = self.writer._slot_offset(1)
+        header = list(SharedFrameRing.SLOT_HEADER.unpack_from(self.writer.shm.buf, offset))
+
+        # Odd sequence: the writer is in the middle of this slot
+        header[0] = 2 * 1 - 1
+        SharedFrameRing.SLOT_HEADER.pack_into(self.writer.shm.buf, offset, *header)
+        self.assertIsNone(self.reader.read_latest())
+
+    def test_concurrent_reads_are_never_torn(self):
+        stop = Event()
+
+        def write():
+            value = 0
+            while not stop.is_set():
+                value += 1
+                self.writer.write_frame(self.frame(value))
+
+        writer = Thread(target=write, daemon=True)
+        writer.start()
+        self.addCleanup(writer.join)
+        self.addCleanup(stop.set)
+
+        reads = 0
+        while reads < 2000:
+            latest = self.reader.read_latest()
+            if latest is None:
+                continue
+            frame_number, _, data = latest
+            # Every frame is filled with its own number, a torn copy mixes two of them
+            self.assertTrue((data == frame_number % 256).all(), f"torn read of frame {frame_number}")
+            reads += 1
+
+
+class DetectionRegionTests(unittest.TestCase):
+    # Right half of a 1920x1080 reference frame without its top right quarter, decoded at 960x540
+    ROI = [[[960, 0], [1920, 0], [1920, 1080], [960, 1080]]]
+    EXCLUSION = [[[1440, 0], [1920, 0], [1920, 540], [1440, 540]]]
+
+    def test_whole_frame_without_polygons(self):
+        region = DetectionRegion()
+        frame = np.zeros((540, 960, 3), dtype=np.uint8)
+        self.assertEqual(region.crop(frame).shape, frame.shape)
+        self.assertIsNone(region.mask_for((540, 960)))
+        self.assertTrue(region.contains(np.array([[900.0, 500.0, 10.0, 10.0]])).all())
+
+    def test_crop_is_the_scaled_roi_bounding_rectangle(self):
+        region = DetectionRegion(self.ROI, reference_size=(1920, 1080))
+        crop = region.crop(np.zeros((540, 960, 3), dtype=np.uint8))
+        self.assertEqual(crop.shape[:2], (540, 480))
+
+        # Boxes found in the crop are moved back to frame coordinates
+        boxes = region.to_frame(np.array([[100.0, 100.0, 10.0, 10.0]]))
+        np.testing.assert_array_equal(boxes, [[580.0, 100.0, 10.0, 10.0]])
+
+    def test_boxes_outside_the_roi_or_inside_an_exclusion_are_dropped(self):
+        region = DetectionRegion(self.ROI, self.EXCLUSION, reference_size=(1920, 1080))
+        region.crop(np.zeros((540, 960, 3), dtype=np.uint8))
+
+        boxes = np.array([
+            [800.0, 100.0, 10.0, 10.0], # excluded
+            [600.0, 400.0, 10.0, 10.0], # inside
+            [100.0, 400.0, 10.0, 10.0], # outside the ROI
+        ])
+        np.testing.assert_array_equal(region.contains(boxes), [False, True, False])
+
+    def test_mask_scales_to_any_resolution(self):
+        region = DetectionRegion(self.ROI, self.EXCLUSION, reference_size=(1920, 1080))
+        mask = region.mask_for((90, 160))
+        self.assertEqual(mask.shape, (90, 160))
+        self.assertEqual(mask[20, 140], 0)
+        self.assertEqual(mask[70, 140], 255)
+        self.assertEqual(mask[70, 20], 0)
+
+
+class MotionGateTests(unittest.TestCase):
+    EXCLUSION = [[[0, 0], [960, 0], [960, 1080], [0, 1080]]]
+
+    def setUp(self):
+        region = DetectionRegion(exclusion_polygons=self.EXCLUSION, reference_size=(1920, 1080))
+        self.gate = MotionGate(region, method="diff", hold=1.0)
+        self.background = np.zeros((540, 960, 3), dtype=np.uint8)
+
+    def with_square(self, x, y):
+        frame = self.background.copy()
+        frame[y:y + 100, x:x + 100] = 255
+        return frame
+
+    def test_first_frame_counts_as_motion_then_holds(self):
+        self.assertTrue(self.gate.has_motion(self.background, now=0.0))
+        self.assertTrue(self.gate.has_motion(self.background, now=1.0))
+        self.assertFalse(self.gate.has_motion(self.background, now=1.5))
+
+    def test_motion_inside_the_region(self):
+        self.gate.has_motion(self.background, now=0.0)
+        self.assertFalse(self.gate.has_motion(self.background, now=5.0))
+        self.assertTrue(self.gate.has_motion(self.with_square(700, 200), now=6.0))
+
+    def test_motion_in_an_exclusion_is_ignored(self):
+        self.gate.has_motion(self.background, now=0.0)
+        self.assertFalse(self.gate.has_motion(self.with_square(100, 200), now=5.0))
+
+
+class DetectionWriterTests(unittest.TestCase):
+    def setUp(self):
+        self.spill_dir = tempfile.mkdtemp()
+        self.writer = DetectionWriter(spill_dir=self.spill_dir)
+        self.saved = []
+
+    def store(self, rows):
+        # Row 3 belongs to a deleted user, every batch with it is refused
+        if 3 in rows:
+            return SAVE_REJECTED
+        self.saved.extend(rows)
+        return SAVE_OK
+
+    def spilled(self, suffix):
+        rows = []
+        for name in sorted(os.listdir(self.spill_dir)):
+            if name.endswith(suffix):
+                with open(os.path.join(self.spill_dir, name)) as spill_file:
+                    rows.extend(json.loads(line) for line in spill_file)
+        return rows
+
+    def test_only_refused_rows_of_a_batch_are_quarantined(self):
+        with mock.patch("utils.store_detections", side_effect=self.store):
+            self.assertEqual(self.writer._write_batch(list(range(8))), [])
+
+        self.assertEqual(sorted(self.saved), [0, 1, 2, 4, 5, 6, 7])
+        self.assertEqual(self.spilled(".failed"), [3])
+        self.assertEqual(self.writer.metrics()["rejected_rows"], 1)
+
+    def test_replayed_file_keeps_the_rows_left_when_the_database_goes_away(self):
+        self.writer._spill(list(range(8)))
+
+        def store(rows):
+            # The database goes away before the second half is written
+            if 6 in rows and 3 not in rows:
+                return SAVE_FAILED
+            return self.store(rows)
+
+        with mock.patch("utils.store_detections", side_effect=store):
+            self.assertFalse(self.writer._replay_spilled())
+
+        self.assertEqual(self.saved, [0, 1, 2])
+        self.assertEqual(self.spilled(".failed"), [3])
+        self.assertEqual(self.spilled(".jsonl"), [4, 5, 6, 7])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,14 +1,19 @@
 import asyncio
+from datetime import datetime
+import io
 import json
+from multiprocessing import resource_tracker, shared_memory
 import os
-from queue import Queue
+from queue import Empty, Full, Queue
 import signal
 import socket
+import struct
 import sys
-from threading import Lock, Thread
+from threading import Condition, Lock, Thread
 import time
 import cv2
 import numpy as np
+import psycopg2
 from psycopg2 import pool
 import requests
 import torch
@@ -21,13 +26,47 @@ BATCH_SIZE = int(os.getenv("BATCH_SIZE"))
 TRACKING_MODEL = os.getenv("TRACKING_MODEL")
 FACE_DETECTION_MODEL = os.getenv("FACE_DETECTION_MODEL")
 CAMERA_ID = int(os.getenv("CAMERA_ID"))
+# Multi-camera worker: JSON lists with the links and ids of all cameras handled by this container,
+# defaults to the single CAMERA_LINK/CAMERA_ID camera
+CAMERA_LINKS = json.loads(os.getenv("CAMERA_LINKS") or "null") or [CAMERA_LINK]
+CAMERA_IDS = [int(camera_id) for camera_id in (json.loads(os.getenv("CAMERA_IDS") or "null") or [CAMERA_ID])]
+CAMERA_SUB_LINKS = json.loads(os.getenv("CAMERA_SUB_LINKS") or "null") or [None] * len(CAMERA_LINKS) # low resolution sub-streams used for inference, None to use the main stream
+CAMERA_REFERENCE_SIZES = json.loads(os.getenv("CAMERA_REFERENCE_SIZES") or "null") or [[1920, 1080]] * len(CAMERA_LINKS) # (width, height) detections are stored in
+CAMERA_ROI_POLYGONS = json.loads(os.getenv("CAMERA_ROI_POLYGONS") or "null") or [None] * len(CAMERA_LINKS) # polygons (reference resolution) people are detected in, None for the whole frame
+CAMERA_EXCLUSION_POLYGONS = json.loads(os.getenv("CAMERA_EXCLUSION_POLYGONS") or "null") or [None] * len(CAMERA_LINKS) # polygons (reference resolution) whose detections are dropped, e.g. posters and monitors
+STREAM_BASE_PORT = int(os.getenv("STREAM_BASE_PORT", "12346")) # frame transport port of the first camera, +1 for every next camera
+STREAM_TRANSPORT = os.getenv("STREAM_TRANSPORT", "shm").lower() # "shm" shared memory ring buffer or "socket" for the JPEG over TCP transport
+STREAM_PASS_JPEG = os.getenv("STREAM_PASS_JPEG", "false").lower() in ['true', '1', 'yes'] # send JPEG encoded frames through the ring instead of raw pixels
+STREAM_RING_SLOTS = int(os.getenv("STREAM_RING_SLOTS", "3")) # frames kept in the shared memory ring
+STREAM_MAX_FPS = float(os.getenv("STREAM_MAX_FPS", "15")) # upper bound of the frame rate sent to a single /video_feed viewer
+STREAM_MAX_FRAME_BYTES = int(os.getenv("STREAM_MAX_FRAME_BYTES", str(1920 * 1080 * 3))) # size of a ring slot, bigger raw frames are sent as JPEG
 FACE_SIMILARITY_THRESHOLD = float(os.getenv("FACE_SIMILARITY_THRESHOLD"))
 FACE_DETECTION_THRESHOLD = float(os.getenv("FACE_DETECTION_THRESHOLD"))
 PERSON_DETECTION_THRESHOLD = float(os.getenv("PERSON_DETECTION_THRESHOLD"))
 FACE_SIMILARITY_REQUEST_LINK =  os.getenv("FACE_SIMILARITY_REQUEST_LINK") # closest embedding request address
 FACE_SIMILARITY_REQUEST_LINK =  "http://host.docker.internal:8000/face_recognition/api/recognize/"
+FACE_SIMILARITY_BATCH_REQUEST_LINK = os.getenv("FACE_SIMILARITY_BATCH_REQUEST_LINK", "http://host.docker.internal:8000/face_recognition/api/recognize_batch/")
+RECOGNITION_PRECROPPED = os.getenv("RECOGNITION_PRECROPPED", "true").lower() in ['true', '1', 'yes'] # faces are already cropped by face_model, skip MTCNN on the server
 FPS = int(os.getenv("FPS"))
+RECOGNITION_MAX_IN_FLIGHT = int(os.getenv("RECOGNITION_MAX_IN_FLIGHT", "4")) # max concurrent recognition requests
+RECOGNITION_WINDOW = float(os.getenv("RECOGNITION_WINDOW", "0.5")) # seconds spent collecting face crops of a track before sending the best one
+RECOGNITION_BACKOFF_BASE = float(os.getenv("RECOGNITION_BACKOFF_BASE", "1.0")) # first delay after an unrecognized attempt, doubled every attempt
+RECOGNITION_BACKOFF_MAX = float(os.getenv("RECOGNITION_BACKOFF_MAX", "30.0")) # upper bound for the delay between attempts
+FACE_DETECTION_IMGSZ = int(os.getenv("FACE_DETECTION_IMGSZ", "320")) # side of the letterboxed square person crops are batched into for face detection
 TIME_PER_FRAME = 1.0 / FPS
+DECODE_SCALE = float(os.getenv("DECODE_SCALE", "1.0")) # downscale factor applied to decoded frames, 0.5 halves both sides
+DECODE_SKIP_FRAMES = os.getenv("DECODE_SKIP_FRAMES", "true").lower() in ['true', '1', 'yes'] # only decode as many frames as FPS, grab and drop the rest
+MOTION_GATE = os.getenv("MOTION_GATE", "true").lower() in ['true', '1', 'yes'] # skip the tracking model for cameras without motion and without tracks
+MOTION_METHOD = os.getenv("MOTION_METHOD", "diff").lower() # "diff" frame differencing or "mog2" background subtraction
+MOTION_DOWNSCALE_WIDTH = int(os.getenv("MOTION_DOWNSCALE_WIDTH", "160")) # width of the frames motion is computed on
+MOTION_PIXEL_THRESHOLD = int(os.getenv("MOTION_PIXEL_THRESHOLD", "25")) # grey level change counting a pixel as changed
+MOTION_MIN_AREA = float(os.getenv("MOTION_MIN_AREA", "0.002")) # fraction of changed ROI pixels counting as motion
+MOTION_HOLD = float(os.getenv("MOTION_HOLD", "2.0")) # seconds inference keeps running after the last motion
+DETECTION_FLUSH_INTERVAL = float(os.getenv("DETECTION_FLUSH_INTERVAL", "5")) # seconds after which queued detections are written even if BATCH_SIZE is not reached
+DETECTION_QUEUE_SIZE = int(os.getenv("DETECTION_QUEUE_SIZE", "50000")) # detection rows held in memory, the rest is spilled to disk
+DETECTION_SPILL_DIR = os.getenv("DETECTION_SPILL_DIR", "/tmp/detection_spill") # detection rows waiting for the database to come back
+METRICS_PATH = os.getenv("METRICS_PATH", "/tmp/detection_metrics.json") # written by process_frame.py, served by stream.py at /metrics
+METRICS_INTERVAL = float(os.getenv("METRICS_INTERVAL", "10")) # seconds between metrics file updates
 
 # Database connection settings from .env
 DB_SETTINGS = {
@@ -38,13 +77,60 @@ DB_SETTINGS = {
     "password": os.getenv("PGVECTOR_DB_PASSWORD"),
 }
 
-# Create a connection pool
-DB_POOL = pool.SimpleConnectionPool(
+# Create a connection pool, shared by the main loop, the detection writer and the settings listener threads
+DB_POOL = pool.ThreadedConnectionPool(
     minconn=1,
     maxconn=10,
     **DB_SETTINGS
 )
 
+class LiveThresholds:
+    """
+    Detection thresholds that follow the management settings without restarting the container.
+    Start with the values of the environment, reload() reads them again from management_setting.
+    """
+    # Setting key -> attribute
+    SETTING_KEYS = {
+        'faceSimilarityTresholdTracking': 'face_similarity',
+        'faceDetectionTresholdTracking': 'face_detection',
+        'personDetectionTresholdTracking': 'person_detection',
+    }
+
+    def __init__(self):
+        self.face_similarity = FACE_SIMILARITY_THRESHOLD
+        self.face_detection = FACE_DETECTION_THRESHOLD
+        self.person_detection = PERSON_DETECTION_THRESHOLD
+
+    def reload(self, keys=None):
+        """Re-read the thresholds, keys is the set of changed settings (None for all)."""
+        if keys is not None and not keys & self.SETTING_KEYS.keys():
+            return
+
+        conn = DB_POOL.getconn()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "SELECT key, value FROM management_setting WHERE key IN %s",
+                    (tuple(self.SETTING_KEYS),)
+                )
+                rows = cursor.fetchall()
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(f"Error reloading threshold settings: {e}")
+            return
+        finally:
+            DB_POOL.putconn(conn)
+
+        for key, value in rows:
+            try:
+                setattr(self, self.SETTING_KEYS[key], float(value))
+            except ValueError:
+                print(f"Ignoring invalid value {value!r} of setting {key}")
+
+# Read on every frame, updated by the settings listener started in process_frame.py
+thresholds = LiveThresholds()
+
 # config values for BOTSORT
 class BotsortArgs:
     def __init__(self):
@@ -66,15 +152,15 @@ class TrackUpdate:
         self.conf = conf
         self.cls = cls
 
-# Dictionary to hold STrack ID and associated face embeddings
-track_user_ids = {}
+# BOTSORT update without detections, lets tracks age out when the tracking model was skipped or found nobody
+EMPTY_TRACK_UPDATE = TrackUpdate(np.empty((0, 4), dtype=np.float32), np.empty(0, dtype=np.float32), np.empty(0, dtype=np.float32))
 
-# New dictionary to store last known position
-last_position = {}  
+# Run on the GPU when there is one, CPU-only hosts fall back to the CPU
+DEVICE = 'cuda' if torch.cuda.is_available() else 'cpu'
 
-tracking_model = YOLO(TRACKING_MODEL, verbose=False).to('cuda')
-face_model = YOLO(FACE_DETECTION_MODEL, verbose=False).to('cuda')
-tracker = BOTSORT(BotsortArgs())  # Initialize the BOTSORT tracker
+# Models are shared by all cameras of the worker
+tracking_model = YOLO(TRACKING_MODEL, verbose=False).to(DEVICE)
+face_model = YOLO(FACE_DETECTION_MODEL, verbose=False).to(DEVICE)
 
 
 
@@ -83,42 +169,164 @@ def test_cuda():
     print(device)
 
 class VideoStream:
-    def __init__(self, link, frame_width, frame_height):
-        self.stream = cv2.VideoCapture(link)
-        self.lock = Lock()
+    """
+    Camera reader decoding frames in a background thread. Every decoded frame gets a monotonically increasing
+    sequence number and a capture timestamp so consumers can tell new frames from ones they already handled.
+    The camera is reopened with exponential backoff whenever the stream drops.
+
+    With target_fps, frames coming faster are only grabbed (demuxed) and dropped without being retrieved
+    (decoded and converted), decode_scale < 1 downscales the retrieved frames.
+    """
+    def __init__(self, link, frame_width, frame_height, reconnect_delay=1.0, max_reconnect_delay=30.0, target_fps=None, decode_scale=1.0):
+        self.link = link
+        self.frame_width = frame_width
+        self.frame_height = frame_height
+        self.min_frame_interval = 1.0 / target_fps if target_fps else 0.0 # frames arriving faster are grabbed but not decoded
+        self.decode_scale = decode_scale
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.lock = Condition()
         self.latest_frame = None
+        self.sequence = 0 # number of the latest frame, 0 before the first one
+        self.timestamp = None # time.time() when the latest frame was decoded
         self.stopped = False
+        self.listeners = [] # called with every decoded frame from the decode thread
+        self.stream = self._open()
 
-        if self.stream.isOpened():
-            self.stream.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # Minimize buffering
-            self.stream.set(cv2.CAP_PROP_FRAME_WIDTH, frame_width)
-            self.stream.set(cv2.CAP_PROP_FRAME_HEIGHT, frame_height)
+    def _open(self):
+        stream = cv2.VideoCapture(self.link)
+        if stream.isOpened():
+            stream.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # Minimize buffering
+            stream.set(cv2.CAP_PROP_FRAME_WIDTH, self.frame_width)
+            stream.set(cv2.CAP_PROP_FRAME_HEIGHT, self.frame_height)
+        return stream
 
     def start(self):
         Thread(target=self.update, args=(), daemon=True).start()
         return self
 
+    def _reconnect(self, delay):
+        """Wait `delay` seconds and reopen the camera, returns the delay for the next attempt."""
+        print(f"Camera stream {self.link} unavailable, reconnecting in {delay:.1f} seconds...")
+        self.stream.release()
+        time.sleep(delay)
+        if not self.stopped:
+            self.stream = self._open()
+        return min(delay * 2, self.max_reconnect_delay)
+
     def update(self):
+        delay = self.reconnect_delay
         while not self.stopped:
-            if self.stream.isOpened():
-                ret, frame = self.stream.read()
-                if ret:
-                    with self.lock:
-                        self.latest_frame = frame
+            if not self.stream.isOpened():
+                delay = self._reconnect(delay)
+                continue
+
+            if not self.stream.grab():
+                delay = self._reconnect(delay)
+                continue
+            delay = self.reconnect_delay
+
+            # Skip frames until the next one is due
+            if self.min_frame_interval and self.timestamp and time.time() - self.timestamp < self.min_frame_interval:
+                continue
+
+            ret, frame = self.stream.retrieve()
+            if not ret:
+                continue
+
+            if self.decode_scale < 1.0:
+                frame = cv2.resize(frame, None, fx=self.decode_scale, fy=self.decode_scale, interpolation=cv2.INTER_AREA)
+
+            with self.lock:
+                self.latest_frame = frame
+                self.sequence += 1
+                self.timestamp = time.time()
+                self.lock.notify_all()
+            for listener in list(self.listeners):
+                listener(frame)
 
     def read(self):
         with self.lock:
             return self.latest_frame
 
+    def read_new(self, after=0, timeout=None):
+        """
+        Wait for a frame newer than the sequence number `after`.
+
+        Args:
+            after: Sequence number of the last frame the caller handled
+            timeout: Seconds to wait, None waits until a frame arrives, 0 does not wait
+
+        Returns:
+            (sequence, timestamp, frame) of the latest frame or None if there was no new frame in time.
+        """
+        with self.lock:
+            if not self.lock.wait_for(lambda: self.sequence > after or self.stopped, timeout=timeout):
+                return None
+            if self.sequence <= after:
+                return None
+            return self.sequence, self.timestamp, self.latest_frame
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
     def stop(self):
         self.stopped = True
+        with self.lock:
+            self.lock.notify_all()
         self.stream.release()
 
-def open_camera(link, frame_width=640, frame_heigth=480):
-    video_stream = VideoStream(link, frame_width, frame_heigth)
+def open_camera(link, frame_width=640, frame_heigth=480, **options):
+    video_stream = VideoStream(link, frame_width, frame_heigth, **options)
     video_stream.start()
     return video_stream
 
+class CaptureRegistry:
+    """
+    Process-wide registry of reference counted VideoStreams, one decoder per camera link and decode options
+    no matter how many consumers (the processing loop, raw viewers) read from it.
+
+    Consumers asking for the same link with other options (target_fps, decode_scale, frame size) get their
+    own decoder, a shared one would hand them frames decoded for someone else.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.streams = {} # (link, frame size, options) -> VideoStream
+        self.ref_counts = {} # (link, frame size, options) -> number of consumers
+        self.keys = {} # id(VideoStream) -> (link, frame size, options)
+
+    def acquire(self, link, frame_width=640, frame_heigth=480, **options):
+        """Get the VideoStream of the link and decode options, opening the camera for the first consumer."""
+        key = (link, frame_width, frame_heigth, tuple(sorted(options.items())))
+        with self.lock:
+            if key not in self.streams:
+                video_stream = open_camera(link, frame_width, frame_heigth, **options)
+                self.streams[key] = video_stream
+                self.ref_counts[key] = 0
+                self.keys[id(video_stream)] = key
+            self.ref_counts[key] += 1
+            return self.streams[key]
+
+    def release(self, video_stream):
+        """Drop one consumer of an acquired VideoStream, the camera is closed when the last one leaves."""
+        with self.lock:
+            key = self.keys.get(id(video_stream))
+            if key is None:
+                return
+            self.ref_counts[key] -= 1
+            if self.ref_counts[key] > 0:
+                return
+            self.streams.pop(key)
+            self.ref_counts.pop(key)
+            self.keys.pop(id(video_stream))
+        video_stream.stop()
+
+capture_registry = CaptureRegistry()
+
 def cut_the_frame_from_bbox(frame, xywh):
     x, y, w, h = map(int, xywh)
     
@@ -134,35 +342,92 @@ def cut_the_frame_from_bbox(frame, xywh):
 
     return roi
 
+def letterbox(img, size, pad_value=114):
+    """
+    Resize an image to fit a size x size square keeping the aspect ratio and pad the rest.
+
+    Returns:
+        (padded image, scale, (pad_x, pad_y)) so boxes can be mapped back with (coord - pad) / scale.
+    """
+    height, width = img.shape[:2]
+    scale = min(size / height, size / width)
+    new_width, new_height = max(1, round(width * scale)), max(1, round(height * scale))
+
+    resized = cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+
+    pad_x = (size - new_width) // 2
+    pad_y = (size - new_height) // 2
+    padded = np.full((size, size, 3), pad_value, dtype=np.uint8)
+    padded[pad_y:pad_y + new_height, pad_x:pad_x + new_width] = resized
+
+    return padded, scale, (pad_x, pad_y)
+
+def detect_faces(imgs, face_model, threshold, imgsz=None):
+    """
+    Batched face detection over all person crops needing identification (of all cameras).
+
+    Every crop is letterboxed to the same imgsz x imgsz square so face_model runs a single batch,
+    the largest face above the threshold is then selected for all crops at once on the stacked box tensors.
+
+    Returns:
+        List with (xywh, confidence) of the largest face in crop coordinates for every crop, None where there is none.
+    """
+    if not imgs:
+        return []
+
+    imgsz = imgsz or FACE_DETECTION_IMGSZ
+    letterboxed = [letterbox(img, imgsz) for img in imgs]
+
+    results = face_model([padded for padded, _, _ in letterboxed], imgsz=imgsz, verbose=False)
+
+    # Stack the boxes of all crops as rows of (x1, y1, x2, y2, conf, cls) with the crop index next to them
+    boxes = torch.cat([result.boxes.data[:, :5] for result in results])
+    crop_indices = torch.cat([
+        torch.full((len(result.boxes),), i, dtype=torch.long, device=boxes.device)
+        for i, result in enumerate(results)
+    ])
+
+    faces = [None] * len(imgs)
+
+    confident = boxes[:, 4] >= threshold
+    boxes, crop_indices = boxes[confident], crop_indices[confident]
+    if not len(boxes):
+        return faces
+
+    # Largest face per crop: order by area descending, then keep the first row of every crop index
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    order = torch.argsort(areas, descending=True)
+    order = order[torch.argsort(crop_indices[order], stable=True)]
+    sorted_indices = crop_indices[order]
+    first = torch.ones_like(sorted_indices, dtype=torch.bool)
+    first[1:] = sorted_indices[1:] != sorted_indices[:-1]
+    selected = order[first]
+
+    # Map back from the letterboxed square to crop coordinates, one transfer to the host for all crops
+    selected_boxes = boxes[selected].cpu().numpy()
+    selected_crops = crop_indices[selected].cpu().numpy()
+    scales = np.array([scale for _, scale, _ in letterboxed], dtype=np.float32)[selected_crops]
+    pads = np.array([pad for _, _, pad in letterboxed], dtype=np.float32)[selected_crops]
+
+    x1 = (selected_boxes[:, 0] - pads[:, 0]) / scales
+    y1 = (selected_boxes[:, 1] - pads[:, 1]) / scales
+    x2 = (selected_boxes[:, 2] - pads[:, 0]) / scales
+    y2 = (selected_boxes[:, 3] - pads[:, 1]) / scales
+    xywh = np.stack([(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1], axis=1)
+
+    for crop_index, face_xywh, conf in zip(selected_crops, xywh, selected_boxes[:, 4]):
+        faces[crop_index] = (face_xywh, float(conf))
+
+    return faces
+
 def detect_face(img, face_model, threshold):
-    # Run the face detection model
-    result = face_model(img)
-    
-    largest_face = None
-    max_area = 0
-
-    # Iterate over all detected boxes
-    for box in result[0].boxes:
-        conf = box.conf.cpu().numpy()[0]
-        if conf < threshold:
-            continue
-
-        # Calculate the area of the bounding box
-        _, _, w, h = box.xywh[0].cpu().numpy()
-        area = w * h
-
-        # Update largest_face if this box has a larger area
-        if area > max_area:
-            max_area = area
-            largest_face = box
-
-    if largest_face:
-        # print(f"Largest face box: {largest_face}")
-        return largest_face
-    else:
+    """Single crop version of detect_faces, returns (xywh, confidence) of the largest face or None."""
+    largest_face = detect_faces([img], face_model, threshold)[0]
+
+    if largest_face is None:
         print("No face detected above the threshold.")
-        return None          
-    
+    return largest_face
+
 async def send_frame_for_recognition(frame, session, request_link):
     # Encode the frame to JPEG
     _, img_encoded = cv2.imencode('.jpg', frame)
@@ -176,6 +441,7 @@ async def send_frame_for_recognition(frame, session, request_link):
         filename='frame.jpg',
         content_type='image/jpeg'
     )
+    form.add_field('precropped', str(RECOGNITION_PRECROPPED).lower())
 
     try:
         async with session.post(request_link, data=form) as response:
@@ -197,6 +463,582 @@ async def send_frame_for_recognition(frame, session, request_link):
         print(f"Error sending frame: {e}")
         return None, None, None  
 
+async def send_frames_for_recognition(frames, session, request_link):
+    """
+    Send many face crops to the batch recognition endpoint in one multipart request.
+
+    Returns:
+        List of (distance, user_id, user_inside) tuples in the order of frames,
+        (None, None, None) for crops that were not recognized, None if the request failed.
+    """
+
+    form = aiohttp.FormData()
+    for i, frame in enumerate(frames):
+        _, img_encoded = cv2.imencode('.jpg', frame)
+        form.add_field(
+            name='files',
+            value=img_encoded.tobytes(),
+            filename=f'frame_{i}.jpg',
+            content_type='image/jpeg'
+        )
+    form.add_field('precropped', str(RECOGNITION_PRECROPPED).lower())
+
+    try:
+        async with session.post(request_link, data=form) as response:
+            if response.status == 200:
+                data = await response.json()
+                results = []
+                for item in data.get("results", []):
+                    distance = item.get("distance", None)
+                    user_id = item.get("user_id", None)
+                    user_inside = item.get("user_inside")
+                    print(f"face recognition distance: {distance} user_id: {user_id}")
+                    results.append((distance, user_id, user_inside))
+                if len(results) != len(frames):
+                    print(f"Error: Server returned {len(results)} results for {len(frames)} frames")
+                    return None
+                return results
+            else:
+                print(f"Error: Server returned status code {response.status}")
+                html_content = await response.text()
+                print(html_content)
+                return None
+    except Exception as e:
+        print(f"Error sending frames: {e}")
+        return None
+
+class RecognitionDispatcher:
+    """
+    Runs face recognition requests as background asyncio tasks so the frame loop never waits on HTTP.
+
+    - at most max_in_flight requests run at the same time, submissions over the limit are dropped
+      and simply retried on a later frame
+    - a track with a pending request is not submitted again until its result arrives
+    - on_result(track_id, distance, user_id, user_inside) is called as soon as each result arrives
+    - on_error(track_id) is called instead when the request failed (network or server error),
+      so a track is not taken for an unrecognized person just because the server could not answer
+    """
+    def __init__(self, session, request_link, on_result, on_error=None, max_in_flight=RECOGNITION_MAX_IN_FLIGHT):
+        self.session = session
+        self.request_link = request_link
+        self.on_result = on_result
+        self.on_error = on_error
+        self.max_in_flight = max_in_flight
+        self.pending_tracks = set()
+        self.tasks = set()
+
+    def is_pending(self, track_id):
+        return track_id in self.pending_tracks
+
+    def submit(self, faces_by_track):
+        """
+        Schedule recognition of {track_id: face_crop} in one batch request.
+        Returns False if nothing was scheduled.
+        """
+        faces = {track_id: face for track_id, face in faces_by_track.items() if track_id not in self.pending_tracks}
+        if not faces or len(self.tasks) >= self.max_in_flight:
+            return False
+
+        self.pending_tracks.update(faces)
+        task = asyncio.create_task(self._recognize(faces))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return True
+
+    def forget(self, track_id):
+        """Drop a removed track, a result arriving for it later is ignored."""
+        self.pending_tracks.discard(track_id)
+
+    async def _recognize(self, faces):
+        try:
+            results = await send_frames_for_recognition(list(faces.values()), self.session, self.request_link)
+            if results is None:
+                self._fail(faces)
+                return
+
+            for track_id, (distance, user_id, user_inside) in zip(faces, results):
+                if track_id not in self.pending_tracks:
+                    continue
+                self.pending_tracks.discard(track_id)
+                self.on_result(track_id, distance, user_id, user_inside)
+        except Exception as e:
+            print(f"Error in recognition task: {e}")
+            self._fail(faces)
+        finally:
+            self.pending_tracks.difference_update(faces)
+
+    def _fail(self, faces):
+        """Report the failed request to on_error for the tracks still waiting on it."""
+        for track_id in faces:
+            if track_id not in self.pending_tracks:
+                continue
+            self.pending_tracks.discard(track_id)
+            if self.on_error is not None:
+                self.on_error(track_id)
+
+    async def close(self):
+        """Wait for the requests that are still running."""
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+class TrackRecognitionState:
+    def __init__(self):
+        self.window_start = None
+        self.best_face = None
+        self.best_score = 0.0
+        self.attempts = 0
+        self.next_attempt_time = 0.0
+
+class TrackRecognitionPolicy:
+    """
+    Per-track state machine deciding when the face of an unidentified track is sent for recognition.
+
+    - collecting: for `window` seconds from the first face seen, only the best crop is kept
+      (face confidence x face area)
+    - awaiting: the best crop is sent once the window closes, at most one request per window,
+      no new faces are collected until the result arrives, or for backoff_max seconds if it never does
+      (request failed or dropped), so a lost result cannot block the track forever
+    - backoff: after an unrecognized result the next window opens after
+      backoff_base * 2 ** (attempts - 1) seconds, capped at backoff_max
+    - failed request: the next window opens after backoff_base seconds and the attempt is not counted,
+      so a server outage does not push tracks to backoff_max
+    """
+    def __init__(self, window=RECOGNITION_WINDOW, backoff_base=RECOGNITION_BACKOFF_BASE, backoff_max=RECOGNITION_BACKOFF_MAX):
+        self.window = window
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.states = {}
+
+    def wants_face(self, track_id, now):
+        """True if a face crop of the track is useful right now (worth running face detection)."""
+        state = self.states.get(track_id)
+        return state is None or now >= state.next_attempt_time
+
+    def observe(self, track_id, face, confidence, now):
+        """Offer a face crop of the track, kept if it is the best one of the current window."""
+        state = self.states.setdefault(track_id, TrackRecognitionState())
+        if now < state.next_attempt_time:
+            return
+
+        if state.window_start is None:
+            state.window_start = now
+
+        score = float(confidence) * face.shape[0] * face.shape[1]
+        if score > state.best_score:
+            state.best_face = face
+            state.best_score = score
+
+    def due_faces(self, now):
+        """Best crop of every track whose collection window has closed, as {track_id: face}."""
+        return {
+            track_id: state.best_face
+            for track_id, state in self.states.items()
+            if state.best_face is not None and now - state.window_start >= self.window
+        }
+
+    def mark_sent(self, track_ids, now):
+        """Close the windows of the sent tracks and wait for their results, at most backoff_max seconds."""
+        for track_id in track_ids:
+            state = self.states.get(track_id)
+            if state is None:
+                continue
+            state.window_start = None
+            state.best_face = None
+            state.best_score = 0.0
+            state.next_attempt_time = now + self.backoff_max
+
+    def record_result(self, track_id, recognized, now):
+        state = self.states.get(track_id)
+        if state is None:
+            return
+
+        if recognized:
+            self.states.pop(track_id)
+            return
+
+        state.attempts += 1
+        state.next_attempt_time = now + min(self.backoff_max, self.backoff_base * 2 ** (state.attempts - 1))
+
+    def record_error(self, track_id, now):
+        """The request of the track failed, try again soon without counting it as an attempt."""
+        state = self.states.get(track_id)
+        if state is None:
+            return
+        state.next_attempt_time = now + self.backoff_base
+
+    def forget(self, track_id):
+        self.states.pop(track_id, None)
+
+class MotionGate:
+    """
+    Cheap motion detection run before the tracking model, on small grey frames with frame differencing
+    (or MOG2 background subtraction), optionally restricted to the DetectionRegion of the camera
+    (ROI minus exclusions), so motion where no detection would be kept does not wake the model up.
+    """
+    def __init__(self, region=None, method=MOTION_METHOD, width=MOTION_DOWNSCALE_WIDTH,
+                 pixel_threshold=MOTION_PIXEL_THRESHOLD, min_area=MOTION_MIN_AREA, hold=MOTION_HOLD):
+        self.region = region
+        self.method = method
+        self.width = width
+        self.pixel_threshold = pixel_threshold
+        self.min_area = min_area
+        self.hold = hold
+        self.previous = None
+        self.mask = None
+        self.mask_area = 0
+        self.last_motion = None
+        self.subtractor = cv2.createBackgroundSubtractorMOG2(detectShadows=False) if method == "mog2" else None
+
+    def _prepare(self, frame):
+        height = max(1, round(frame.shape[0] * self.width / frame.shape[1]))
+        small = cv2.resize(frame, (self.width, height), interpolation=cv2.INTER_AREA)
+        grey = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(grey, (5, 5), 0)
+
+    def _build_mask(self, shape):
+        """Region mask at the motion resolution, None when motion is looked for in the whole frame."""
+        mask = self.region.mask_for(shape) if self.region is not None else None
+        if mask is None:
+            self.mask, self.mask_area = None, shape[0] * shape[1]
+            return
+
+        self.mask, self.mask_area = mask, max(1, cv2.countNonZero(mask))
+
+    def has_motion(self, frame, now):
+        """Whether there was motion in the ROI within the last `hold` seconds, the first frame always counts as motion."""
+        grey = self._prepare(frame)
+        if self.previous is None or self.previous.shape != grey.shape:
+            self._build_mask(grey.shape)
+
+        if self.subtractor is not None:
+            changed = self.subtractor.apply(grey)
+        elif self.previous is None or self.previous.shape != grey.shape:
+            changed = None
+        else:
+            _, changed = cv2.threshold(cv2.absdiff(grey, self.previous), self.pixel_threshold, 255, cv2.THRESH_BINARY)
+        self.previous = grey
+
+        if changed is None:
+            self.last_motion = now
+        else:
+            if self.mask is not None:
+                changed = cv2.bitwise_and(changed, self.mask)
+            if cv2.countNonZero(changed) / self.mask_area >= self.min_area:
+                self.last_motion = now
+
+        return self.last_motion is not None and now - self.last_motion <= self.hold
+
+class DetectionRegion:
+    """
+    ROI and exclusion polygons of a camera, given in the reference resolution and rasterised for the frame size in use.
+    The tracking model only sees the bounding rectangle of the ROI and person boxes whose center lies outside the ROI
+    or inside an exclusion polygon are dropped before tracking.
+    """
+    def __init__(self, roi_polygons=None, exclusion_polygons=None, reference_size=(1920, 1080)):
+        self.roi_polygons = roi_polygons or []
+        self.exclusion_polygons = exclusion_polygons or []
+        self.reference_width, self.reference_height = reference_size
+        self.shape = None
+        self.mask = None # 255 where detections are kept, None when everything is kept
+        self.bounds = None # (x1, y1, x2, y2) of the part of the frame inference runs on
+
+    def _scaled(self, polygons, shape):
+        scale = np.array([shape[1] / self.reference_width, shape[0] / self.reference_height], dtype=np.float32)
+        return [(np.asarray(polygon, dtype=np.float32) * scale).astype(np.int32) for polygon in polygons]
+
+    def mask_for(self, shape):
+        """The region (ROI minus exclusions) rasterised at shape, 255 inside, None when it is the whole frame."""
+        if not self.roi_polygons and not self.exclusion_polygons:
+            return None
+
+        if self.roi_polygons:
+            mask = np.zeros(shape, dtype=np.uint8)
+            cv2.fillPoly(mask, self._scaled(self.roi_polygons, shape), 255)
+        else:
+            mask = np.full(shape, 255, dtype=np.uint8)
+
+        if self.exclusion_polygons:
+            cv2.fillPoly(mask, self._scaled(self.exclusion_polygons, shape), 0)
+        return mask
+
+    def _build(self, shape):
+        self.shape = shape
+        height, width = shape
+        self.bounds = (0, 0, width, height)
+        self.mask = self.mask_for(shape)
+
+        if self.roi_polygons:
+            x, y, w, h = cv2.boundingRect(np.concatenate(self._scaled(self.roi_polygons, shape)))
+            x1, y1 = max(0, x), max(0, y)
+            self.bounds = (x1, y1, max(x1 + 1, min(width, x + w)), max(y1 + 1, min(height, y + h)))
+
+    def crop(self, frame):
+        """The part of the frame the tracking model runs on (a view, no copy)."""
+        if self.shape != frame.shape[:2]:
+            self._build(frame.shape[:2])
+        x1, y1, x2, y2 = self.bounds
+        return frame[y1:y2, x1:x2]
+
+    def to_frame(self, xywh):
+        """Shift xywh boxes from crop to frame coordinates in place."""
+        xywh[:, 0] += self.bounds[0]
+        xywh[:, 1] += self.bounds[1]
+        return xywh
+
+    def contains(self, xywh):
+        """Boolean array, True for boxes (frame coordinates) whose center is inside the active region."""
+        if self.mask is None:
+            return np.ones(len(xywh), dtype=bool)
+        height, width = self.mask.shape
+        x = np.clip(xywh[:, 0].astype(np.int32), 0, width - 1)
+        y = np.clip(xywh[:, 1].astype(np.int32), 0, height - 1)
+        return self.mask[y, x] > 0
+
+class InferenceMetrics:
+    """
+    Per camera counters of processed frames and tracking model calls, periodically written as JSON
+    to METRICS_PATH for stream.py to serve.
+    """
+    def __init__(self, camera_ids, path=METRICS_PATH, interval=METRICS_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.started = time.time()
+        self.last_write = 0.0
+        self.frames = {camera_id: 0 for camera_id in camera_ids}
+        self.inferences = {camera_id: 0 for camera_id in camera_ids}
+        self.sources = {} # name -> callable returning a dict of extra metrics
+
+    def add_source(self, name, source):
+        self.sources[name] = source
+
+    def record(self, camera_id, inferred):
+        self.frames[camera_id] += 1
+        if inferred:
+            self.inferences[camera_id] += 1
+
+    def snapshot(self):
+        hours = max(time.time() - self.started, 1.0) / 3600
+        return {
+            "uptime_seconds": round(time.time() - self.started, 1),
+            "cameras": {
+                str(camera_id): {
+                    "frames": frames,
+                    "inferences": self.inferences[camera_id],
+                    "skipped": frames - self.inferences[camera_id],
+                    "skip_ratio": round((frames - self.inferences[camera_id]) / frames, 4) if frames else 0.0,
+                    "inferences_per_hour": round(self.inferences[camera_id] / hours, 1),
+                }
+                for camera_id, frames in self.frames.items()
+            },
+            **{name: source() for name, source in self.sources.items()},
+        }
+
+    def maybe_write(self, now):
+        if now - self.last_write < self.interval:
+            return
+        self.last_write = now
+        try:
+            # Write and rename so stream.py never reads a half written file
+            temporary_path = f"{self.path}.tmp"
+            with open(temporary_path, "w") as metrics_file:
+                json.dump(self.snapshot(), metrics_file)
+            os.replace(temporary_path, self.path)
+        except OSError as e:
+            print(f"Error writing metrics: {e}")
+
+def read_metrics(path=METRICS_PATH):
+    try:
+        with open(path) as metrics_file:
+            return json.load(metrics_file)
+    except (OSError, ValueError):
+        return {}
+
+class CameraPipeline:
+    """
+    Per-camera state of a detection worker: video input, BOTSORT tracker, track identities,
+    recognition policy and output stream. A worker runs one pipeline per camera and batches
+    the model inference of all of them together.
+    """
+    def __init__(self, camera_id, camera_link, stream_port, sub_link=None, reference_size=(1920, 1080), roi_polygons=None,
+                 exclusion_polygons=None):
+        self.camera_id = camera_id
+        self.camera_link = camera_link
+        self.reference_width, self.reference_height = reference_size # detections are stored in this resolution
+
+        # Inference runs on the low resolution sub-stream when the camera has one, the main stream is then
+        # only decoded at FPS for high resolution person crops
+        target_fps = FPS if DECODE_SKIP_FRAMES else None
+        self.inference_link = sub_link or camera_link
+        self.cap = capture_registry.acquire(self.inference_link, target_fps=target_fps, decode_scale=DECODE_SCALE)
+        self.crop_cap = capture_registry.acquire(camera_link, target_fps=target_fps) if sub_link else None
+        self.region = DetectionRegion(roi_polygons, exclusion_polygons, reference_size)
+        self.motion_gate = MotionGate(self.region) if MOTION_GATE else None
+        self.frame_sequence = 0 # sequence number of the last camera frame processed
+        self.tracker = BOTSORT(BotsortArgs())
+        self.track_user_ids = {} # STrack ID -> recognized user ID
+        self.last_position = {} # STrack ID -> last known position
+        self.recognition_policy = TrackRecognitionPolicy()
+        self.recognition = None
+        self.client = get_stream_client(camera_id, stream_port)
+
+        # Raw frames for /video_feed_raw in stream.py, so viewers do not open their own camera connections.
+        # They come from the main stream when inference runs on the sub-stream, viewers get the camera's own resolution
+        self.raw_ring = None
+        self.raw_cap = self.crop_cap or self.cap
+        if STREAM_TRANSPORT == "shm":
+            self.raw_ring = SharedFrameRing(get_raw_frame_ring_name(camera_id), create=True)
+            self.raw_cap.add_listener(self.publish_raw_frame)
+
+    def publish_raw_frame(self, frame):
+        """Called by the decode thread with every camera frame, written only while a raw viewer is watching."""
+        if self.raw_ring.has_readers():
+            self.raw_ring.write_frame(frame)
+
+    def close(self):
+        if self.raw_ring:
+            self.raw_cap.remove_listener(self.publish_raw_frame)
+            self.raw_ring.close()
+            self.raw_ring = None
+        self.client.cleanup()
+        capture_registry.release(self.cap)
+        if self.crop_cap:
+            capture_registry.release(self.crop_cap)
+
+    def start_recognition(self, session):
+        self.recognition = RecognitionDispatcher(
+            session, FACE_SIMILARITY_BATCH_REQUEST_LINK, self.on_recognition_result, self.on_recognition_error
+        )
+
+    def on_recognition_result(self, track_id, distance, detected_id, user_inside):
+        """Called by the RecognitionDispatcher whenever a recognition result arrives."""
+        recognized = distance is not None and distance < thresholds.face_similarity and user_inside
+        if recognized:
+            self.track_user_ids[track_id] = detected_id
+        self.recognition_policy.record_result(track_id, recognized, time.time())
+
+    def on_recognition_error(self, track_id):
+        """Called by the RecognitionDispatcher when the recognition request of the track failed."""
+        self.recognition_policy.record_error(track_id, time.time())
+
+    def needs_inference(self, frame, now):
+        """Whether the tracking model has to run on the frame: always while tracks are alive, otherwise only on motion."""
+        if self.motion_gate is None:
+            return True
+        motion = self.motion_gate.has_motion(frame, now)
+        return motion or bool(self.tracker.tracked_stracks)
+
+    def update_tracker(self, result):
+        """Feed the person detections of a tracking_model result to the tracker, None when the model was skipped."""
+        if result is None:
+            self.tracker.update(EMPTY_TRACK_UPDATE)
+            self.forget_removed_tracks()
+            return
+
+        # Filter detections for people
+        person_indices = (result.boxes.cls == 0) & (result.boxes.conf > thresholds.person_detection)
+        filtered_boxes = result.boxes[person_indices]
+
+        # The model ran on the ROI crop, move the boxes back to frame coordinates and drop the ones outside the region
+        xywh = self.region.to_frame(filtered_boxes.xywh.cpu().numpy())
+        inside = self.region.contains(xywh)
+
+        if not inside.any():
+            self.tracker.update(EMPTY_TRACK_UPDATE)
+        else:
+            try:
+                track_update = TrackUpdate(xywh[inside], filtered_boxes.conf.cpu().numpy()[inside], filtered_boxes.cls.cpu().numpy()[inside])
+                self.tracker.update(track_update)
+            except IndexError:
+                print("index error")
+
+        self.forget_removed_tracks()
+
+    def forget_removed_tracks(self):
+        for track in self.tracker.removed_stracks:
+            self.recognition.forget(track.track_id)
+            self.recognition_policy.forget(track.track_id)
+            if track.track_id in self.track_user_ids:
+                self.track_user_ids.pop(track.track_id)
+
+    def moved_tracks(self):
+        """Tracks whose position changed since the last processed frame."""
+        moved = []
+        for track in self.tracker.tracked_stracks:
+            position = (float(track.xywh[0]), float(track.xywh[1]))
+
+            if track.track_id in self.last_position and self.last_position[track.track_id] == position:
+                continue
+
+            self.last_position[track.track_id] = position
+            moved.append(track)
+        return moved
+
+    def tracks_needing_face(self, tracks, now):
+        """Unidentified tracks the recognition policy currently wants a face crop of."""
+        return [
+            track for track in tracks
+            if track.track_id not in self.track_user_ids and self.recognition_policy.wants_face(track.track_id, now)
+        ]
+
+    def submit_due_faces(self, now):
+        # Send the best face of every track whose collection window closed in a single background request,
+        # track_user_ids is filled in by on_recognition_result when it completes
+        faces_to_recognize = self.recognition_policy.due_faces(now)
+        if faces_to_recognize and self.recognition.submit(faces_to_recognize):
+            self.recognition_policy.mark_sent(faces_to_recognize, now)
+
+    def read_new_frame(self):
+        """The latest camera frame if it was not processed yet, as (capture timestamp, frame), otherwise None."""
+        latest = self.cap.read_new(after=self.frame_sequence, timeout=0)
+        if latest is None:
+            return None
+        self.frame_sequence, captured_at, frame = latest
+        return captured_at, frame
+
+    def crop_source(self, frame):
+        """
+        Frame person crops are cut from: the latest high resolution main stream frame when inference runs on the sub-stream.
+
+        Returns:
+            (frame, scale) where scale maps xywh from the inference frame to the returned frame.
+        """
+        high_res_frame = self.crop_cap.read() if self.crop_cap else None
+        if high_res_frame is None:
+            return frame, np.ones(4, dtype=np.float32)
+
+        scale_x = high_res_frame.shape[1] / frame.shape[1]
+        scale_y = high_res_frame.shape[0] / frame.shape[0]
+        return high_res_frame, np.array([scale_x, scale_y, scale_x, scale_y], dtype=np.float32)
+
+    def detection_rows(self, tracks, captured_at=None, frame_shape=None):
+        """
+        Detection rows for save_detections, one per track, stamped with the capture time of the frame.
+        Coordinates are normalised from the inference frame (frame_shape) to the reference resolution of the camera.
+        """
+        timestamp = datetime.fromtimestamp(captured_at or time.time()).strftime("%Y-%m-%d %H:%M:%S")
+
+        scale_x = scale_y = 1.0
+        if frame_shape is not None:
+            scale_x = self.reference_width / frame_shape[1]
+            scale_y = self.reference_height / frame_shape[0]
+
+        return [
+            (
+                self.track_user_ids.get(track.track_id),
+                self.camera_id,
+                track.track_id,
+                timestamp,
+                float(track.xywh[0]) * scale_x,
+                float(track.xywh[1]) * scale_y,
+                float(track.xywh[2]) * scale_x,
+                float(track.xywh[3]) * scale_y,
+            )
+            for track in tracks
+        ]
+
+    def processed_frame(self, frame):
+        return visualize_tracks(frame, self.tracker.tracked_stracks, self.track_user_ids)
+
 def generate_frames(cap):
     """Generate frames for the video feed."""
     while True:
@@ -379,6 +1221,9 @@ class ImprovedStreamServer:
         self.server_socket = None
         self.client_socket = None
         self.frame_buffer = FrameBuffer()
+        self.frame_number = 0
+        self.jpeg = None
+        self.jpeg_number = 0
         self.running = True
         self.setup_socket()
         
@@ -432,6 +1277,7 @@ class ImprovedStreamServer:
                 np_arr = np.frombuffer(data, dtype=np.uint8)
                 frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
                 self.frame_buffer.put_frame(frame)
+                self.frame_number += 1
                 
             except Exception as e:
                 print(f"Error receiving frame: {e}")
@@ -441,6 +1287,21 @@ class ImprovedStreamServer:
     def get_frame(self):
         """Get the latest frame from the buffer"""
         return self.frame_buffer.get_latest_frame()
+
+    def get_latest_jpeg(self):
+        """Get (frame number, JPEG) of the latest frame, encoding every received frame at most once"""
+        frame_number = self.frame_number
+        if self.jpeg_number != frame_number:
+            frame = self.get_frame()
+            if frame is None:
+                return frame_number, None
+            self.jpeg = cv2.imencode('.jpg', frame)[1].tobytes()
+            self.jpeg_number = frame_number
+        return frame_number, self.jpeg
+
+    def get_jpeg(self):
+        """Get the latest frame JPEG encoded"""
+        return self.get_latest_jpeg()[1]
         
     def cleanup(self):
         self.running = False
@@ -449,7 +1310,426 @@ class ImprovedStreamServer:
         if self.server_socket:
             self.server_socket.close()
 
-def save_detections(data_batch):
+class SharedFrameRing:
+    """
+    Ring buffer of frames in a multiprocessing.shared_memory segment, written by process_frame.py
+    and read by stream.py in the same container without encoding, copying through sockets or decoding.
+
+    Layout: latest frame number (uint64) and last reader heartbeat (float64) followed by `slots` slots
+    of a header and `slot_size` bytes of data.
+    Every slot is guarded by a seqlock: its sequence is odd while the writer is filling it and
+    2 * frame number once it is complete, a reader retries if the sequence changed during its copy.
+    """
+    LATEST = struct.Struct("<Q")
+    HEARTBEAT = struct.Struct("<d")
+    HEARTBEAT_OFFSET = 8
+    HEADER_SIZE = 16
+    SLOT_HEADER = struct.Struct("<QB3xIIII") # sequence, kind, height, width, channels, length
+    SLOT_HEADER_SIZE = 32
+    KIND_RAW = 0
+    KIND_JPEG = 1
+
+    def __init__(self, name, create=False, slots=STREAM_RING_SLOTS, slot_size=STREAM_MAX_FRAME_BYTES):
+        self.name = name
+        self.created = create
+
+        if create:
+            size = self.HEADER_SIZE + slots * (self.SLOT_HEADER_SIZE + slot_size)
+            try:
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            except FileExistsError:
+                # Left over by a previous run of the writer
+                stale = shared_memory.SharedMemory(name=name)
+                stale.close()
+                stale.unlink()
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            self.shm.buf[:self.HEADER_SIZE] = bytes(self.HEADER_SIZE)
+            self.slots = slots
+            self.slot_size = slot_size
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            # Readers must not unlink the segment of the writer when they exit
+            try:
+                resource_tracker.unregister(self.shm._name, "shared_memory")
+            except Exception:
+                pass
+            self.slots = slots
+            self.slot_size = (self.shm.size - self.HEADER_SIZE) // slots - self.SLOT_HEADER_SIZE
+
+        self.frame_number = self.LATEST.unpack_from(self.shm.buf, 0)[0]
+
+    def _slot_offset(self, frame_number):
+        return self.HEADER_SIZE + (frame_number % self.slots) * (self.SLOT_HEADER_SIZE + self.slot_size)
+
+    def write(self, kind, data, shape=(0, 0, 0)):
+        """
+        Write a frame into the next slot.
+
+        Args:
+            kind: KIND_RAW for a uint8 image array, KIND_JPEG for encoded bytes
+            data: Image array or bytes
+            shape: (height, width, channels) of a raw frame
+
+        Returns:
+            False if the frame does not fit into a slot.
+        """
+        length = data.nbytes if isinstance(data, np.ndarray) else len(data)
+        if length > self.slot_size:
+            return False
+
+        frame_number = self.frame_number + 1
+        offset = self._slot_offset(frame_number)
+        data_offset = offset + self.SLOT_HEADER_SIZE
+        height, width, channels = shape
+
+        self.SLOT_HEADER.pack_into(self.shm.buf, offset, 2 * frame_number - 1, kind, height, width, channels, length)
+        if isinstance(data, np.ndarray):
+            np.ndarray(data.shape, dtype=np.uint8, buffer=self.shm.buf, offset=data_offset)[...] = data
+        else:
+            self.shm.buf[data_offset:data_offset + length] = data
+        self.SLOT_HEADER.pack_into(self.shm.buf, offset, 2 * frame_number, kind, height, width, channels, length)
+
+        self.LATEST.pack_into(self.shm.buf, 0, frame_number)
+        self.frame_number = frame_number
+        return True
+
+    def write_frame(self, frame, pass_jpeg=False):
+        """
+        Write an image into the ring, raw or JPEG encoded. Raw frames too big for a slot are sent as JPEG.
+
+        Returns:
+            False if the frame does not fit into a slot even as JPEG.
+        """
+        if not pass_jpeg and self.write(self.KIND_RAW, frame, frame.shape):
+            return True
+
+        _, encoded_frame = cv2.imencode('.jpg', frame)
+        return self.write(self.KIND_JPEG, encoded_frame.tobytes())
+
+    def touch(self):
+        """Called by readers, tells the writer somebody is still reading the ring."""
+        self.HEARTBEAT.pack_into(self.shm.buf, self.HEARTBEAT_OFFSET, time.time())
+
+    def has_readers(self, timeout=2.0):
+        """Whether a reader touched the ring during the last `timeout` seconds."""
+        return time.time() - self.HEARTBEAT.unpack_from(self.shm.buf, self.HEARTBEAT_OFFSET)[0] < timeout
+
+    def read_latest(self, after=0, retries=3):
+        """
+        Copy the latest complete frame out of the ring.
+
+        Returns:
+            (frame number, kind, data) with an image array for KIND_RAW and bytes for KIND_JPEG,
+            or None when there is no frame newer than `after`.
+        """
+        for _ in range(retries):
+            frame_number = self.LATEST.unpack_from(self.shm.buf, 0)[0]
+            if frame_number == 0 or frame_number <= after:
+                return None
+
+            offset = self._slot_offset(frame_number)
+            sequence, kind, height, width, channels, length = self.SLOT_HEADER.unpack_from(self.shm.buf, offset)
+            if sequence != 2 * frame_number:
+                continue
+
+            data_offset = offset + self.SLOT_HEADER_SIZE
+            if kind == self.KIND_RAW:
+                data = np.ndarray((height, width, channels), dtype=np.uint8, buffer=self.shm.buf, offset=data_offset).copy()
+            else:
+                data = bytes(self.shm.buf[data_offset:data_offset + length])
+
+            # The writer lapped the ring while we were copying, try the newest frame again
+            if self.SLOT_HEADER.unpack_from(self.shm.buf, offset)[0] == sequence:
+                return frame_number, kind, data
+        return None
+
+    def close(self):
+        self.shm.close()
+        if self.created:
+            self.shm.unlink()
+
+def get_frame_ring_name(camera_id):
+    return f"frame_ring_{camera_id}"
+
+def get_raw_frame_ring_name(camera_id):
+    return f"raw_frame_ring_{camera_id}"
+
+class SharedMemoryStreamClient:
+    """StreamClient counterpart writing processed frames into the SharedFrameRing of the camera."""
+    def __init__(self, camera_id, pass_jpeg=STREAM_PASS_JPEG):
+        self.camera_id = camera_id
+        self.pass_jpeg = pass_jpeg
+        self.ring = None
+        self.connected = False
+
+    async def connect(self, retry_count=9999999, retry_delay=2):
+        for attempt in range(retry_count):
+            try:
+                if self.ring is None:
+                    self.ring = SharedFrameRing(get_frame_ring_name(self.camera_id), create=True)
+                self.connected = True
+                print(f"Shared memory frame ring {self.ring.name} created")
+                return True
+            except Exception as e:
+                print(f"Failed to create the shared memory frame ring (attempt {attempt + 1}/{retry_count}): {e}")
+                await asyncio.sleep(retry_delay)
+
+        print("Failed to create the shared memory frame ring after all attempts")
+        return False
+
+    def send_frame(self, frame):
+        if not self.connected or not self.ring:
+            return False
+
+        try:
+            # JPEG pass-through, also the fallback for raw frames too big for a slot
+            if not self.ring.write_frame(frame, self.pass_jpeg):
+                print("Frame does not fit into the frame ring, dropped")
+            return True
+        except Exception as e:
+            print(f"Error writing frame: {e}")
+            self.connected = False
+            return False
+
+    def cleanup(self):
+        if self.ring:
+            self.ring.close()
+            self.ring = None
+            self.connected = False
+
+class SharedMemoryStreamServer:
+    """ImprovedStreamServer counterpart reading the latest frame from the SharedFrameRing of the camera."""
+    def __init__(self, camera_id, stale_after=2.0, ring_name=None):
+        self.camera_id = camera_id
+        self.ring_name = ring_name or get_frame_ring_name(camera_id)
+        self.stale_after = stale_after # reattach if no new frame arrived for so long, process_frame.py may have recreated the ring
+        self.ring = None
+        self.lock = Lock()
+        self.frame_number = 0
+        self.kind = None
+        self.data = None
+        self.jpeg = None # JPEG of the current frame, encoded at most once
+        self.last_update = 0.0
+
+    def start_receiving(self):
+        """Frames are read on demand, nothing to start."""
+        pass
+
+    def _attach(self):
+        try:
+            self.ring = SharedFrameRing(self.ring_name)
+            self.frame_number = 0
+            self.last_update = time.time()
+        except FileNotFoundError:
+            self.ring = None
+
+    def _poll(self):
+        """Pull the newest frame out of the ring, if there is one."""
+        with self.lock:
+            now = time.time()
+            if self.ring is not None and now - self.last_update > self.stale_after:
+                self.ring.close()
+                self.ring = None
+            if self.ring is None:
+                self._attach()
+                if self.ring is None:
+                    return
+
+            self.ring.touch()
+            latest = self.ring.read_latest(after=self.frame_number)
+            if latest is not None:
+                self.frame_number, self.kind, self.data = latest
+                self.jpeg = self.data if self.kind == SharedFrameRing.KIND_JPEG else None
+                self.last_update = now
+
+    def get_frame(self):
+        """Get the latest frame as an image array"""
+        self._poll()
+        kind, data = self.kind, self.data
+        if data is None:
+            return None
+        if kind == SharedFrameRing.KIND_JPEG:
+            return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        return data
+
+    def get_jpeg(self):
+        """Get the latest frame JPEG encoded, passing through frames process_frame.py already encoded"""
+        self._poll()
+        with self.lock:
+            if self.jpeg is None and self.data is not None:
+                self.jpeg = cv2.imencode('.jpg', self.data)[1].tobytes()
+            return self.jpeg
+
+    def get_latest_jpeg(self):
+        """Get (frame number, JPEG) of the latest frame"""
+        jpeg = self.get_jpeg()
+        return self.frame_number, jpeg
+
+    def cleanup(self):
+        with self.lock:
+            if self.ring:
+                self.ring.close()
+                self.ring = None
+
+class CaptureStreamServer:
+    """
+    Stream server interface over a camera VideoStream taken from the capture_registry, used for the raw feed
+    when process_frame.py does not publish raw frames. The camera is acquired on the first read and released by close().
+    """
+    def __init__(self, camera_link):
+        self.camera_link = camera_link
+        self.lock = Lock()
+        self.cap = None
+        self.frame_number = 0
+        self.jpeg = None
+
+    def get_latest_jpeg(self):
+        """Get (frame number, JPEG) of the latest camera frame"""
+        with self.lock:
+            if self.cap is None:
+                self.cap = capture_registry.acquire(self.camera_link)
+
+            latest = self.cap.read_new(after=self.frame_number, timeout=0)
+            if latest is not None:
+                self.frame_number, _, frame = latest
+                self.jpeg = cv2.imencode('.jpg', frame)[1].tobytes()
+            return self.frame_number, self.jpeg
+
+    def close(self):
+        with self.lock:
+            if self.cap is not None:
+                capture_registry.release(self.cap)
+                self.cap = None
+                self.frame_number = 0
+                self.jpeg = None
+
+class FrameBroadcaster:
+    """
+    Shares the frames of one stream server with every /video_feed viewer of the camera.
+
+    A single thread pulls each new frame from the server as JPEG (encoded at most once by the server)
+    and publishes it with a sequence number, viewers block on a condition variable until the sequence
+    changes and get the very same bytes. The thread only runs while somebody is watching.
+    """
+    def __init__(self, server, max_fps=STREAM_MAX_FPS, poll_interval=0.01, on_idle=None):
+        self.server = server
+        self.on_idle = on_idle # called when the last viewer left
+        self.max_fps = max_fps
+        self.poll_interval = poll_interval
+        self.condition = Condition()
+        self.sequence = 0
+        self.jpeg = None
+        self.subscribers = 0
+        self.thread = None
+
+    def _run(self):
+        last_frame_number = None
+        while True:
+            with self.condition:
+                if self.subscribers == 0:
+                    self.thread = None
+                    if self.on_idle:
+                        self.on_idle()
+                    return
+
+            frame_number, jpeg = self.server.get_latest_jpeg()
+            if jpeg is not None and frame_number != last_frame_number:
+                last_frame_number = frame_number
+                with self.condition:
+                    self.sequence += 1
+                    self.jpeg = jpeg
+                    self.condition.notify_all()
+
+            time.sleep(self.poll_interval)
+
+    def subscribe(self):
+        with self.condition:
+            self.subscribers += 1
+            if self.thread is None:
+                self.thread = Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def unsubscribe(self):
+        with self.condition:
+            self.subscribers -= 1
+
+    def frames(self, fps=None, timeout=1.0):
+        """
+        Generator of JPEG frames for one viewer, at most `fps` (capped by max_fps) frames per second.
+
+        Yields None when no new frame arrived within timeout so the caller can send a placeholder.
+        """
+        fps = min(fps or self.max_fps, self.max_fps)
+        min_interval = 1.0 / fps if fps > 0 else 0.0
+
+        self.subscribe()
+        try:
+            sequence = 0
+            last_sent = 0.0
+            while True:
+                with self.condition:
+                    if not self.condition.wait_for(lambda: self.sequence != sequence, timeout=timeout):
+                        jpeg = None
+                    else:
+                        sequence, jpeg = self.sequence, self.jpeg
+
+                yield jpeg
+
+                # Per viewer frame rate cap, frames published in between are skipped
+                if jpeg is not None:
+                    delay = min_interval - (time.time() - last_sent)
+                    if delay > 0:
+                        time.sleep(delay)
+                    last_sent = time.time()
+        finally:
+            self.unsubscribe()
+
+def get_stream_client(camera_id, stream_port):
+    """Frame transport from process_frame.py to stream.py selected by STREAM_TRANSPORT."""
+    if STREAM_TRANSPORT == "socket":
+        return StreamClient(server_port=stream_port)
+    return SharedMemoryStreamClient(camera_id)
+
+def get_stream_server(camera_id, stream_port):
+    if STREAM_TRANSPORT == "socket":
+        return ImprovedStreamServer(port=stream_port)
+    return SharedMemoryStreamServer(camera_id)
+
+def get_raw_stream_server(camera_id, camera_link):
+    """Raw camera frames published by process_frame.py, or a camera connection shared by all raw viewers of stream.py."""
+    if STREAM_TRANSPORT == "socket":
+        return CaptureStreamServer(camera_link)
+    return SharedMemoryStreamServer(camera_id, ring_name=get_raw_frame_ring_name(camera_id))
+
+DETECTION_COLUMNS = "user_id, camera_id, track_id, time, x, y, w, h"
+
+def copy_detections(conn, data_batch):
+    """
+    Write detection rows with a single COPY ... FROM STDIN instead of one INSERT per row.
+
+    Args:
+        conn: psycopg2 connection, committed on success
+        data_batch (list): (user_id, camera_id, track_id, time, x_center, y_center, width, height) tuples
+    """
+    buffer = io.StringIO()
+    for user_id, camera_id, track_id, time_, x_center, y_center, width, height in data_batch:
+        # Empty unquoted CSV fields are NULL, coordinates are integer columns
+        buffer.write(
+            f"{'' if user_id is None else user_id},{camera_id},{track_id},{time_},"
+            f"{round(x_center)},{round(y_center)},{round(width)},{round(height)}\n"
+        )
+    buffer.seek(0)
+
+    with conn.cursor() as cursor:
+        cursor.copy_expert(f"COPY stats_detection ({DETECTION_COLUMNS}) FROM STDIN WITH (FORMAT csv)", buffer)
+    conn.commit()
+
+# Outcomes of store_detections
+SAVE_OK = "saved"
+SAVE_FAILED = "failed" # database unreachable or busy, worth retrying
+SAVE_REJECTED = "rejected" # the rows themselves are refused (deleted camera or user, no partition), retrying cannot help
+
+def store_detections(data_batch):
     """
     Save a batch of detection data to the database.
 
@@ -457,31 +1737,246 @@ def save_detections(data_batch):
         data_batch (list): A list of tuples containing detection data to insert.
                            Each tuple should contain:
                            (user_id, camera_id, track_id, time, x_center, y_center, width, height)
+
+    Returns:
+        SAVE_OK, SAVE_FAILED or SAVE_REJECTED.
     """
+    conn = None
     try:
         conn = DB_POOL.getconn()
-        cursor = conn.cursor()
-
-        # Updated INSERT query to match the Detection model with track_id
-        insert_query = """
-        INSERT INTO stats_detection (
-            user_id, camera_id, track_id, time, x, y, w, h
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-        """
-
-        # Transform data_batch to match the query's format
-        transformed_batch = [
-            (user_id, camera_id, track_id, time, x_center, y_center, width, height)
-            for user_id, camera_id, track_id, time, x_center, y_center, width, height in data_batch
-        ]
-
-        cursor.executemany(insert_query, transformed_batch)
-        conn.commit()
+        copy_detections(conn, data_batch)
         print(f"{len(data_batch)} rows saved to DB")
+        return SAVE_OK
+    except (psycopg2.DataError, psycopg2.IntegrityError, ValueError, TypeError) as e:
+        print(f"Detection rows rejected by the DB: {e}")
+        if conn:
+            conn.rollback()
+        return SAVE_REJECTED
     except Exception as e:
         print(f"Error saving data to DB: {e}")
+        if conn:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                pass
+        return SAVE_FAILED
     finally:
-        if cursor:
-            cursor.close()
         if conn:
-            DB_POOL.putconn(conn)
\ No newline at end of file
+            DB_POOL.putconn(conn)
+
+def save_detections(data_batch):
+    """Save a batch of detection rows, returns True if they were saved."""
+    return store_detections(data_batch) == SAVE_OK
+
+class DetectionWriter:
+    """
+    Background thread persisting detection rows so a slow or unavailable database never stalls the frame loop.
+
+    Rows are queued without blocking and written with COPY once BATCH_SIZE rows are waiting or DETECTION_FLUSH_INTERVAL
+    passed. Batches that cannot be written (and rows that do not fit into the bounded queue) are spilled to
+    DETECTION_SPILL_DIR as JSON lines files by the writer thread and replayed, oldest first, after the next
+    successful flush. When the database refuses a batch (data or integrity errors, e.g. a row of a deleted user),
+    it is written again in halves until only the refused rows are left, those are kept as .failed files
+    so they are never retried and never hold back the rest.
+    """
+    def __init__(self, batch_size=BATCH_SIZE, flush_interval=DETECTION_FLUSH_INTERVAL, max_queue_size=DETECTION_QUEUE_SIZE,
+                 spill_dir=DETECTION_SPILL_DIR, retry_delay=1.0, max_retry_delay=30.0):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill_dir = spill_dir
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.queue = Queue(maxsize=max_queue_size)
+        # Rows the queue had no room for, spilled by the writer thread
+        self.overflow = []
+        self.stopped = False
+        self.lock = Lock()
+        self.stats = {
+            "flushed_rows": 0,
+            "failed_flushes": 0,
+            "spilled_rows": 0,
+            "rejected_rows": 0,
+            "last_flush_latency": None,
+            "max_flush_latency": 0.0,
+        }
+        os.makedirs(self.spill_dir, exist_ok=True)
+        self.thread = Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def put(self, rows):
+        """Queue detection rows, never blocks. Rows the queue has no room for are left to the writer thread to spill."""
+        overflow = []
+        for row in rows:
+            try:
+                self.queue.put_nowait(row)
+            except Full:
+                overflow.append(row)
+        if overflow:
+            with self.lock:
+                self.overflow.extend(overflow)
+
+    def _spill_overflow(self):
+        with self.lock:
+            overflow, self.overflow = self.overflow, []
+        if overflow:
+            self._spill(overflow)
+
+    def metrics(self):
+        with self.lock:
+            metrics = dict(self.stats)
+            metrics["overflow_rows"] = len(self.overflow)
+        metrics["queue_depth"] = self.queue.qsize()
+        metrics["spill_files"] = len(self._spill_files())
+        return metrics
+
+    def _take_batch(self):
+        """Collect rows until the batch is full, the flush interval passed or the writer stops."""
+        batch = []
+        deadline = time.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=min(timeout, 0.5)))
+            except Empty:
+                if self.stopped:
+                    break
+        return batch
+
+    def _flush(self, batch):
+        """Write a batch, returns SAVE_OK, SAVE_FAILED or SAVE_REJECTED."""
+        started = time.time()
+        status = store_detections(batch)
+        latency = time.time() - started
+        with self.lock:
+            self.stats["last_flush_latency"] = round(latency, 4)
+            self.stats["max_flush_latency"] = round(max(self.stats["max_flush_latency"], latency), 4)
+            if status == SAVE_OK:
+                self.stats["flushed_rows"] += len(batch)
+            elif status == SAVE_FAILED:
+                self.stats["failed_flushes"] += 1
+        return status
+
+    def _write(self, rows):
+        """
+        Write rows, splitting a refused batch in halves until only the refused rows are left.
+
+        Returns:
+            (rejected rows, unsaved rows), the unsaved ones were not written because the database went away.
+        """
+        status = self._flush(rows)
+        if status == SAVE_OK:
+            return [], []
+        if status == SAVE_FAILED:
+            return [], rows
+        if len(rows) == 1:
+            return rows, []
+
+        rejected, unsaved = [], []
+        middle = len(rows) // 2
+        for part in (rows[:middle], rows[middle:]):
+            if unsaved:
+                # No point in trying the second half while the database is unavailable
+                unsaved.extend(part)
+                continue
+            part_rejected, part_unsaved = self._write(part)
+            rejected.extend(part_rejected)
+            unsaved.extend(part_unsaved)
+        return rejected, unsaved
+
+    def _write_batch(self, rows):
+        """Write rows with _write and keep the refused ones as a .failed file, returns the unsaved rows."""
+        rejected, unsaved = self._write(rows)
+        if rejected:
+            with self.lock:
+                self.stats["rejected_rows"] += len(rejected)
+            self._spill(rejected, suffix=".failed")
+        return unsaved
+
+    def _spill_files(self):
+        try:
+            return sorted(name for name in os.listdir(self.spill_dir) if name.endswith(".jsonl"))
+        except OSError:
+            return []
+
+    def _spill(self, rows, suffix=".jsonl"):
+        path = os.path.join(self.spill_dir, f"detections_{time.time_ns()}{suffix}")
+        try:
+            with open(path, "w") as spill_file:
+                for row in rows:
+                    spill_file.write(json.dumps(row) + "\n")
+            with self.lock:
+                self.stats["spilled_rows"] += len(rows)
+            print(f"{len(rows)} detection rows spilled to {path}")
+        except OSError as e:
+            print(f"Error spilling detection rows, {len(rows)} rows lost: {e}")
+
+    def _rewrite(self, path, rows):
+        """Replace the content of a spill file with the rows still waiting, keeping its place in the replay order."""
+        try:
+            with open(path + ".tmp", "w") as spill_file:
+                for row in rows:
+                    spill_file.write(json.dumps(row) + "\n")
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            print(f"Error rewriting {path}, rows already saved will be replayed again: {e}")
+
+    def _quarantine(self, path):
+        """Keep a spill file the database refused as .failed, it is not replayed again."""
+        failed_path = path[:-len(".jsonl")] + ".failed"
+        try:
+            os.replace(path, failed_path)
+            print(f"Detection rows of {path} refused by the DB, kept in {failed_path}")
+        except OSError as e:
+            print(f"Error moving {path} to {failed_path}: {e}")
+
+    def _replay_spilled(self):
+        """Write spilled batches back to the database, stops at the first failure the database may recover from."""
+        for name in self._spill_files():
+            path = os.path.join(self.spill_dir, name)
+            try:
+                with open(path) as spill_file:
+                    rows = [tuple(json.loads(line)) for line in spill_file if line.strip()]
+            except (OSError, ValueError) as e:
+                print(f"Unreadable spill file {path}: {e}")
+                self._quarantine(path)
+                continue
+
+            unsaved = self._write_batch(rows) if rows else []
+            if unsaved:
+                if len(unsaved) < len(rows):
+                    self._rewrite(path, unsaved)
+                return False
+            os.remove(path)
+        return True
+
+    def _run(self):
+        delay = self.retry_delay
+        while not (self.stopped and self.queue.empty() and not self.overflow):
+            batch = self._take_batch()
+            self._spill_overflow()
+
+            flushed = True
+            if batch:
+                unsaved = self._write_batch(batch)
+                if unsaved:
+                    self._spill(unsaved)
+                    flushed = False
+            if flushed and self._spill_files():
+                flushed = self._replay_spilled()
+
+            if flushed:
+                delay = self.retry_delay
+            elif not self.stopped:
+                # Database unavailable, back off before trying again
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+
+    def close(self, timeout=30):
+        """Flush what is queued and stop the thread."""
+        self.stopped = True
+        self.thread.join(timeout)
@@ -1,6 +1,8 @@
 import json
 import os
-from utils import DB_POOL
+from threading import Lock
+from settings_listener import SettingsListener
+from utils import DB_POOL, DB_SETTINGS
 from flask import Flask, render_template, request, jsonify
 import cv2
 import numpy as np
@@ -155,6 +157,35 @@ class DatabaseManager:
             if conn:
                 DB_POOL.putconn(conn)
 
+# Threshold settings cached in memory, reloaded when the management app NOTIFYs a change of one of them
+THRESHOLD_SETTING_KEYS = {'faceSimilarityTresholdEnterExit', 'faceDetectionTresholdEnterExit'}
+threshold_settings = None
+settings_listener = None
+settings_lock = Lock()
+
+def reload_threshold_settings(keys=None):
+    global threshold_settings
+    if keys is not None and not keys & THRESHOLD_SETTING_KEYS:
+        return
+    settings = DatabaseManager.get_threshold_settings()
+    # Keep the previous values when the database could not be read
+    if None not in settings:
+        threshold_settings = settings
+
+def get_threshold_settings():
+    """
+    Returns (face_similarity_threshold, face_detection_threshold) without querying the database once loaded.
+    The listener is started on first use so only the serving process (not the reloader) holds a connection.
+    """
+    global settings_listener
+    with settings_lock:
+        if settings_listener is None:
+            settings_listener = SettingsListener(DB_SETTINGS, reload_threshold_settings)
+            settings_listener.start()
+        if threshold_settings is None:
+            reload_threshold_settings()
+    return threshold_settings or (None, None)
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -170,7 +201,7 @@ def exit():
 @app.route('/recognize_entry', methods=['POST'])
 def recognize_entry():
     try:
-        FACE_SIMILARITY_THRESHOLD, FACE_DETECTION_THRESHOLD = DatabaseManager.get_threshold_settings()
+        FACE_SIMILARITY_THRESHOLD, FACE_DETECTION_THRESHOLD = get_threshold_settings()
         # Get the image data from the request
         image_data = request.json['image'].split(',')[1]
         image_bytes = base64.b64decode(image_data)
@@ -216,7 +247,7 @@ def recognize_entry():
 @app.route('/recognize_exit', methods=['POST'])
 def recognize_exit():
     try:
-        FACE_SIMILARITY_THRESHOLD, FACE_DETECTION_THRESHOLD = DatabaseManager.get_threshold_settings()
+        FACE_SIMILARITY_THRESHOLD, FACE_DETECTION_THRESHOLD = get_threshold_settings()
         # Get the image data from the request
         image_data = request.json['image'].split(',')[1]
         image_bytes = base64.b64decode(image_data)
@@ -19,9 +19,9 @@ DB_SETTINGS = {
     "password": os.getenv("PGVECTOR_DB_PASSWORD"),
 }
 
-# Create a connection pool
-DB_POOL = pool.SimpleConnectionPool(
+# Create a connection pool, shared by the request threads and the settings listener thread
+DB_POOL = pool.ThreadedConnectionPool(
     minconn=1,
     maxconn=10,
     **DB_SETTINGS
-)
\ No newline at end of file
+)
@@ -0,0 +1,271 @@
+# embedding_index.py
+import logging
+from threading import Lock
+
+import numpy as np
+from django.apps import apps
+from django.db import connection, transaction
+from pgvector.django import L2Distance
+from management.utils import get_setting
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DIMENSIONS = 512
+
+
+class EmbeddingIndex:
+    """
+    In-memory copy of all FaceEmbedding vectors used for exact nearest-neighbour search.
+
+    The matrix is loaded lazily on the first lookup and kept in sync through the
+    FaceEmbedding post_save/post_delete signals, so a lookup is a single matmul
+    instead of a sequential scan over the face_recognition_faceembedding table.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.loaded = False
+        self.ids = np.empty(0, dtype=np.int64)
+        self.user_ids = np.empty(0, dtype=np.int64)
+        self.vectors = np.empty((0, EMBEDDING_DIMENSIONS), dtype=np.float32)
+        self.squared_norms = np.empty(0, dtype=np.float32)
+
+    def load(self):
+        """
+        (Re)load every stored embedding from the database.
+        """
+        FaceEmbedding = apps.get_model('face_recognition', 'FaceEmbedding')
+        rows = list(FaceEmbedding.objects.values_list('id', 'user_id', 'embedding'))
+
+        with self.lock:
+            if rows:
+                self.ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+                self.user_ids = np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))
+                self.vectors = np.vstack([np.asarray(row[2], dtype=np.float32) for row in rows])
+            else:
+                self.ids = np.empty(0, dtype=np.int64)
+                self.user_ids = np.empty(0, dtype=np.int64)
+                self.vectors = np.empty((0, EMBEDDING_DIMENSIONS), dtype=np.float32)
+            self.squared_norms = np.einsum('ij,ij->i', self.vectors, self.vectors)
+            self.loaded = True
+
+        logger.info(f"Embedding index loaded with {len(rows)} embeddings")
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            self.load()
+
+    def upsert(self, embedding_id, user_id, embedding):
+        """
+        Insert or replace a single embedding. No-op until the index has been loaded,
+        the next load() picks the row up from the database anyway.
+        """
+        if not self.loaded:
+            return
+
+        vector = np.asarray(embedding, dtype=np.float32).reshape(1, -1)
+
+        with self.lock:
+            position = np.flatnonzero(self.ids == embedding_id)
+            if position.size:
+                index = position[0]
+                # Copy before writing so concurrent readers keep a consistent snapshot
+                self.vectors = self.vectors.copy()
+                self.squared_norms = self.squared_norms.copy()
+                self.user_ids = self.user_ids.copy()
+                self.vectors[index] = vector[0]
+                self.squared_norms[index] = float(vector[0] @ vector[0])
+                self.user_ids[index] = user_id
+            else:
+                self.ids = np.append(self.ids, embedding_id)
+                self.user_ids = np.append(self.user_ids, user_id)
+                self.vectors = np.vstack([self.vectors, vector])
+                self.squared_norms = np.append(self.squared_norms, float(vector[0] @ vector[0]))
+
+    def remove(self, embedding_id):
+        if not self.loaded:
+            return
+
+        with self.lock:
+            keep = self.ids != embedding_id
+            if keep.all():
+                return
+            self.ids = self.ids[keep]
+            self.user_ids = self.user_ids[keep]
+            self.vectors = self.vectors[keep]
+            self.squared_norms = self.squared_norms[keep]
+
+    def search(self, embedding, k=1):
+        """
+        Find the k closest embeddings by L2 distance.
+
+        Returns:
+            List of (embedding_id, user_id, distance) tuples ordered by distance.
+        """
+        self.ensure_loaded()
+
+        with self.lock:
+            ids, user_ids, vectors, squared_norms = self.ids, self.user_ids, self.vectors, self.squared_norms
+
+        if ids.size == 0:
+            return []
+
+        query = np.asarray(embedding, dtype=np.float32).reshape(-1)
+
+        # ||a - b||^2 = ||a||^2 - 2ab + ||b||^2
+        squared_distances = squared_norms - 2.0 * (vectors @ query) + float(query @ query)
+        np.maximum(squared_distances, 0.0, out=squared_distances)
+
+        k = min(k, ids.size)
+        if k == 1:
+            nearest = np.array([np.argmin(squared_distances)])
+        else:
+            nearest = np.argpartition(squared_distances, k - 1)[:k]
+            nearest = nearest[np.argsort(squared_distances[nearest])]
+
+        return [
+            (int(ids[i]), int(user_ids[i]), float(np.sqrt(squared_distances[i])))
+            for i in nearest
+        ]
+
+    def find_closest_batch(self, embeddings):
+        """
+        Find the closest embedding for every row of a (N, 512) query matrix with a single matmul.
+
+        Returns:
+            List of (embedding_id, user_id, distance) tuples in query order, or None for every query if the index is empty.
+        """
+        self.ensure_loaded()
+
+        with self.lock:
+            ids, user_ids, vectors, squared_norms = self.ids, self.user_ids, self.vectors, self.squared_norms
+
+        queries = np.asarray(embeddings, dtype=np.float32).reshape(-1, EMBEDDING_DIMENSIONS)
+
+        if ids.size == 0:
+            return [None] * len(queries)
+
+        squared_distances = (
+            squared_norms[np.newaxis, :]
+            - 2.0 * (queries @ vectors.T)
+            + np.einsum('ij,ij->i', queries, queries)[:, np.newaxis]
+        )
+        nearest = np.argmin(squared_distances, axis=1)
+        distances = np.sqrt(np.maximum(squared_distances[np.arange(len(queries)), nearest], 0.0))
+
+        return [
+            (int(ids[i]), int(user_ids[i]), float(distance))
+            for i, distance in zip(nearest, distances)
+        ]
+
+    def find_closest(self, embedding):
+        """
+        Returns (embedding_id, user_id, distance) of the closest embedding or None if the index is empty.
+        """
+        matches = self.search(embedding, k=1)
+        return matches[0] if matches else None
+
+
+# Global index instance, one per process
+_embedding_index = None
+
+def get_embedding_index():
+    global _embedding_index
+    if _embedding_index is None:
+        _embedding_index = EmbeddingIndex()
+    return _embedding_index
+
+
+def search_pgvector(embedding, k=1, ef_search=None):
+    """
+    Find the k closest embeddings with pgvector, using the HNSW index on FaceEmbedding.embedding.
+
+    Args:
+        embedding: Query vector
+        k: Number of neighbours to return
+        ef_search: Size of the HNSW candidate list for this query (hnsw.ef_search)
+
+    Returns:
+        List of (embedding_id, user_id, distance) tuples ordered by distance.
+    """
+    FaceEmbedding = apps.get_model('face_recognition', 'FaceEmbedding')
+    query = np.asarray(embedding, dtype=np.float32).reshape(-1)
+
+    with transaction.atomic():
+        if ef_search:
+            with connection.cursor() as cursor:
+                # SET LOCAL only lasts until the end of this transaction
+                cursor.execute("SET LOCAL hnsw.ef_search = %s", [int(ef_search)])
+
+        matches = FaceEmbedding.objects.annotate(
+            distance=L2Distance('embedding', query)
+        ).order_by('distance').values_list('id', 'user_id', 'distance')[:k]
+
+        return [(embedding_id, user_id, float(distance)) for embedding_id, user_id, distance in matches]
+
+def search_pgvector_batch(embeddings, ef_search=None):
+    """
+    Find the closest embedding for every query vector in a single SQL statement
+    (one LATERAL nearest-neighbour lookup per query, each served by the HNSW index).
+
+    Returns:
+        List of (embedding_id, user_id, distance) tuples in query order, None where nothing was found.
+    """
+    queries = np.asarray(embeddings, dtype=np.float32).reshape(-1, EMBEDDING_DIMENSIONS)
+    if len(queries) == 0:
+        return []
+
+    vector_literals = ['[' + ','.join(map(str, query.tolist())) + ']' for query in queries]
+
+    sql = """
+    SELECT q.ordinality, nn.id, nn.user_id, nn.distance
+    FROM unnest(%s::vector[]) WITH ORDINALITY AS q(embedding, ordinality)
+    CROSS JOIN LATERAL (
+        SELECT fe.id, fe.user_id, fe.embedding <-> q.embedding AS distance
+        FROM face_recognition_faceembedding fe
+        ORDER BY fe.embedding <-> q.embedding
+        LIMIT 1
+    ) nn
+    """
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            if ef_search:
+                cursor.execute("SET LOCAL hnsw.ef_search = %s", [int(ef_search)])
+            cursor.execute(sql, [vector_literals])
+            rows = cursor.fetchall()
+
+    results = [None] * len(queries)
+    for ordinality, embedding_id, user_id, distance in rows:
+        results[ordinality - 1] = (embedding_id, user_id, float(distance))
+    return results
+
+def find_closest_embedding(embedding):
+    """
+    Find the closest stored embedding with the backend selected by the faceEmbeddingSearchBackend setting:
+    "memory" (default) for the in-process index, "pgvector" for the HNSW index in the database.
+
+    Returns:
+        (embedding_id, user_id, distance) or None if there are no embeddings.
+    """
+    backend = get_setting("faceEmbeddingSearchBackend", "memory")
+
+    if backend == "pgvector":
+        matches = search_pgvector(embedding, k=1, ef_search=get_setting("faceEmbeddingEfSearch", "40"))
+        return matches[0] if matches else None
+
+    return get_embedding_index().find_closest(embedding)
+
+def find_closest_embeddings(embeddings):
+    """
+    Batch version of find_closest_embedding, resolving all queries in one vectorized lookup.
+
+    Returns:
+        List of (embedding_id, user_id, distance) tuples in input order, None where nothing was found.
+    """
+    backend = get_setting("faceEmbeddingSearchBackend", "memory")
+
+    if backend == "pgvector":
+        return search_pgvector_batch(embeddings, ef_search=get_setting("faceEmbeddingEfSearch", "40"))
+
+    return get_embedding_index().find_closest_batch(embeddings)
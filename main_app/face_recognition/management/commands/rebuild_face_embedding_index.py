@@ -0,0 +1,101 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from pgvector.django import HnswIndex
+
+from face_recognition.embedding_index import EmbeddingIndex, search_pgvector
+from face_recognition.models import FaceEmbedding
+from management.utils import get_settings
+
+INDEX_NAME = 'face_embedding_hnsw_idx'
+
+
+class Command(BaseCommand):
+    help = "Rebuild the HNSW index on FaceEmbedding.embedding and report its recall against an exact scan."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--m', type=int, default=16,
+                            help="Max connections per HNSW layer (the migration builds the index with 16)")
+        parser.add_argument('--ef-construction', type=int, default=64,
+                            help="Candidate list size used while building the index (the migration builds it with 64)")
+        parser.add_argument('--ef-search', type=int, default=None,
+                            help="Candidate list size used for the recall check (defaults to the faceEmbeddingEfSearch setting)")
+        parser.add_argument('--k', type=int, default=1, help="Number of neighbours compared per query")
+        parser.add_argument('--sample', type=int, default=200, help="Number of stored embeddings used as queries")
+        parser.add_argument('--skip-rebuild', action='store_true', help="Only measure recall of the current index")
+
+    def handle(self, *args, **options):
+        ef_search = options['ef_search'] or int(get_settings().get("faceEmbeddingEfSearch", "40"))
+
+        if not options['skip_rebuild']:
+            self.rebuild_index(options['m'], options['ef_construction'])
+
+        self.report_recall(options['k'], options['sample'], ef_search)
+
+    def rebuild_index(self, m, ef_construction):
+        index = HnswIndex(
+            name=INDEX_NAME,
+            fields=['embedding'],
+            m=m,
+            ef_construction=ef_construction,
+            opclasses=['vector_l2_ops'],
+        )
+
+        self.stdout.write(f"Rebuilding {INDEX_NAME} (m={m}, ef_construction={ef_construction})...")
+        start = time.perf_counter()
+        with connection.schema_editor() as schema_editor:
+            schema_editor.remove_index(FaceEmbedding, index)
+            schema_editor.add_index(FaceEmbedding, index)
+        elapsed = time.perf_counter() - start
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_size_pretty(pg_relation_size(%s::regclass))", [INDEX_NAME])
+            size = cursor.fetchone()[0]
+
+        self.stdout.write(self.style.SUCCESS(f"Index rebuilt in {elapsed:.2f}s, size {size}"))
+
+    def report_recall(self, k, sample, ef_search):
+        exact_index = EmbeddingIndex()
+        exact_index.load()
+
+        if exact_index.ids.size == 0:
+            self.stdout.write(self.style.WARNING("No embeddings stored, nothing to measure."))
+            return
+
+        rng = np.random.default_rng()
+        query_rows = rng.choice(exact_index.ids.size, size=min(sample, exact_index.ids.size), replace=False)
+
+        hits = 0
+        exact_time = 0.0
+        ann_time = 0.0
+
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                # Make sure the planner goes through the index even on small tables
+                cursor.execute("SET LOCAL enable_seqscan = off")
+
+            for row in query_rows:
+                query = exact_index.vectors[row]
+
+                start = time.perf_counter()
+                exact = {match[0] for match in exact_index.search(query, k=k)}
+                exact_time += time.perf_counter() - start
+
+                start = time.perf_counter()
+                approximate = {match[0] for match in search_pgvector(query, k=k, ef_search=ef_search)}
+                ann_time += time.perf_counter() - start
+
+                hits += len(exact & approximate)
+
+        queries = len(query_rows)
+        recall = hits / (queries * min(k, exact_index.ids.size))
+
+        self.stdout.write(
+            f"Embeddings: {exact_index.ids.size}, queries: {queries}, k={k}, ef_search={ef_search}"
+        )
+        self.stdout.write(self.style.SUCCESS(f"Recall@{k}: {recall:.4f}"))
+        self.stdout.write(
+            f"Average latency: HNSW {ann_time / queries * 1000:.2f} ms, exact (in-memory) {exact_time / queries * 1000:.2f} ms"
+        )
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2025-02-16 12:41
+
+import pgvector.django.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('face_recognition', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='faceembedding',
+            index=pgvector.django.indexes.HnswIndex(ef_construction=64, fields=['embedding'], m=16, name='face_embedding_hnsw_idx', opclasses=['vector_l2_ops']),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.4 on 2025-03-14 09:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('face_recognition', '0002_faceembedding_face_embedding_hnsw_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recognition',
+            index=models.Index(fields=['time'], name='recognition_time_idx'),
+        ),
+    ]
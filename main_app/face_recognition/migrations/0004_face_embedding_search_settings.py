@@ -0,0 +1,47 @@
+# Generated by Django 5.1.4 on 2025-03-14 10:05
+
+from django.db import migrations
+
+SETTINGS = [
+    {
+        'key': 'faceEmbeddingSearchBackend',
+        'value': 'memory',
+        'data_type': 'str',
+        'description': 'Nearest embedding search: "memory" for the in-process index, "pgvector" for the HNSW index in the database',
+    },
+    {
+        'key': 'faceEmbeddingEfSearch',
+        'value': '40',
+        'data_type': 'int',
+        'description': 'Candidate list size of the pgvector HNSW search (hnsw.ef_search), higher is more accurate but slower',
+    },
+]
+
+
+def create_settings(apps, schema_editor):
+    Setting = apps.get_model('management', 'Setting')
+    for setting in SETTINGS:
+        # Rows created by hand before this migration keep their value
+        Setting.objects.get_or_create(key=setting['key'], defaults={
+            'value': setting['value'],
+            'default_value': setting['value'],
+            'description': setting['description'],
+            'data_type': setting['data_type'],
+        })
+
+
+def delete_settings(apps, schema_editor):
+    Setting = apps.get_model('management', 'Setting')
+    Setting.objects.filter(key__in=[setting['key'] for setting in SETTINGS]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('face_recognition', '0003_recognition_time_idx'),
+        ('management', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_settings, delete_settings),
+    ]
@@ -1,11 +1,12 @@
-from django.db import models
+from django.db import models, transaction
 from .utils import extract_embedding
-from pgvector.django import VectorField
+from pgvector.django import VectorField, HnswIndex
 from django.contrib.auth.models import User 
 from django.dispatch import receiver
-from django.db.models.signals import pre_save
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.core.exceptions import ValidationError
 import numpy as np
+from .embedding_index import get_embedding_index
 
 # Create your models here.
 class FaceEmbedding(models.Model):
@@ -13,6 +14,17 @@ class FaceEmbedding(models.Model):
     embedding = VectorField(dimensions=512, null=False, blank=False)
     photo = models.ImageField(upload_to='face_photos/', null=False, blank=False)
 
+    class Meta:
+        indexes = [
+            HnswIndex(
+                name='face_embedding_hnsw_idx',
+                fields=['embedding'],
+                m=16,
+                ef_construction=64,
+                opclasses=['vector_l2_ops'],
+            ),
+        ]
+
     def __str__(self):
         return f"FaceEmbedding for {self.user}"
     
@@ -21,6 +33,12 @@ class Recognition(models.Model):
     distance = models.FloatField()
     time = models.DateTimeField()
     photo =  models.ImageField(upload_to='recognition_face_photos/', null=True, blank=False)
+
+    class Meta:
+        # Backs the keyset pagination of the entries list on recognition_in__time
+        indexes = [
+            models.Index(fields=['time'], name='recognition_time_idx'),
+        ]
     
 @receiver(pre_save, sender=FaceEmbedding)
 def process_face_embedding(sender, instance, **kwargs):
@@ -50,4 +68,17 @@ def process_face_embedding(sender, instance, **kwargs):
             embedding = embedding.tolist()
         
         # Set the embedding and confidence
-        instance.embedding = embedding
\ No newline at end of file
+        instance.embedding = embedding
+
+@receiver(post_save, sender=FaceEmbedding)
+def update_embedding_index(sender, instance, **kwargs):
+    """
+    Keep the in-memory embedding index in sync with saved embeddings.
+    """
+    embedding_id, user_id, embedding = instance.pk, instance.user_id, instance.embedding
+    transaction.on_commit(lambda: get_embedding_index().upsert(embedding_id, user_id, embedding))
+
+@receiver(post_delete, sender=FaceEmbedding)
+def remove_from_embedding_index(sender, instance, **kwargs):
+    embedding_id = instance.pk
+    transaction.on_commit(lambda: get_embedding_index().remove(embedding_id))
@@ -1,3 +1,62 @@
+from unittest import mock
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import TestCase
+from rest_framework.test import APIClient
+
+from .models import Recognition
+
+
+def fake_embedding():
+    embedding = mock.Mock()
+    embedding.numpy.return_value = np.zeros(512, dtype=np.float32)
+    return embedding
+
+
+def photo(name='face.jpg'):
+    return SimpleUploadedFile(name, b'jpeg', content_type='image/jpeg')
+
+
+@mock.patch('face_recognition.views.save_cropped_face', return_value='recognition_face_photos/face.jpg')
+class DeletedUserRecognitionTests(TestCase):
+    """
+    The in-memory embedding index of a process can still return an embedding of a user deleted by another process.
+    """
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user('present')
+        self.deleted_user_id = self.user.id + 1000
+        self.index = mock.Mock()
+        patcher = mock.patch('face_recognition.views.get_embedding_index', return_value=self.index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @mock.patch('face_recognition.views.extract_embedding', side_effect=lambda *args, **kwargs: (fake_embedding(), mock.Mock()))
+    def test_single_crop_of_a_deleted_user(self, extract_embedding, save_cropped_face):
+        with mock.patch('face_recognition.views.find_closest_embedding', return_value=(7, self.deleted_user_id, 0.2)):
+            response = self.client.post('/face_recognition/api/recognize/', {'file': photo()}, format='multipart')
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.data, {"error": "No embeddings found"})
+        self.index.remove.assert_called_once_with(7)
+        self.assertFalse(Recognition.objects.exists())
+
+    @mock.patch('face_recognition.views.extract_embeddings_batch')
+    def test_batch_with_a_deleted_user(self, extract_embeddings_batch, save_cropped_face):
+        extract_embeddings_batch.return_value = [(fake_embedding(), mock.Mock()), (fake_embedding(), mock.Mock())]
+        matches = [(7, self.deleted_user_id, 0.2), (8, self.user.id, 0.3)]
+
+        with mock.patch('face_recognition.views.find_closest_embeddings', return_value=matches):
+            response = self.client.post(
+                '/face_recognition/api/recognize_batch/', {'files': [photo('a.jpg'), photo('b.jpg')]}, format='multipart'
+            )
 
-# Create your tests here.
+        self.assertEqual(response.status_code, 200)
+        deleted, present = response.data['results']
+        self.assertEqual(deleted, {"error": "No embeddings found"})
+        self.assertEqual(present['user_id'], self.user.id)
+        self.assertEqual(present['embedding_id'], 8)
+        self.index.remove.assert_called_once_with(7)
+        self.assertEqual(list(Recognition.objects.values_list('user_id', flat=True)), [self.user.id])
@@ -1,13 +1,60 @@
 # utils.py
 from PIL import Image
 import numpy as np
-from .model_loader import get_models, _device
-from management.utils import get_settings
+import torch
+from facenet_pytorch import fixed_image_standardization
+from .model_loader import get_models
+from management.utils import get_setting
 
-def extract_embedding(photo):
+def preprocess_precropped_face(photo, image_size=160):
+    """
+    Turn an already cropped face into the normalized 3 x image_size x image_size tensor InceptionResnetV1 expects,
+    the same output MTCNN produces for a detected face, without running face detection.
+    """
+    face = photo.resize((image_size, image_size), Image.BILINEAR)
+    face = torch.from_numpy(np.asarray(face, dtype=np.float32)).permute(2, 0, 1)
+    return fixed_image_standardization(face)
+
+def detect_and_crop_face(photo, mtcnn, confidence_threshold):
+    """
+    Single MTCNN pass: detect faces once and crop the largest one above the confidence threshold
+    from the detected box, instead of running the detection cascade a second time through mtcnn(photo).
+
+    Returns:
+        Normalized face tensor or None if no face meets the threshold.
+    """
+    boxes, probs = mtcnn.detect(photo)
+
+    # Check if any faces were detected
+    if boxes is None or len(boxes) == 0:
+        print("No faces detected in the image")
+        return None
+
+    # Check if the highest confidence face meets our threshold
+    confident = np.asarray(probs) >= confidence_threshold
+    if not confident.any():
+        print(f"Face detected but confidence ({max(probs):.2f}) is below threshold ({confidence_threshold})")
+        return None
+
+    # Crop the largest confident face
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    areas[~confident] = -1
+    return mtcnn.extract(photo, boxes[[int(np.argmax(areas))]], None)
+
+def extract_embedding(photo, precropped=False):
+    """
+    Extract a face embedding from a photo.
+
+    Args:
+        photo: File-like object or PIL image
+        precropped: The photo is already a face crop (e.g. from the detection container),
+                    skip MTCNN and only resize/normalize it
+
+    Returns:
+        Tuple of (embedding, cropped_face) or (None, None) if no face could be used.
+    """
     try:
-        setting_dict = get_settings()
-        confidence_threshold = float(setting_dict.get("extractEmbeddingTreshold", 0.95))
+        confidence_threshold = float(get_setting("extractEmbeddingTreshold", 0.95))
         # Get models on the specified device
         mtcnn, resnet = get_models()
         
@@ -15,42 +62,123 @@ def extract_embedding(photo):
         if not isinstance(photo, Image.Image):
             # Open the image and ensure it's in RGB format
             photo = Image.open(photo).convert('RGB')
-        
-        # Get both boxes and probabilities from MTCNN
-        boxes, probs = mtcnn.detect(photo)
-        
-        # Check if any faces were detected
-        if boxes is None or len(boxes) == 0:
-            print("No faces detected in the image")
-            return None, None
-        
-        # Check if the highest confidence face meets our threshold
-        max_prob = max(probs)
-        if max_prob < confidence_threshold:
-            print(f"Face detected but confidence ({max_prob:.2f}) is below threshold ({confidence_threshold})")
-            return None, None
-            
-        # Extract the face with highest confidence
-        cropped_face = mtcnn(photo)
+
+        if precropped:
+            cropped_face = preprocess_precropped_face(photo)
+        else:
+            cropped_face = detect_and_crop_face(photo, mtcnn, confidence_threshold)
+
         if cropped_face is None:
-            print("Error cropping face")
             return None, None
         
         # Ensure cropped_face is on the same device as the resnet model
-        cropped_face = cropped_face.to(_device)
+        device = next(resnet.parameters()).device
         
         # Pass through the face recognition model
-        embedding = resnet(cropped_face.unsqueeze(0).to(_device)).detach().cpu()[0]
+        with torch.no_grad():
+            embedding = resnet(cropped_face.unsqueeze(0).to(device)).detach().cpu()[0]
         
         # Ensure the embedding is a 1D array
         if embedding.ndim != 1:
             print(f"Embedding has unexpected shape: {embedding.shape}")
             return None, None
         
-        return embedding, cropped_face  # Return both the embedding and cropped face
+        return embedding, cropped_face.cpu()  # Return both the embedding and cropped face
         
     except Exception as e:
         print(f"Error extracting embedding: {e}")
         return None, None
     
 
+def pad_to_square(photo, size):
+    """
+    Paste a PIL image onto the top-left corner of a black size x size canvas,
+    downscaling it first if it does not fit. Returns the padded image and the scale applied.
+    """
+    scale = min(1.0, size / max(photo.size))
+    if scale < 1.0:
+        photo = photo.resize((max(1, int(photo.width * scale)), max(1, int(photo.height * scale))))
+
+    canvas = Image.new('RGB', (size, size))
+    canvas.paste(photo, (0, 0))
+    return canvas, scale
+
+def extract_embeddings_batch(photos, precropped=False, max_size=640):
+    """
+    Extract embeddings for many photos with one MTCNN pass and one InceptionResnetV1 pass.
+
+    MTCNN can only batch images of equal size, so every photo is padded onto a common square canvas first.
+
+    Args:
+        photos: List of file-like objects or PIL images
+        precropped: The photos are already face crops, skip MTCNN and only resize/normalize them
+        max_size: Upper bound for the common canvas size, larger photos are downscaled
+
+    Returns:
+        List of (embedding, cropped_face) tuples in input order, (None, None) where no face was found.
+    """
+    results = [(None, None)] * len(photos)
+
+    try:
+        confidence_threshold = float(get_setting("extractEmbeddingTreshold", 0.95))
+        mtcnn, resnet = get_models()
+
+        images = [
+            photo if isinstance(photo, Image.Image) else Image.open(photo).convert('RGB')
+            for photo in photos
+        ]
+        if not images:
+            return results
+
+        if precropped:
+            cropped_faces = [preprocess_precropped_face(image) for image in images]
+        else:
+            cropped_faces = detect_and_crop_faces_batch(images, mtcnn, confidence_threshold, max_size)
+
+        valid = [i for i, face in enumerate(cropped_faces) if face is not None]
+        if not valid:
+            return results
+
+        device = next(resnet.parameters()).device
+        faces = torch.stack([cropped_faces[i] for i in valid]).to(device)
+        with torch.no_grad():
+            embeddings = resnet(faces).detach().cpu()
+
+        for row, i in enumerate(valid):
+            results[i] = (embeddings[row], cropped_faces[i].cpu())
+
+        return results
+
+    except Exception as e:
+        print(f"Error extracting batch embeddings: {e}")
+        return results
+
+def detect_and_crop_faces_batch(images, mtcnn, confidence_threshold, max_size=640):
+    """
+    Batched detect_and_crop_face: one MTCNN pass over all images padded onto a common canvas.
+
+    Returns:
+        List of normalized face tensors in input order, None where no face meets the threshold.
+    """
+    size = min(max_size, max(max(image.size) for image in images))
+    padded = [pad_to_square(image, size)[0] for image in images]
+
+    batch_boxes, batch_probs = mtcnn.detect(padded)
+
+    # Keep the largest face above the confidence threshold for every image
+    selected_boxes = []
+    for boxes, probs in zip(batch_boxes, batch_probs):
+        if boxes is None:
+            selected_boxes.append(None)
+            continue
+
+        confident = np.asarray(probs) >= confidence_threshold
+        if not confident.any():
+            selected_boxes.append(None)
+            continue
+
+        areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+        areas[~confident] = -1
+        selected_boxes.append(boxes[[int(np.argmax(areas))]])
+
+    return mtcnn.extract(padded, selected_boxes, None)
@@ -6,15 +6,17 @@ from django.shortcuts import render
 from django.http import JsonResponse
 from PIL import Image
 from io import BytesIO
+import numpy as np
 from django.conf import settings
 
-from .models import FaceEmbedding, Recognition
-from stats.models import Entry
-from .utils import extract_embedding
+from .models import Recognition
+from stats.occupancy import get_occupancy
+from .utils import extract_embedding, extract_embeddings_batch
+from .embedding_index import find_closest_embedding, find_closest_embeddings, get_embedding_index
+from django.contrib.auth.models import User
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from pgvector.django import L2Distance
 import logging\
 
 from django.http import JsonResponse
@@ -51,6 +53,33 @@ def extract_embedding_view(request):
     # Render the initial template
     return render(request, "extract_embedding.html")
 
+def is_precropped(request):
+    """
+    Callers that already cropped the face (e.g. detection containers) send precropped=true to skip MTCNN.
+    """
+    return str(request.data.get('precropped', '')).lower() in ['true', '1', 'yes']
+
+def save_cropped_face(cropped_face):
+    """
+    Save a normalized face tensor returned by extract_embedding as a JPEG under MEDIA_ROOT.
+
+    Returns:
+        Path of the saved photo relative to MEDIA_ROOT, suitable for Recognition.photo.
+    """
+    # Create directory if it doesn't exist
+    directory = os.path.join(settings.MEDIA_ROOT, "recognition_face_photos")
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    normalized_face = (cropped_face + 1) / 2
+    cropped_face_image = Image.fromarray((normalized_face * 255).permute(1, 2, 0).byte().numpy())
+    cropped_face_filename = f"{uuid.uuid4().hex}.jpg"
+    cropped_face_path = os.path.join(directory, cropped_face_filename)
+    cropped_face_image.save(cropped_face_path)
+    print(f"Image saved at {cropped_face_path}")
+
+    return os.path.join("recognition_face_photos", cropped_face_filename)
+
 class FindClosestEmbeddingView(APIView):
     def post(self, request):
         # Get the photo
@@ -59,45 +88,37 @@ class FindClosestEmbeddingView(APIView):
             return Response({"error": "No file provided"}, status=status.HTTP_400_BAD_REQUEST)
 
         # Extract the embedding and cropped face from the photo
-        embedding, cropped_face = extract_embedding(photo)
+        embedding, cropped_face = extract_embedding(photo, precropped=is_precropped(request))
 
         if embedding is None or cropped_face is None:
             return Response({"error": "Could not extract embedding from photo"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        # Create directory if it doesn't exist
-        directory = os.path.join(settings.MEDIA_ROOT, "recognition_face_photos")
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-
         # Save the cropped face as an image file
-        normalized_face = (cropped_face + 1) / 2
-        cropped_face_image = Image.fromarray((normalized_face * 255).permute(1, 2, 0).byte().numpy())
-        cropped_face_filename = f"{uuid.uuid4().hex}.jpg"
-        cropped_face_path = os.path.join(directory, cropped_face_filename)
-        cropped_face_image.save(cropped_face_path)
-        print(f"Image saved at {cropped_face_path}")
-
-        # Find the closest match using pg-vector's L2 distance
-        closest_embedding = FaceEmbedding.objects.annotate(
-            distance=L2Distance("embedding", embedding)
-        ).order_by('distance').first()
+        cropped_face_photo = save_cropped_face(cropped_face)
+
+        # Find the closest match (in-memory index or pgvector HNSW index)
+        closest_embedding = find_closest_embedding(embedding.numpy())
 
         # Prepare the recognition data
         if closest_embedding:
-            user = closest_embedding.user
-            distance = closest_embedding.distance
+            embedding_id, user_id, distance = closest_embedding
+            user = User.objects.filter(id=user_id).first()
+            if user is None:
+                # The embedding index of this process still held an embedding of a deleted user
+                get_embedding_index().remove(embedding_id)
+                return Response({"error": "No embeddings found"}, status=status.HTTP_404_NOT_FOUND)
             # Save recognition data
             recognition = Recognition.objects.create(
                 user=user,
                 distance=distance,
                 time=timezone.now(),
-                photo=os.path.join("recognition_face_photos", cropped_face_filename)
+                photo=cropped_face_photo
             )
             result = {
                 "user_id": user.id,
                 "user_name": user.username,
-                "user_inside": Entry.objects.filter(recognition_out__isnull=True, user_id=user.id).exists(),
-                "embedding_id": closest_embedding.id,
+                "user_inside": get_occupancy().is_inside(user.id),
+                "embedding_id": embedding_id,
                 "distance": distance,
                 "recognition_id": recognition.id
             }
@@ -105,6 +126,74 @@ class FindClosestEmbeddingView(APIView):
         else:
             return Response({"error": "No embeddings found"}, status=status.HTTP_404_NOT_FOUND)
         
+class FindClosestEmbeddingsBatchView(APIView):
+    """
+    Recognize many face crops sent in one multipart request (repeated "files" field).
+    Send precropped=true to skip face detection when the crops are already faces.
+
+    Embeddings are extracted in one batch and all nearest neighbours are resolved in one vectorized lookup.
+    Results are returned in input order; crops without a usable face get an "error" entry instead.
+    """
+    def post(self, request):
+        photos = request.FILES.getlist('files')
+        if not photos:
+            return Response({"error": "No files provided"}, status=status.HTTP_400_BAD_REQUEST)
+
+        extracted = extract_embeddings_batch(photos, precropped=is_precropped(request))
+        valid = [i for i, (embedding, cropped_face) in enumerate(extracted) if embedding is not None]
+
+        results = [{"error": "Could not extract embedding from photo"} for _ in photos]
+        if not valid:
+            return Response({"results": results}, status=status.HTTP_200_OK)
+
+        embeddings = np.stack([extracted[i][0].numpy() for i in valid])
+        closest_embeddings = find_closest_embeddings(embeddings)
+
+        matched = [(i, match) for i, match in zip(valid, closest_embeddings) if match is not None]
+        for i, match in zip(valid, closest_embeddings):
+            if match is None:
+                results[i] = {"error": "No embeddings found"}
+
+        if not matched:
+            return Response({"results": results}, status=status.HTTP_200_OK)
+
+        user_ids = {user_id for _, (_, user_id, _) in matched}
+        users = User.objects.in_bulk(user_ids)
+
+        # The embedding index can still hold embeddings of a user deleted since it was loaded
+        for i, (embedding_id, user_id, _) in matched:
+            if users.get(user_id) is None:
+                get_embedding_index().remove(embedding_id)
+                results[i] = {"error": "No embeddings found"}
+        matched = [(i, match) for i, match in matched if users.get(match[1]) is not None]
+        if not matched:
+            return Response({"results": results}, status=status.HTTP_200_OK)
+
+        users_inside = get_occupancy().inside(users.keys())
+
+        now = timezone.now()
+        recognitions = Recognition.objects.bulk_create([
+            Recognition(
+                user_id=user_id,
+                distance=distance,
+                time=now,
+                photo=save_cropped_face(extracted[i][1])
+            )
+            for i, (_, user_id, distance) in matched
+        ])
+
+        for (i, (embedding_id, user_id, distance)), recognition in zip(matched, recognitions):
+            results[i] = {
+                "user_id": user_id,
+                "user_name": users[user_id].username,
+                "user_inside": user_id in users_inside,
+                "embedding_id": embedding_id,
+                "distance": distance,
+                "recognition_id": recognition.id
+            }
+
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def create_recognition_view(request):
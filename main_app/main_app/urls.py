@@ -1,9 +1,9 @@
 # urls.py
 from django.contrib import admin
 from django.urls import path, include
-from face_recognition.views import create_recognition_view, extract_embedding_view, FindClosestEmbeddingView
+from face_recognition.views import create_recognition_view, extract_embedding_view, FindClosestEmbeddingView, FindClosestEmbeddingsBatchView
 from management.views import add_camera_view, add_face_embedding_view, camera_streams_raw_view, containers_status_view, delete_camera_view, edit_camera_view, hard_reset_all_containers_view, hard_restart_container_view, soft_reset_all_containers_view, soft_restart_container_view, start_all_containers_view, start_container_view, stop_all_containers_view, stop_container_view
-from stats.views import camera_detections_view, detections_monthly_view, detections_view, detections_weekly_view, entries_list_view, recognize_entry_view, recognize_exit_view
+from stats.views import camera_detections_view, detections_monthly_view, detections_view, detections_weekly_view, entries_list_view, export_view, recognize_entry_view, recognize_exit_view
 from django.conf import settings
 from django.conf.urls.static import static
 from management.views import home, camera_streams_view
@@ -70,10 +70,12 @@ urlpatterns = [
     path('camera-detections/', camera_detections_view, name='camera_detections'),
     path('detections/weekly/', detections_weekly_view, name='detections_weekly'),
     path('detections/monthly/', detections_monthly_view, name='detections_monthly'),
+    path('stats/export/<str:kind>/', export_view, name='stats_export'),
     
     # face recognition
     path('face_recognition/extract_embedding/', extract_embedding_view, name='extract-embedding-view'),
     path('face_recognition/api/recognize/', FindClosestEmbeddingView.as_view()),
+    path('face_recognition/api/recognize_batch/', FindClosestEmbeddingsBatchView.as_view()),
 
     # other
     path('admin/', admin.site.urls),
@@ -27,10 +27,15 @@ class SettingForm(forms.ModelForm):
 class CameraForm(forms.ModelForm):
     class Meta:
         model = Camera
-        fields = ['name', 'link', 'enabled', 'photo']
+        fields = ['name', 'link', 'sub_stream_link', 'reference_width', 'reference_height', 'roi_polygons', 'exclusion_polygons', 'enabled', 'photo']
         widgets = {
             'name': forms.TextInput(attrs={'class': 'form-control'}),
             'link': forms.URLInput(attrs={'class': 'form-control'}),
+            'sub_stream_link': forms.URLInput(attrs={'class': 'form-control'}),
+            'reference_width': forms.NumberInput(attrs={'class': 'form-control'}),
+            'reference_height': forms.NumberInput(attrs={'class': 'form-control'}),
+            'roi_polygons': forms.Textarea(attrs={'class': 'form-control', 'rows': 3}),
+            'exclusion_polygons': forms.Textarea(attrs={'class': 'form-control', 'rows': 3}),
             'enabled': forms.CheckboxInput(attrs={'class': 'form-check-input'}),
             'photo': forms.ClearableFileInput(attrs={'class': 'form-control'}),
         }
\ No newline at end of file
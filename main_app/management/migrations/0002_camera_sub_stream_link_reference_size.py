@@ -0,0 +1,28 @@
+# Generated by Django 5.1.4 on 2025-03-02 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('management', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='camera',
+            name='sub_stream_link',
+            field=models.CharField(blank=True, default='', max_length=500),
+        ),
+        migrations.AddField(
+            model_name='camera',
+            name='reference_width',
+            field=models.PositiveIntegerField(default=1920),
+        ),
+        migrations.AddField(
+            model_name='camera',
+            name='reference_height',
+            field=models.PositiveIntegerField(default=1080),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.4 on 2025-03-06 09:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('management', '0002_camera_sub_stream_link_reference_size'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='camera',
+            name='roi_polygons',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='camera',
+            name='exclusion_polygons',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -1,17 +1,27 @@
-from django.db import models
+from django.db import models, transaction
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import User
 import logging
 from django.core.exceptions import ValidationError
 
-from .utils import restart_all_containers_logic
+from .utils import invalidate_settings, notify_settings_changed, restart_all_containers_logic
 
 class Camera(models.Model):
     link = models.CharField(max_length=500, unique=True)
     name = models.CharField(max_length=200, unique=True)
     enabled = models.BooleanField(default=True)
     photo = models.ImageField(upload_to='camera_reference_photos/', default='default.png')
+    # Low resolution sub-stream used for inference, the main link is then only used for face crops
+    sub_stream_link = models.CharField(max_length=500, blank=True, default='')
+    # Resolution detection coordinates are stored in, whatever resolution the streams are decoded at
+    reference_width = models.PositiveIntegerField(default=1920)
+    reference_height = models.PositiveIntegerField(default=1080)
+    # Polygons ([[x, y], ...] in the reference resolution) people are detected in (the model only sees their
+    # bounding rectangle, empty for the whole frame) and polygons whose detections are dropped, e.g. posters
+    # and monitors. The motion gate looks for motion in the same region, ROI minus exclusions.
+    roi_polygons = models.JSONField(blank=True, null=True)
+    exclusion_polygons = models.JSONField(blank=True, null=True)
 
     def __str__(self):
         return f"{self.name}: {self.link}"
@@ -71,7 +81,11 @@ class Setting(models.Model):
 @receiver(post_save, sender=Setting)
 @receiver(post_delete, sender=Setting)
 def setting_changed(sender, instance, **kwargs):
+    # Cached settings of this process are reloaded on the next read once the change is committed
+    transaction.on_commit(invalidate_settings)
     try:
+        # Other processes (entry app, detection containers) reload on the NOTIFY
+        notify_settings_changed(instance.key)
         # Implement only if setting si related to the detection
         # restart_all_containers_logic(hard=True)
         logging.info(f"Containers restarted due to Setting changes: {instance.key}")
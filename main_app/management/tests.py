@@ -1,3 +1,88 @@
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase
 
-# Create your tests here.
+from .models import Setting
+from .utils import get_container_shm_size, get_setting, get_settings, invalidate_settings, parse_setting_value
+
+
+class ParseSettingValueTests(SimpleTestCase):
+    def test_parses_by_data_type(self):
+        self.assertEqual(parse_setting_value("40", 'int'), 40)
+        self.assertEqual(parse_setting_value("0.6", 'float'), 0.6)
+        self.assertEqual(parse_setting_value("memory", 'str'), "memory")
+
+    def test_bool_values(self):
+        for value in ["true", "True", "1", "yes"]:
+            self.assertIs(parse_setting_value(value, 'bool'), True)
+        for value in ["false", "0", "no", ""]:
+            self.assertIs(parse_setting_value(value, 'bool'), False)
+
+    def test_invalid_value_is_returned_as_stored(self):
+        with self.assertLogs(level='WARNING'):
+            self.assertEqual(parse_setting_value("abc", 'int'), "abc")
+        with self.assertLogs(level='WARNING'):
+            self.assertEqual(parse_setting_value("1,5", 'float'), "1,5")
+
+
+class SettingsCacheTests(TestCase):
+    def setUp(self):
+        invalidate_settings()
+        self.addCleanup(invalidate_settings)
+        self.setting = Setting.objects.create(key='testEfSearch', value='40', default_value='40', data_type='int')
+        invalidate_settings()
+
+    def test_typed_and_raw_values(self):
+        self.assertEqual(get_setting('testEfSearch'), 40)
+        self.assertEqual(get_settings()['testEfSearch'], '40')
+        self.assertEqual(get_setting('missingSetting', 'default'), 'default')
+
+    def test_cached_reads_do_not_query(self):
+        get_settings()
+        with self.assertNumQueries(0):
+            get_setting('testEfSearch')
+            get_settings()
+
+    def test_returned_dict_is_a_copy(self):
+        get_settings()['testEfSearch'] = '100'
+        self.assertEqual(get_settings()['testEfSearch'], '40')
+
+    def test_saved_setting_is_reloaded_after_commit(self):
+        self.assertEqual(get_setting('testEfSearch'), 40)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.setting.value = '80'
+            self.setting.save()
+
+        self.assertEqual(get_setting('testEfSearch'), 80)
+
+    def test_deleted_setting_is_reloaded_after_commit(self):
+        self.assertEqual(get_setting('testEfSearch'), 40)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.setting.delete()
+
+        self.assertIsNone(get_setting('testEfSearch'))
+
+
+class ContainerShmSizeTests(TestCase):
+    def setUp(self):
+        invalidate_settings()
+        self.addCleanup(invalidate_settings)
+
+    def test_grows_with_the_cameras_of_the_container(self):
+        ring = 16 + 3 * (32 + 1920 * 1080 * 3)
+        headroom = 64 * 1024 * 1024
+
+        self.assertEqual(get_container_shm_size(1), 2 * ring + headroom)
+        # Eight 1080p cameras no longer fit into a fixed 256 MB
+        self.assertEqual(get_container_shm_size(8), 16 * ring + headroom)
+        self.assertGreater(get_container_shm_size(8), 256 * 1024 * 1024)
+
+    def test_follows_the_ring_settings(self):
+        Setting.objects.bulk_create([
+            Setting(key='detectionContainerStreamRingSlots', value='2', default_value='3', data_type='int'),
+            Setting(key='detectionContainerStreamMaxFrameBytes', value='1000', default_value='6220800', data_type='int'),
+            Setting(key='detectionContainerShmHeadroomMb', value='0', default_value='64', data_type='int'),
+        ])
+        invalidate_settings()
+
+        self.assertEqual(get_container_shm_size(4), 4 * 2 * (16 + 2 * (32 + 1000)))
@@ -8,8 +8,10 @@ import cv2
 from django.views.decorators.csrf import csrf_exempt
 import docker
 from django.apps import apps
+from django.db import connection
 from django.conf import settings
 import logging
+from threading import Lock
 import requests
 
 
@@ -17,27 +19,63 @@ logger = logging.getLogger(__name__)
 
 # containers
 
-def get_container_env(camera_id):
+def get_container_env(camera_ids):
+    """
+    Build the environment of a detection container. A single container can process several cameras,
+    their links and ids are passed as JSON lists in CAMERA_LINKS/CAMERA_IDS (CAMERA_LINK/CAMERA_ID hold the first one).
+    """
     Camera = apps.get_model('management', 'Camera')
 
     setting_dict = get_settings()
 
-    camera = Camera.objects.get(id=camera_id)
+    if not isinstance(camera_ids, (list, tuple)):
+        camera_ids = [camera_ids]
+
+    cameras = Camera.objects.in_bulk(camera_ids)
+    cameras = [cameras[camera_id] for camera_id in camera_ids]
 
     environment = {
-        'CAMERA_LINK': camera.link,
-        'CAMERA_ID': str(camera.id),
+        'CAMERA_LINK': cameras[0].link,
+        'CAMERA_ID': str(cameras[0].id),
+        'CAMERA_LINKS': json.dumps([camera.link for camera in cameras]),
+        'CAMERA_IDS': json.dumps([camera.id for camera in cameras]),
+        'CAMERA_SUB_LINKS': json.dumps([camera.sub_stream_link or None for camera in cameras]),
+        'CAMERA_REFERENCE_SIZES': json.dumps([[camera.reference_width, camera.reference_height] for camera in cameras]),
+        'CAMERA_ROI_POLYGONS': json.dumps([camera.roi_polygons or None for camera in cameras]),
+        'CAMERA_EXCLUSION_POLYGONS': json.dumps([camera.exclusion_polygons or None for camera in cameras]),
+        'DECODE_SCALE': setting_dict.get("decodeScaleTracking", "1.0"),
+        'DECODE_SKIP_FRAMES': setting_dict.get("decodeSkipFramesTracking", "true"),
+        'MOTION_GATE': setting_dict.get("motionGateTracking", "true"),
+        'MOTION_METHOD': setting_dict.get("motionMethodTracking", "diff"),
+        'MOTION_MIN_AREA': setting_dict.get("motionMinAreaTracking", "0.002"),
+        'MOTION_HOLD': setting_dict.get("motionHoldTracking", "2.0"),
         'BATCH_SIZE': setting_dict.get("batchSizeDetectionsSave", "100"),
+        'DETECTION_FLUSH_INTERVAL': setting_dict.get("flushIntervalDetectionsSave", "5"),
         'TRACKING_MODEL': setting_dict.get("trackingModel", "yolo11n.pt"),
         'FACE_DETECTION_MODEL': setting_dict.get("faceDetectionModel", "yolov10n-face.pt"),
         'FACE_SIMILARITY_THRESHOLD': setting_dict.get("faceSimilarityTresholdTracking", "0.7"),
         'FACE_DETECTION_THRESHOLD': setting_dict.get("faceDetectionTresholdTracking", "0.4"),
+        'FACE_DETECTION_IMGSZ': setting_dict.get("faceDetectionImgszTracking", "320"),
         'PERSON_DETECTION_THRESHOLD': setting_dict.get("personDetectionTresholdTracking", "0.6"),
         'FACE_SIMILARITY_REQUEST_LINK': setting_dict.get(
             "detectionContainerFaceSimilarirtyRequestLink",
             "host.docker.internal:8000/face_recognition/api/recognize/"
         ),
+        'FACE_SIMILARITY_BATCH_REQUEST_LINK': setting_dict.get(
+            "detectionContainerFaceSimilarityBatchRequestLink",
+            "http://host.docker.internal:8000/face_recognition/api/recognize_batch/"
+        ),
+        'RECOGNITION_PRECROPPED': setting_dict.get("detectionContainerRecognitionPrecropped", "true"),
         'FPS': setting_dict.get("fpsTracking", "10"),
+        'STREAM_TRANSPORT': setting_dict.get("detectionContainerStreamTransport", "shm"),
+        'STREAM_PASS_JPEG': setting_dict.get("detectionContainerStreamPassJpeg", "false"),
+        'STREAM_MAX_FPS': setting_dict.get("detectionContainerStreamMaxFps", "15"),
+        'STREAM_RING_SLOTS': str(get_ring_slots()),
+        'STREAM_MAX_FRAME_BYTES': str(get_ring_slot_size()),
+        'RECOGNITION_MAX_IN_FLIGHT': setting_dict.get("recognitionMaxInFlightTracking", "4"),
+        'RECOGNITION_WINDOW': setting_dict.get("recognitionWindowTracking", "0.5"),
+        'RECOGNITION_BACKOFF_BASE': setting_dict.get("recognitionBackoffBaseTracking", "1.0"),
+        'RECOGNITION_BACKOFF_MAX': setting_dict.get("recognitionBackoffMaxTracking", "30.0"),
         'PGVECTOR_DB_NAME': os.getenv('PGVECTOR_DB_NAME'),
         'PGVECTOR_DB_USER': os.getenv('PGVECTOR_DB_USER'),
         'PGVECTOR_DB_PASSWORD': os.getenv('PGVECTOR_DB_PASSWORD'),
@@ -47,30 +85,147 @@ def get_container_env(camera_id):
 
     return environment
 
-def get_new_container_config(camera_id, container_port):
+def get_ring_slots():
+    return max(1, int(get_settings().get("detectionContainerStreamRingSlots", "3")))
+
+def get_ring_slot_size():
+    # Bytes of a shared memory ring slot, a raw 1080p BGR frame by default, bigger frames are passed as JPEG
+    return int(get_settings().get("detectionContainerStreamMaxFrameBytes", str(1920 * 1080 * 3)))
+
+def get_container_shm_size(camera_count):
+    """
+    Bytes of /dev/shm a detection container needs: every camera maps two frame rings (processed and raw)
+    of get_ring_slots() slots, plus headroom for the rest of the worker (e.g. PyTorch).
+    """
     setting_dict = get_settings()
 
+    # Ring header, then a slot header and the slot data per slot (see SharedFrameRing in detection/utils.py)
+    ring_size = 16 + get_ring_slots() * (32 + get_ring_slot_size())
+    headroom = int(setting_dict.get("detectionContainerShmHeadroomMb", "64")) * 1024 * 1024
+
+    return camera_count * 2 * ring_size + headroom
+
+def get_new_container_config(camera_ids, container_port):
+    setting_dict = get_settings()
+
+    if not isinstance(camera_ids, (list, tuple)):
+        camera_ids = [camera_ids]
+
     container_config = {
-        'image': setting_dict.get("detectionContainerImage", 'pppfkp15/flask-ultralytics-gpu:4.0'),
+        'image': setting_dict.get("detectionContainerImage", 'pppfkp15/flask-ultralytics-gpu:5.0'),
         'detach': True,
-        'environment': get_container_env(camera_id),
+        'environment': get_container_env(camera_ids),
         'network_mode': 'bridge',  
         'ports': {'5000/tcp': container_port},  # Simplified port mapping
-        'device_requests': [
+        'shm_size': get_container_shm_size(len(camera_ids)),  # Room for the frame rings of all cameras
+    }
+
+    # The detection worker falls back to the CPU when no GPU is requested
+    if setting_dict.get("detectionContainerUseGpu", "true").lower() == "true":
+        container_config['device_requests'] = [
             docker.types.DeviceRequest(count=-1, capabilities=[['gpu']])
         ]
-    }
 
     return container_config
 
-def get_settings():
+def get_cameras_per_container():
+    setting_dict = get_settings()
+
+    return max(1, int(setting_dict.get("detectionCamerasPerContainer", "1")))
+
+def run_new_container(client, container_record):
+    """
+    Create a new container for every camera sharing the container of container_record
+    and point all their CameraContainer records to it.
+    """
+    CameraContainer = apps.get_model('management', 'CameraContainer')
+
+    shared_records = list(
+        CameraContainer.objects.filter(container_id=container_record.container_id).order_by('camera_id')
+    ) or [container_record]
+    camera_ids = [record.camera_id for record in shared_records]
+
+    container_config = get_new_container_config(camera_ids, container_record.port)
+
+    # Extract the image and pass the rest of the config as keyword arguments
+    image = container_config.pop('image')  # Remove 'image' from the config
+    new_container = client.containers.run(image, **container_config)
+
+    # Update the CameraContainer records
+    for record in shared_records:
+        record.container_id = new_container.id
+        record.port = container_record.port
+        record.save()
+
+    return new_container
+
+# Channel the management app NOTIFYs with the changed setting key, the entry app and the detection containers LISTEN on it
+SETTINGS_CHANNEL = 'settings_changed'
+
+# Settings loaded once per process: {'raw': {key: value}, 'typed': {key: parsed value}}, None until loaded or after a change
+_settings_cache = None
+_settings_lock = Lock()
+
+def parse_setting_value(value, data_type):
+    """
+    Parse a stored setting value by its data_type, values that do not parse are returned as stored.
+    """
+    try:
+        if data_type == 'int':
+            return int(value)
+        if data_type == 'float':
+            return float(value)
+        if data_type == 'bool':
+            return str(value).lower() in ['true', '1', 'yes']
+    except ValueError:
+        logging.warning(f"Setting value {value!r} is not a valid {data_type}")
+    return value
+
+def load_settings():
+    """
+    Read the Setting table in one query and cache it until the next setting change.
+    """
+    global _settings_cache
 
     Setting = apps.get_model('management', 'Setting')
+    rows = Setting.objects.values_list('key', 'value', 'data_type')
 
-    # Fetch settings
-    setting_dict = {setting.key: setting.value for setting in Setting.objects.all()}
+    cache = {
+        'raw': {key: value for key, value, _ in rows},
+        'typed': {key: parse_setting_value(value, data_type) for key, value, data_type in rows},
+    }
+    with _settings_lock:
+        _settings_cache = cache
+    return cache
 
-    return setting_dict
+def get_settings():
+    """
+    All settings as {key: value string}. Served from the per-process cache, no query once loaded.
+    """
+    cache = _settings_cache or load_settings()
+    return dict(cache['raw'])
+
+def get_setting(key, default=None):
+    """
+    A single setting parsed by its data_type, or default if it does not exist.
+    """
+    cache = _settings_cache or load_settings()
+    return cache['typed'].get(key, default)
+
+def invalidate_settings():
+    """
+    Drop the cached settings, the next read loads them again.
+    """
+    global _settings_cache
+    with _settings_lock:
+        _settings_cache = None
+
+def notify_settings_changed(key):
+    """
+    Tell the processes listening on SETTINGS_CHANNEL that a setting changed, sent when the transaction commits.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_notify(%s, %s)", [SETTINGS_CHANNEL, key])
 
 def get_docker_client():
 
@@ -78,9 +233,26 @@ def get_docker_client():
 
     return docker.DockerClient(base_url=setting_dict.get("dockerClientAddress", 'tcp://host.docker.internal:2375'))
 
+def container_cameras(container_record):
+    """
+    Describe the cameras processed by the container of container_record, e.g. "cameras 1, 2".
+    Starting, stopping or restarting the container acts on all of them.
+    """
+    CameraContainer = apps.get_model('management', 'CameraContainer')
+
+    camera_ids = list(
+        CameraContainer.objects.filter(container_id=container_record.container_id)
+        .order_by('camera_id').values_list('camera_id', flat=True)
+    ) or [container_record.camera_id]
+
+    if len(camera_ids) == 1:
+        return f"camera {camera_ids[0]}"
+    return f"cameras {', '.join(str(camera_id) for camera_id in camera_ids)}"
+
 def start_container_logic(camera_id):
     """
     Logic to start a specific container. Create a new container if one doesn't exist.
+    The container processes every camera of its worker group, they are all started.
     """
     try:
         client = get_docker_client()
@@ -89,29 +261,23 @@ def start_container_logic(camera_id):
 
         # Retrieve or create a container record for the given camera ID
         container_record = CameraContainer.objects.get(camera_id=camera_id)
+        cameras = container_cameras(container_record)
 
         try:
             # Check if the container exists
             container = client.containers.get(container_record.container_id)
             container.start()
         except docker.errors.NotFound:
-            container_config= get_new_container_config(camera_id, container_record.port)
-
-            # Extract the image and pass the rest of the config as keyword arguments
-            image = container_config.pop('image')  # Remove 'image' from the config
-            new_container = client.containers.run(image, **container_config)
+            run_new_container(client, container_record)
 
-            # Update the CameraContainer record
-            container_record.container_id = new_container.id
-            container_record.save()
-
-        return {'message': f'Container for camera {camera_id} started successfully'}
+        return {'message': f'Container for {cameras} started successfully'}
     except Exception as e:
         return {'error': str(e), 'status': 500}
     
 def stop_container_logic(camera_id):
     """
     Logic to stop a specific container. Stops the container if it's running.
+    The container processes every camera of its worker group, they are all stopped.
     """
     try:
         client = get_docker_client()
@@ -120,21 +286,23 @@ def stop_container_logic(camera_id):
 
         # Retrieve the container record for the given camera ID
         container_record = CameraContainer.objects.get(camera_id=camera_id)
+        cameras = container_cameras(container_record)
 
         try:
             # Check if the container exists
             container = client.containers.get(container_record.container_id)
             container.stop()
         except docker.errors.NotFound:
-            return {'error': f'Container for camera {camera_id} not found', 'status': 404}
+            return {'error': f'Container for {cameras} not found', 'status': 404}
 
-        return {'message': f'Container for camera {camera_id} stopped successfully'}
+        return {'message': f'Container for {cameras} stopped successfully'}
     except Exception as e:
         return {'error': str(e), 'status': 500}
 
 def soft_restart_container_logic(camera_id):
     """
     Soft restart logic: Restart the container if it exists; otherwise, create a new one.
+    The container processes every camera of its worker group, they are all restarted.
     """
     try:
         client = get_docker_client()
@@ -143,30 +311,24 @@ def soft_restart_container_logic(camera_id):
 
         # Retrieve or create a container record for the given camera ID
         container_record = CameraContainer.objects.get(camera_id=camera_id)
+        cameras = container_cameras(container_record)
 
         try:
             # Check if the container exists
             container = client.containers.get(container_record.container_id)
             container.restart()
-            return {'message': f'Container for camera {camera_id} restarted successfully'}
+            return {'message': f'Container for {cameras} restarted successfully'}
         except docker.errors.NotFound:
-            container_config= get_new_container_config(camera_id, container_record.port)
-
-            # Extract the image and pass the rest of the config as keyword arguments
-            image = container_config.pop('image')  # Remove 'image' from the config
-            new_container = client.containers.run(image, **container_config)
+            run_new_container(client, container_record)
 
-            # Update the CameraContainer record
-            container_record.container_id = new_container.id
-            container_record.save()
-
-            return {'message': f'Container for camera {camera_id} created and started successfully'}
+            return {'message': f'Container for {cameras} created and started successfully'}
     except Exception as e:
         return {'error': str(e), 'status': 500}
 
 def hard_restart_container_logic(camera_id):
     """
     Hard restart logic: Always delete the existing container and create a new one.
+    The container processes every camera of its worker group, they are all recreated.
     """
     try:
         client = get_docker_client()
@@ -175,6 +337,7 @@ def hard_restart_container_logic(camera_id):
 
         # Retrieve the container record for the given camera ID
         container_record = CameraContainer.objects.get(camera_id=camera_id)
+        cameras = container_cameras(container_record)
 
         # Try to stop and remove the existing container if it exists
         try:
@@ -184,17 +347,9 @@ def hard_restart_container_logic(camera_id):
         except docker.errors.NotFound:
             pass  # Container doesn't exist, no need to remove it
 
-        container_config= get_new_container_config(camera_id, container_record.port)
-
-        # Extract the image and pass the rest of the config as keyword arguments
-        image = container_config.pop('image')  # Remove 'image' from the config
-        new_container = client.containers.run(image, **container_config)
-
-        # Update the CameraContainer record
-        container_record.container_id = new_container.id
-        container_record.save()
+        run_new_container(client, container_record)
 
-        return {'message': f'Container for camera {camera_id} recreated and started successfully'}
+        return {'message': f'Container for {cameras} recreated and started successfully'}
     except Exception as e:
         return {'error': str(e), 'status': 500}
 
@@ -211,7 +366,8 @@ def restart_all_containers_logic(hard_restart=False):
         CameraContainer = apps.get_model('management', 'CameraContainer')
         base_port = setting_dict.get('detectionContainersBasePort', 5000)
 
-        camera_containers = CameraContainer.objects.all()
+        # Cameras processed by the same container share its record values, handle each container once
+        camera_containers = {record.container_id: record for record in CameraContainer.objects.all()}.values()
 
         if not hard_restart:
             for container_record in camera_containers:
@@ -244,7 +400,7 @@ def restart_all_containers_logic(hard_restart=False):
             time.sleep(2)
             
             # Create new containers for all enabled cameras
-            enabled_cameras = Camera.objects.filter(enabled=True)
+            enabled_cameras = list(Camera.objects.filter(enabled=True).order_by('id'))
             used_ports = set()
             
             def find_available_port(start_port):
@@ -267,13 +423,21 @@ def restart_all_containers_logic(hard_restart=False):
                         sock.close()
                 raise RuntimeError("No available ports found")
             
-            for camera in enabled_cameras:
+            # Group the cameras so one container runs batched inference for several of them
+            cameras_per_container = get_cameras_per_container()
+            camera_groups = [
+                enabled_cameras[i:i + cameras_per_container]
+                for i in range(0, len(enabled_cameras), cameras_per_container)
+            ]
+
+            for cameras in camera_groups:
+                camera_names = ", ".join(camera.name for camera in cameras)
                 try:
                     # Find an available port
                     container_port = find_available_port(base_port)
                     used_ports.add(container_port)
                     
-                    container_config = get_new_container_config(camera.id, container_port)
+                    container_config = get_new_container_config([camera.id for camera in cameras], container_port)
                     
                     # Extract the image and pass the rest of the config as keyword arguments
                     image = container_config.pop('image')
@@ -281,17 +445,18 @@ def restart_all_containers_logic(hard_restart=False):
                     # Create the container
                     new_container = client.containers.run(image, **container_config)
                     
-                    # Save the container info in the database
-                    CameraContainer.objects.create(
-                        camera=camera,
-                        container_id=new_container.id,
-                        port=container_port
-                    )
+                    # Save the container info in the database, cameras of one container share its id and port
+                    for camera in cameras:
+                        CameraContainer.objects.create(
+                            camera=camera,
+                            container_id=new_container.id,
+                            port=container_port
+                        )
                     
-                    logging.info(f"New container created for camera {camera.name} at port {container_port}")
+                    logging.info(f"New container created for cameras {camera_names} at port {container_port}")
                         
                 except Exception as e:
-                    logging.error(f"Error creating container for camera {camera.name}: {e}")
+                    logging.error(f"Error creating container for cameras {camera_names}: {e}")
                     # Release the port if container creation failed
                     used_ports.discard(container_port)
             
@@ -307,7 +472,8 @@ def start_all_containers_logic():
     try:
         client = get_docker_client()
         CameraContainer = apps.get_model('management', 'CameraContainer')
-        camera_containers = CameraContainer.objects.all()
+        # Cameras processed by the same container share its record values, handle each container once
+        camera_containers = {record.container_id: record for record in CameraContainer.objects.all()}.values()
 
         for container_record in camera_containers:
             try:
@@ -334,7 +500,8 @@ def stop_all_containers_logic():
     try:
         client = get_docker_client()
         CameraContainer = apps.get_model('management', 'CameraContainer')
-        camera_containers = CameraContainer.objects.all()
+        # Cameras processed by the same container share its record values, handle each container once
+        camera_containers = {record.container_id: record for record in CameraContainer.objects.all()}.values()
 
         for container_record in camera_containers:
             try:
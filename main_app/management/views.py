@@ -37,7 +37,7 @@ def camera_streams_view(request):
     streams = [
         {
             "camera_name": container.camera.name,
-            "video_feed_url": f"http://{server_host}:{container.port}/video_feed"
+            "video_feed_url": f"http://{server_host}:{container.port}/video_feed/{container.camera.id}"
         }
         for container in containers
     ]
@@ -58,7 +58,7 @@ def camera_streams_raw_view(request):
         {
             "camera_id": container.camera.id,
             "camera_name": container.camera.name,
-            "video_feed_url": f"http://{server_host}:{container.port}/video_feed_raw"
+            "video_feed_url": f"http://{server_host}:{container.port}/video_feed_raw/{container.camera.id}"
         }
         for container in containers
     ]
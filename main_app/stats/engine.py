@@ -0,0 +1,125 @@
+# engine.py
+from django.db import connection
+from django.db.models import Avg, Count, DurationField, ExpressionWrapper, F, Q, Sum
+from django.db.models.functions import ExtractDay, ExtractWeekDay
+
+# Bucket expressions over DetectionHourly.hour for the dashboard time series
+SERIES_BUCKETS = {
+    'hour': F('hour'),
+    'weekday': ExtractWeekDay('hour'),
+    'day': ExtractDay('hour'),
+}
+
+
+def detection_summary(detections):
+    """
+    Compute every detection figure of the dashboards in a single SQL statement.
+
+    The per-user and per-camera totals are aggregated once, the averages and the top/bottom rows
+    come from window functions over those totals instead of separate querysets.
+
+    Args:
+        detections: Filtered DetectionHourly queryset
+
+    Returns:
+        Dict with total, unrecognized, avg_per_user, avg_per_camera, top_user, bottom_user,
+        top_camera and bottom_camera (the last four shaped like the former values() rows, or None).
+    """
+    base_sql, params = detections.values('camera_id', 'user_id', 'detection_count').query.sql_with_params()
+
+    sql = f"""
+    WITH d AS ({base_sql}),
+    groups AS (
+        SELECT 'user' AS kind, u.username AS name, SUM(d.detection_count) AS count
+        FROM d JOIN auth_user u ON u.id = d.user_id
+        GROUP BY u.id, u.username
+        UNION ALL
+        SELECT 'camera', c.name, SUM(d.detection_count)
+        FROM d JOIN management_camera c ON c.id = d.camera_id
+        GROUP BY c.id, c.name
+    ),
+    ranked AS (
+        SELECT kind, name, count,
+            AVG(count) OVER (PARTITION BY kind) AS average,
+            ROW_NUMBER() OVER (PARTITION BY kind ORDER BY count DESC, name) AS top_rank,
+            ROW_NUMBER() OVER (PARTITION BY kind ORDER BY count ASC, name) AS bottom_rank
+        FROM groups
+    )
+    SELECT 'total', NULL, COALESCE(SUM(detection_count), 0),
+        COALESCE(SUM(detection_count) FILTER (WHERE user_id IS NULL), 0), NULL, NULL
+    FROM d
+    UNION ALL
+    SELECT kind, name, count, average, top_rank, bottom_rank
+    FROM ranked
+    WHERE top_rank = 1 OR bottom_rank = 1
+    """
+
+    summary = {
+        'total': 0,
+        'unrecognized': 0,
+        'avg_per_user': 0,
+        'avg_per_camera': 0,
+        'top_user': None,
+        'bottom_user': None,
+        'top_camera': None,
+        'bottom_camera': None,
+    }
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+    for kind, name, count, average, top_rank, bottom_rank in rows:
+        if kind == 'total':
+            # The total row carries the unrecognized count in the average column
+            summary['total'] = int(count)
+            summary['unrecognized'] = int(average)
+            continue
+
+        row = {f'{kind}__username' if kind == 'user' else f'{kind}__name': name, 'count': int(count)}
+        summary[f'avg_per_{kind}'] = float(average)
+        if top_rank == 1:
+            summary[f'top_{kind}'] = row
+        if bottom_rank == 1:
+            summary[f'bottom_{kind}'] = row
+
+    return summary
+
+def detection_series(detections, bucket):
+    """
+    Detection counts per time bucket ('hour', 'weekday' or 'day') in one grouped query.
+
+    Returns:
+        Dict mapping the bucket value to its detection count.
+    """
+    series = detections.annotate(
+        bucket=SERIES_BUCKETS[bucket]
+    ).values('bucket').annotate(count=Sum('detection_count')).order_by('bucket')
+
+    return {item['bucket']: item['count'] for item in series}
+
+def entry_summary(entries):
+    """
+    Entry count, average stay and average first entry / last exit hour in a single aggregate.
+    """
+    exited = Q(recognition_out__isnull=False)
+
+    return entries.aggregate(
+        total=Count('id', distinct=True),
+        avg_duration=Avg(
+            ExpressionWrapper(F('recognition_out__time') - F('recognition_in__time'), output_field=DurationField()),
+            filter=exited,
+        ),
+        avg_first_entry=Avg('recognition_in__time__hour'),
+        avg_last_exit=Avg('recognition_out__time__hour', filter=exited),
+    )
+
+def format_duration(duration):
+    """
+    Format a timedelta as hours and minutes, e.g. "1h 5m".
+    """
+    if not duration:
+        return "0h 0m"
+
+    total_minutes = duration.total_seconds() / 60
+    return f"{int(total_minutes // 60)}h {int(total_minutes % 60)}m"
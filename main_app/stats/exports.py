@@ -0,0 +1,119 @@
+# exports.py
+import csv
+from datetime import datetime, timedelta
+
+from django.apps import apps
+from django.utils import timezone
+
+# Rows fetched per round trip from the server-side cursor
+EXPORT_CHUNK_SIZE = 5000
+
+# Column names with their Parquet type, declared up front since a chunk can be all NULL in a column
+DETECTION_COLUMNS = [
+    ('id', 'int'), ('time', 'timestamp'), ('camera_id', 'int'), ('camera', 'string'), ('user_id', 'int'),
+    ('username', 'string'), ('track_id', 'int'), ('x', 'int'), ('y', 'int'), ('w', 'int'), ('h', 'int'),
+]
+ENTRY_COLUMNS = [
+    ('id', 'int'), ('user_id', 'int'), ('username', 'string'), ('time_in', 'timestamp'), ('time_out', 'timestamp'),
+    ('recognition_in_id', 'int'), ('recognition_out_id', 'int'),
+]
+
+
+def export_range(date_from, date_to=None):
+    """
+    Parse an inclusive YYYY-MM-DD date range into aware (since, until) datetimes, until being exclusive.
+    Without date_to the range ends today. Raises ValueError on malformed dates.
+    """
+    since = timezone.make_aware(datetime.strptime(date_from, '%Y-%m-%d'))
+    if date_to:
+        until = timezone.make_aware(datetime.strptime(date_to, '%Y-%m-%d'))
+    else:
+        until = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+    return since, until + timedelta(days=1)
+
+def detection_rows(since, until, camera_id=None, username=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Stream detections of a time range as tuples in DETECTION_COLUMNS order.
+
+    The rows come from a server-side cursor, chunk_size at a time, so memory use does not depend on the range.
+    """
+    Detection = apps.get_model('stats', 'Detection')
+
+    detections = Detection.objects.filter(time__gte=since, time__lt=until)
+    if camera_id:
+        detections = detections.filter(camera_id=camera_id)
+    if username:
+        detections = detections.filter(user__username=username)
+
+    return detections.order_by('time', 'id').values_list(
+        'id', 'time', 'camera_id', 'camera__name', 'user_id', 'user__username', 'track_id', 'x', 'y', 'w', 'h'
+    ).iterator(chunk_size=chunk_size)
+
+def entry_rows(since, until, username=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Stream entries that started in a time range as tuples in ENTRY_COLUMNS order.
+    """
+    Entry = apps.get_model('stats', 'Entry')
+
+    entries = Entry.objects.filter(recognition_in__time__gte=since, recognition_in__time__lt=until)
+    if username:
+        entries = entries.filter(user__username=username)
+
+    return entries.order_by('recognition_in__time', 'id').values_list(
+        'id', 'user_id', 'user__username', 'recognition_in__time', 'recognition_out__time',
+        'recognition_in_id', 'recognition_out_id'
+    ).iterator(chunk_size=chunk_size)
+
+EXPORTS = {
+    'detections': (DETECTION_COLUMNS, detection_rows),
+    'entries': (ENTRY_COLUMNS, entry_rows),
+}
+
+
+class Echo:
+    """
+    File-like object handing back what csv.writer writes, so every row can be yielded as it is formatted.
+    """
+    def write(self, value):
+        return value
+
+def csv_lines(columns, rows):
+    """
+    Yield the CSV header and one CSV line per row.
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow([name for name, _ in columns])
+    for row in rows:
+        yield writer.writerow(row)
+
+def write_parquet(path, columns, rows, row_group_size=EXPORT_CHUNK_SIZE):
+    """
+    Write rows to a Parquet file, one row group per row_group_size rows.
+
+    Requires pyarrow, raises ImportError when it is not installed.
+
+    Returns:
+        Number of rows written.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    types = {'int': pa.int64(), 'string': pa.string(), 'timestamp': pa.timestamp('us', tz='UTC')}
+    schema = pa.schema([(name, types[kind]) for name, kind in columns])
+    names = [name for name, _ in columns]
+
+    written = 0
+    batch = []
+
+    with pq.ParquetWriter(path, schema) as writer:
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= row_group_size:
+                writer.write_table(pa.Table.from_pylist([dict(zip(names, row)) for row in batch], schema=schema))
+                written += len(batch)
+                batch = []
+        if batch:
+            writer.write_table(pa.Table.from_pylist([dict(zip(names, row)) for row in batch], schema=schema))
+            written += len(batch)
+
+    return written
@@ -0,0 +1,111 @@
+# heatmap.py
+import math
+
+from django.core.cache import cache
+from django.db import connection
+from django.utils import timezone
+from management.utils import get_settings
+
+# Grid over the reference resolution of the camera (40px squares for 1920x1080)
+HEATMAP_COLUMNS = 48
+HEATMAP_ROWS = 27
+
+# Binned in the database, the foot position is the bottom center of the bounding box
+GRID_SQL = """
+SELECT
+    LEAST(%s, GREATEST(0, FLOOR(d.x * %s / %s)))::int AS grid_x,
+    LEAST(%s, GREATEST(0, FLOOR((d.y + d.h / 2.0) * %s / %s)))::int AS grid_y,
+    COUNT(*)
+FROM ({base}) d
+GROUP BY 1, 2
+"""
+
+# Every step-th detection in time order, so the sample still covers the whole range
+SAMPLE_SQL = """
+SELECT x, y, time
+FROM (
+    SELECT d.x, d.y + d.h / 2.0 AS y, d.time, ROW_NUMBER() OVER (ORDER BY d.time) AS row_number
+    FROM ({base}) d
+) numbered
+WHERE row_number %% %s = 0
+ORDER BY time
+"""
+
+
+def heatmap_grid(detections, camera):
+    """
+    Count the detections per heatmap cell with a single GROUP BY query.
+
+    Returns:
+        HEATMAP_ROWS x HEATMAP_COLUMNS nested list of counts.
+    """
+    base_sql, params = detections.values('x', 'y', 'h').query.sql_with_params()
+    grid = [[0 for _ in range(HEATMAP_COLUMNS)] for _ in range(HEATMAP_ROWS)]
+
+    with connection.cursor() as cursor:
+        cursor.execute(GRID_SQL.format(base=base_sql), [
+            HEATMAP_COLUMNS - 1, HEATMAP_COLUMNS, camera.reference_width,
+            HEATMAP_ROWS - 1, HEATMAP_ROWS, camera.reference_height,
+            *params,
+        ])
+        for grid_x, grid_y, count in cursor.fetchall():
+            grid[grid_y][grid_x] = count
+
+    return grid
+
+def sample_points(detections, total, limit):
+    """
+    Foot positions of at most `limit` detections, evenly spread over time.
+
+    Returns:
+        List of {'x', 'y', 'time'} dicts.
+    """
+    if total == 0 or limit <= 0:
+        return []
+
+    base_sql, params = detections.values('x', 'y', 'h', 'time').query.sql_with_params()
+    step = max(1, math.ceil(total / limit))
+
+    with connection.cursor() as cursor:
+        cursor.execute(SAMPLE_SQL.format(base=base_sql), [*params, step])
+        rows = cursor.fetchall()
+
+    return [{'x': x, 'y': float(y), 'time': time.isoformat()} for x, y, time in rows]
+
+def camera_heatmap(detections, camera, datetime_from, datetime_to, user_filter):
+    """
+    Heatmap grid, detection total and down-sampled points of a camera for a time range,
+    cached per (camera, time range, user filter).
+
+    Ranges that are already over are cached for heatmapCacheTimeoutPast seconds (default one day),
+    ranges that still receive detections for heatmapCacheTimeout seconds (default 60).
+
+    Returns:
+        Dict with grid, total and points.
+    """
+    setting_dict = get_settings()
+    max_points = int(setting_dict.get("heatmapMaxPoints", "5000"))
+
+    key = (
+        f"heatmap:{camera.id}:{camera.reference_width}x{camera.reference_height}:"
+        f"{datetime_from.isoformat()}:{datetime_to.isoformat()}:{user_filter.lower()}:{max_points}"
+    )
+    heatmap = cache.get(key)
+    if heatmap is not None:
+        return heatmap
+
+    grid = heatmap_grid(detections, camera)
+    total = sum(map(sum, grid))
+    heatmap = {
+        'grid': grid,
+        'total': total,
+        'points': sample_points(detections, total, max_points),
+    }
+
+    if datetime_to <= timezone.now():
+        timeout = int(setting_dict.get("heatmapCacheTimeoutPast", "86400"))
+    else:
+        timeout = int(setting_dict.get("heatmapCacheTimeout", "60"))
+    cache.set(key, heatmap, timeout)
+
+    return heatmap
@@ -0,0 +1,51 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from stats.exports import EXPORT_CHUNK_SIZE, EXPORTS, csv_lines, export_range, write_parquet
+
+
+class Command(BaseCommand):
+    help = "Export detections or entries of a date range as CSV or Parquet, streaming rows from a server-side cursor."
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(EXPORTS), help="What to export")
+        parser.add_argument('--date-from', required=True, help="First day to export (YYYY-MM-DD)")
+        parser.add_argument('--date-to', default=None, help="Last day to export (YYYY-MM-DD), defaults to today")
+        parser.add_argument('--camera', type=int, default=None, help="Only detections of this camera id")
+        parser.add_argument('--username', default=None, help="Only rows of this user")
+        parser.add_argument('--format', choices=['csv', 'parquet'], default='csv', help="Output format")
+        parser.add_argument('--output', default=None, help="Output file, CSV goes to stdout without it")
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE,
+                            help="Rows per cursor fetch and per Parquet row group")
+
+    def handle(self, *args, **options):
+        try:
+            since, until = export_range(options['date_from'], options['date_to'])
+        except ValueError:
+            raise CommandError("Dates must be in the YYYY-MM-DD format")
+
+        columns, rows_function = EXPORTS[options['kind']]
+        filters = {'username': options['username'], 'chunk_size': options['chunk_size']}
+        if options['kind'] == 'detections':
+            filters['camera_id'] = options['camera']
+        elif options['camera']:
+            raise CommandError("--camera only applies to detections")
+        rows = rows_function(since, until, **filters)
+
+        if options['format'] == 'parquet':
+            if not options['output']:
+                raise CommandError("--output is required for Parquet exports")
+            try:
+                written = write_parquet(options['output'], columns, rows, row_group_size=options['chunk_size'])
+            except ImportError:
+                raise CommandError("Parquet exports require pyarrow (pip install pyarrow)")
+            self.stderr.write(self.style.SUCCESS(f"Exported {written} {options['kind']} to {options['output']}"))
+            return
+
+        if options['output']:
+            with open(options['output'], 'w', newline='') as output:
+                output.writelines(csv_lines(columns, rows))
+            self.stderr.write(self.style.SUCCESS(f"Exported {options['kind']} to {options['output']}"))
+        else:
+            sys.stdout.writelines(csv_lines(columns, rows))
@@ -0,0 +1,62 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from management.utils import get_settings, invalidate_settings
+from stats.partitions import drop_expired_partitions, ensure_partitions, list_partitions
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the upcoming daily partitions of stats_detection and drop the ones older than the "
+        "detectionRetentionDays setting (0 keeps everything)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days-ahead', type=int, default=7, help="Number of future days to create partitions for")
+        parser.add_argument('--retention-days', type=int, default=None,
+                            help="Days of detections to keep (defaults to the detectionRetentionDays setting)")
+        parser.add_argument('--dry-run', action='store_true', help="Only report the partitions that would be dropped")
+        parser.add_argument('--loop', type=int, default=0,
+                            help="Repeat every LOOP seconds instead of running once")
+
+    def handle(self, *args, **options):
+        while True:
+            if not options['loop']:
+                self.maintain(options['days_ahead'], options['retention_days'], options['dry_run'])
+                break
+
+            # A failed run must not end the maintenance of a background loop, the next run retries
+            try:
+                self.maintain(options['days_ahead'], options['retention_days'], options['dry_run'])
+            except Exception:
+                logger.exception("Detection partition maintenance failed")
+            # Nothing notifies this process of changed settings, read them again on the next run
+            invalidate_settings()
+            close_old_connections()
+            time.sleep(options['loop'])
+
+    def maintain(self, days_ahead, retention_days, dry_run):
+        if retention_days is None:
+            retention_days = int(get_settings().get("detectionRetentionDays", "0"))
+
+        today = timezone.localdate()
+
+        with transaction.atomic():
+            created = [] if dry_run else ensure_partitions(today, today + timedelta(days=days_ahead))
+            dropped = drop_expired_partitions(retention_days, today=today, dry_run=dry_run)
+
+        for name in created:
+            self.stdout.write(f"Created {name}")
+        for name in dropped:
+            self.stdout.write(f"{'Would drop' if dry_run else 'Dropped'} {name}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(list_partitions())} daily partitions, {len(created)} created, {len(dropped)} dropped"
+        ))
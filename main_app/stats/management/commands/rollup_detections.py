@@ -0,0 +1,70 @@
+import logging
+import time
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.utils import timezone
+
+from management.utils import invalidate_settings
+from stats.rollups import rollup_detections
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Update the hourly detection rollup (stats_detectionhourly) the statistics dashboards read from."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=str, default=None,
+                            help="Recompute from this date (YYYY-MM-DD) instead of the last rolled up hour")
+        parser.add_argument('--lookback-hours', type=int, default=2,
+                            help="Hours before the last rolled up hour that are recomputed to catch late detections")
+        parser.add_argument('--loop', type=int, default=0,
+                            help="Repeat every LOOP seconds instead of running once")
+        parser.add_argument('--full-days', type=int, default=7,
+                            help="With --loop, recompute the last FULL_DAYS days once a day, for detections "
+                                 "replayed later than the lookback (0 disables)")
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = timezone.make_aware(datetime.strptime(options['since'], '%Y-%m-%d'))
+            except ValueError:
+                raise CommandError("--since must be a date in the YYYY-MM-DD format")
+
+        if not options['loop']:
+            self.rollup(since, options['lookback_hours'])
+            return
+
+        last_full_day = None
+        while True:
+            # Spill files of the detection worker can be replayed hours or days after the detections were
+            # taken, older than the lookback window, so the recent days are fully recomputed once a day
+            today = timezone.localdate()
+            if since is None and options['full_days'] and today != last_full_day:
+                midnight = timezone.make_aware(datetime.combine(today, datetime.min.time()))
+                since = midnight - timedelta(days=options['full_days'])
+
+            # A failed run must not end the background loop, the next run retries
+            try:
+                self.rollup(since, options['lookback_hours'])
+                if since is not None:
+                    last_full_day = today
+                # Only the first run starts at --since, later ones continue from the rollup itself
+                since = None
+            except Exception:
+                logger.exception("Detection rollup failed")
+
+            # Nothing notifies this process of changed settings, read them again on the next run
+            invalidate_settings()
+            close_old_connections()
+            time.sleep(options['loop'])
+
+    def rollup(self, since, lookback_hours):
+        result = rollup_detections(since=since, lookback_hours=lookback_hours)
+        if result:
+            self.stdout.write(self.style.SUCCESS(f"Rolled up detections from {result[0]} to {result[1]}"))
+        else:
+            self.stdout.write("No detections to roll up")
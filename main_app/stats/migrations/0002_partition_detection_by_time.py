@@ -0,0 +1,103 @@
+# Generated by Django 5.1.4 on 2025-03-09 14:30
+
+from datetime import datetime, time, timedelta
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+# Partitioned copy of stats_detection, swapped in for the original table once the rows are moved over.
+# The primary key has to include the partition key, so it becomes (id, time).
+CREATE_PARTITIONED_TABLE = """
+CREATE TABLE stats_detection_partitioned (
+    id bigint GENERATED BY DEFAULT AS IDENTITY,
+    track_id bigint NOT NULL,
+    time timestamp with time zone NOT NULL,
+    x integer NOT NULL,
+    y integer NOT NULL,
+    w integer NOT NULL,
+    h integer NOT NULL,
+    camera_id bigint NOT NULL REFERENCES management_camera (id) DEFERRABLE INITIALLY DEFERRED,
+    user_id integer NULL REFERENCES auth_user (id) DEFERRABLE INITIALLY DEFERRED,
+    PRIMARY KEY (id, time)
+) PARTITION BY RANGE (time);
+CREATE TABLE stats_detection_default PARTITION OF stats_detection_partitioned DEFAULT;
+"""
+
+SWAP_TABLES = """
+INSERT INTO stats_detection_partitioned (id, track_id, time, x, y, w, h, camera_id, user_id)
+SELECT id, track_id, time, x, y, w, h, camera_id, user_id FROM stats_detection;
+SELECT setval(
+    pg_get_serial_sequence('stats_detection_partitioned', 'id'),
+    COALESCE((SELECT MAX(id) FROM stats_detection_partitioned), 0) + 1,
+    false
+);
+DROP TABLE stats_detection;
+ALTER TABLE stats_detection_partitioned RENAME TO stats_detection;
+ALTER INDEX stats_detection_partitioned_pkey RENAME TO stats_detection_pkey;
+CREATE INDEX stats_det_camera_time_idx ON stats_detection (camera_id, time);
+CREATE INDEX stats_det_user_time_idx ON stats_detection (user_id, time);
+"""
+
+
+def day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+def create_partitions(apps, schema_editor):
+    """Daily partitions for every day holding existing detections and the next week."""
+    today = timezone.localdate()
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT MIN(time), MAX(time) FROM stats_detection")
+        first, last = cursor.fetchone()
+
+        first_day = timezone.localtime(first).date() if first else today
+        last_day = max(timezone.localtime(last).date() if last else today, today) + timedelta(days=7)
+
+        day = first_day
+        while day <= last_day:
+            cursor.execute(
+                f'CREATE TABLE "stats_detection_p{day:%Y%m%d}" PARTITION OF stats_detection_partitioned '
+                'FOR VALUES FROM (%s) TO (%s)',
+                [day_start(day), day_start(day + timedelta(days=1))]
+            )
+            day += timedelta(days=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(CREATE_PARTITIONED_TABLE),
+                migrations.RunPython(create_partitions),
+                migrations.RunSQL(SWAP_TABLES),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='detection',
+                    name='camera',
+                    field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='detections', to='management.camera'),
+                ),
+                migrations.AlterField(
+                    model_name='detection',
+                    name='user',
+                    field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='detections', to=settings.AUTH_USER_MODEL),
+                ),
+                migrations.AddIndex(
+                    model_name='detection',
+                    index=models.Index(fields=['camera', 'time'], name='stats_det_camera_time_idx'),
+                ),
+                migrations.AddIndex(
+                    model_name='detection',
+                    index=models.Index(fields=['user', 'time'], name='stats_det_user_time_idx'),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.4 on 2025-03-11 10:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('management', '0003_camera_roi_polygons_exclusion_polygons'),
+        ('stats', '0002_partition_detection_by_time'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DetectionHourly',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('detection_count', models.PositiveIntegerField(default=0)),
+                ('camera', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='detection_rollups', to='management.camera')),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='detection_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['hour'], name='stats_dethourly_hour_idx')],
+                'constraints': [models.UniqueConstraint(fields=('camera', 'user', 'hour'), name='stats_dethourly_cam_user_hour_uniq', nulls_distinct=False)],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.4 on 2025-03-16 11:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0003_detectionhourly'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='entry',
+            constraint=models.UniqueConstraint(condition=models.Q(('recognition_out__isnull', True)), fields=('user',), name='stats_entry_one_open_per_user'),
+        ),
+    ]
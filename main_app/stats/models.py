@@ -1,13 +1,18 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User 
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from face_recognition.models import Recognition
 from management.models import Camera
 from pgvector.django import VectorField
+from .occupancy import get_occupancy
 
 
 class Detection(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='detections', null=True)
-    camera = models.ForeignKey(Camera, on_delete=models.CASCADE, related_name='detections')
+    # Covered by the (user, time) and (camera, time) indexes
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='detections', null=True, db_index=False)
+    camera = models.ForeignKey(Camera, on_delete=models.CASCADE, related_name='detections', db_index=False)
     track_id = models.BigIntegerField()
     time = models.DateTimeField()
     x = models.IntegerField(default=0)
@@ -15,6 +20,36 @@ class Detection(models.Model):
     w = models.IntegerField(default=0)
     h = models.IntegerField(default=0)
 
+    class Meta:
+        # stats_detection is range partitioned by time (daily partitions, see stats/partitions.py),
+        # its primary key is (id, time) in the database
+        indexes = [
+            models.Index(fields=['camera', 'time'], name='stats_det_camera_time_idx'),
+            models.Index(fields=['user', 'time'], name='stats_det_user_time_idx'),
+        ]
+
+class DetectionHourly(models.Model):
+    """
+    Number of detections per camera, user (NULL for unrecognized) and hour, maintained by the
+    rollup_detections command so the dashboards never aggregate raw stats_detection rows.
+    """
+    camera = models.ForeignKey(Camera, on_delete=models.CASCADE, related_name='detection_rollups')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='detection_rollups', null=True)
+    hour = models.DateTimeField()
+    detection_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['camera', 'user', 'hour'],
+                name='stats_dethourly_cam_user_hour_uniq',
+                nulls_distinct=False,
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['hour'], name='stats_dethourly_hour_idx'),
+        ]
+
 class Entry(models.Model):
     user = models.ForeignKey(
         'auth.User',
@@ -35,3 +70,30 @@ class Entry(models.Model):
         blank=True,
         default=None
     )
+
+    class Meta:
+        constraints = [
+            # At most one open entry per user, also the index behind every "who is inside" lookup
+            models.UniqueConstraint(
+                fields=['user'],
+                condition=Q(recognition_out__isnull=True),
+                name='stats_entry_one_open_per_user',
+            ),
+        ]
+
+@receiver(post_save, sender=Entry)
+def update_occupancy(sender, instance, **kwargs):
+    """
+    Keep the in-memory occupancy in sync with saved entries.
+    """
+    entry_id, user_id = instance.pk, instance.user_id
+    if instance.recognition_out_id is None:
+        entered_at = instance.recognition_in.time
+        transaction.on_commit(lambda: get_occupancy().enter(user_id, entry_id, entered_at))
+    else:
+        transaction.on_commit(lambda: get_occupancy().leave(user_id, entry_id))
+
+@receiver(post_delete, sender=Entry)
+def remove_from_occupancy(sender, instance, **kwargs):
+    entry_id, user_id = instance.pk, instance.user_id
+    transaction.on_commit(lambda: get_occupancy().leave(user_id, entry_id))
@@ -0,0 +1,132 @@
+# occupancy.py
+import logging
+from threading import Lock
+
+from django.apps import apps
+
+logger = logging.getLogger(__name__)
+
+
+class Occupancy:
+    """
+    In-memory set of the users currently inside, with their open entry and entry time.
+
+    Loaded lazily from the open entries (served by the partial unique index on Entry) and kept in sync
+    through the Entry post_save/post_delete signals once the transaction commits, so "is user X inside"
+    never has to query the database.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        # Serializes loads, so an older snapshot can never replace a newer one
+        self.load_lock = Lock()
+        self.loaded = False
+        self.loading = False
+        # user_id -> (entry_id, entered_at)
+        self.present = {}
+        # Changes committed while a load is running, replayed on top of its snapshot
+        self.pending = []
+
+    def load(self):
+        """
+        (Re)load the open entries from the database.
+
+        Entries and exits committed while the query runs may be missing from its snapshot, they are
+        queued by enter()/leave() and applied on top of it.
+        """
+        Entry = apps.get_model('stats', 'Entry')
+
+        with self.load_lock:
+            with self.lock:
+                self.loading = True
+                self.pending = []
+
+            try:
+                rows = Entry.objects.filter(recognition_out__isnull=True).values_list('user_id', 'id', 'recognition_in__time')
+                present = {user_id: (entry_id, entered_at) for user_id, entry_id, entered_at in rows}
+            except Exception:
+                with self.lock:
+                    self.loading = False
+                    self.pending = []
+                raise
+
+            with self.lock:
+                for change, args in self.pending:
+                    change(present, *args)
+                self.present = present
+                self.pending = []
+                self.loading = False
+                self.loaded = True
+
+        logger.info(f"Occupancy loaded with {len(present)} users inside")
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            self.load()
+
+    @staticmethod
+    def _enter(present, user_id, entry_id, entered_at):
+        present[user_id] = (entry_id, entered_at)
+
+    @staticmethod
+    def _leave(present, user_id, entry_id):
+        current = present.get(user_id)
+        if current and (entry_id is None or current[0] == entry_id):
+            del present[user_id]
+
+    def _change(self, change, *args):
+        """
+        Apply a change to the loaded occupancy and queue it for a running load. Before the first load
+        nothing is kept, the load reads the change from the database anyway.
+        """
+        with self.lock:
+            if self.loading:
+                self.pending.append((change, args))
+            if self.loaded:
+                change(self.present, *args)
+
+    def enter(self, user_id, entry_id, entered_at):
+        """
+        Mark a user as inside.
+        """
+        self._change(self._enter, user_id, entry_id, entered_at)
+
+    def leave(self, user_id, entry_id=None):
+        """
+        Mark a user as outside. With an entry_id only that entry is closed, so a late signal of an
+        older entry cannot remove a newer one.
+        """
+        self._change(self._leave, user_id, entry_id)
+
+    def is_inside(self, user_id):
+        self.ensure_loaded()
+        return int(user_id) in self.present
+
+    def inside(self, user_ids):
+        """
+        Returns the subset of user_ids that are inside.
+        """
+        self.ensure_loaded()
+        with self.lock:
+            return {user_id for user_id in user_ids if int(user_id) in self.present}
+
+    def open_entry(self, user_id):
+        """
+        Returns (entry_id, entered_at) of the user's open entry or None.
+        """
+        self.ensure_loaded()
+        return self.present.get(int(user_id))
+
+    def count(self):
+        self.ensure_loaded()
+        return len(self.present)
+
+
+# Global occupancy instance, one per process
+_occupancy = None
+
+def get_occupancy():
+    global _occupancy
+    if _occupancy is None:
+        _occupancy = Occupancy()
+    return _occupancy
@@ -0,0 +1,51 @@
+# pagination.py
+import base64
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+def encode_cursor(time, pk):
+    """
+    Opaque cursor pointing after the row with this (time, pk) key.
+    """
+    return base64.urlsafe_b64encode(f"{time.isoformat()}|{pk}".encode()).decode()
+
+def decode_cursor(cursor):
+    """
+    Returns the (time, pk) key of a cursor made by encode_cursor, or None if it is malformed.
+    """
+    try:
+        time, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        time = parse_datetime(time)
+        return (time, int(pk)) if time else None
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+def keyset_page(queryset, time_field, cursor=None, page_size=50):
+    """
+    One page of a queryset in descending (time_field, id) order, continuing after `cursor`.
+
+    Unlike OFFSET pagination every page is a single index range scan, however deep it is.
+
+    Returns:
+        (rows, next_cursor), next_cursor is None on the last page.
+    """
+    queryset = queryset.order_by(f'-{time_field}', '-id')
+
+    key = decode_cursor(cursor) if cursor else None
+    if key:
+        time, pk = key
+        queryset = queryset.filter(Q(**{f'{time_field}__lt': time}) | Q(**{time_field: time, 'id__lt': pk}))
+
+    # One extra row tells whether there is a next page
+    rows = list(queryset[:page_size + 1])
+    if len(rows) <= page_size:
+        return rows, None
+
+    rows = rows[:page_size]
+    last = rows[-1]
+    last_time = last
+    for part in time_field.split('__'):
+        last_time = getattr(last_time, part)
+    return rows, encode_cursor(last_time, last.id)
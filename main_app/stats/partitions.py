@@ -0,0 +1,148 @@
+# partitions.py
+import logging
+import re
+from contextlib import nullcontext
+from datetime import datetime, time, timedelta
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+DETECTION_TABLE = 'stats_detection'
+DEFAULT_PARTITION = f'{DETECTION_TABLE}_default'
+PARTITION_PATTERN = re.compile(rf'^{DETECTION_TABLE}_p(\d{{8}})$')
+
+
+def partition_name(day):
+    return f'{DETECTION_TABLE}_p{day:%Y%m%d}'
+
+def day_start(day):
+    """Start of the day in the current time zone, partition bounds follow local days."""
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+def default_partition(cursor, table=DETECTION_TABLE):
+    """Name of the DEFAULT partition of `table`, or None if it has none."""
+    cursor.execute("""
+        SELECT child.relname
+        FROM pg_partitioned_table
+        JOIN pg_class child ON child.oid = pg_partitioned_table.partdefid
+        WHERE pg_partitioned_table.partrelid = %s::regclass
+    """, [table])
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def create_partition(cursor, day, table=DETECTION_TABLE):
+    """
+    Create the daily partition of stats_detection (or `table`) holding `day` if it does not exist yet.
+
+    Rows of that day already written to the DEFAULT partition (e.g. while the maintenance loop was down)
+    would make the CREATE fail, so the default partition is detached, its rows of the day are moved
+    into the new partition and it is attached again, all in one transaction.
+
+    Returns:
+        True if the partition was created.
+    """
+    name = partition_name(day)
+    cursor.execute("SELECT to_regclass(%s)", [name])
+    if cursor.fetchone()[0] is not None:
+        return False
+
+    bounds = [day_start(day), day_start(day + timedelta(days=1))]
+
+    with transaction.atomic():
+        default = default_partition(cursor, table)
+        stranded = False
+        if default:
+            cursor.execute(f'SELECT EXISTS (SELECT 1 FROM "{default}" WHERE time >= %s AND time < %s)', bounds)
+            stranded = cursor.fetchone()[0]
+
+        if stranded:
+            cursor.execute(f'ALTER TABLE {table} DETACH PARTITION "{default}"')
+
+        cursor.execute(f'CREATE TABLE "{name}" PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)', bounds)
+
+        if stranded:
+            cursor.execute(f"""
+                WITH moved AS (
+                    DELETE FROM "{default}" WHERE time >= %s AND time < %s RETURNING *
+                )
+                INSERT INTO "{name}" SELECT * FROM moved
+            """, bounds)
+            logger.warning(f"Moved {cursor.rowcount} detections from {default} into {name}")
+            cursor.execute(f'ALTER TABLE {table} ATTACH PARTITION "{default}" DEFAULT')
+
+    return True
+
+def ensure_partitions(first_day, last_day, cursor=None, table=DETECTION_TABLE):
+    """
+    Create the daily partitions for every day from first_day to last_day (inclusive).
+
+    Returns:
+        Names of the partitions that were created.
+    """
+    created = []
+    with nullcontext(cursor) if cursor else connection.cursor() as cursor:
+        day = first_day
+        while day <= last_day:
+            if create_partition(cursor, day, table):
+                created.append(partition_name(day))
+            day += timedelta(days=1)
+    return created
+
+def list_partitions():
+    """
+    Returns:
+        List of (day, partition name) of the daily partitions of stats_detection ordered by day.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT child.relname
+            FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = %s
+        """, [DETECTION_TABLE])
+        names = [row[0] for row in cursor.fetchall()]
+
+    partitions = []
+    for name in names:
+        match = PARTITION_PATTERN.match(name)
+        if match:
+            partitions.append((datetime.strptime(match.group(1), '%Y%m%d').date(), name))
+    return sorted(partitions)
+
+def drop_expired_partitions(retention_days, today=None, dry_run=False):
+    """
+    Drop the daily partitions that only hold detections older than retention_days.
+    Whole partitions are dropped, no rows are deleted one by one, except for the expired rows
+    that ended up in the DEFAULT partition.
+
+    Returns:
+        Names of the dropped partitions.
+    """
+    if retention_days <= 0:
+        return []
+
+    today = today or timezone.localdate()
+    cutoff = today - timedelta(days=retention_days)
+
+    dropped = []
+    for day, name in list_partitions():
+        if day >= cutoff:
+            break
+        if not dry_run:
+            with connection.cursor() as cursor:
+                cursor.execute(f'ALTER TABLE {DETECTION_TABLE} DETACH PARTITION "{name}"')
+                cursor.execute(f'DROP TABLE "{name}"')
+        dropped.append(name)
+        logger.info(f"Detection partition {name} dropped (retention {retention_days} days)")
+
+    if not dry_run:
+        with connection.cursor() as cursor:
+            default = default_partition(cursor)
+            if default:
+                cursor.execute(f'DELETE FROM "{default}" WHERE time < %s', [day_start(cutoff)])
+                if cursor.rowcount:
+                    logger.info(f"Deleted {cursor.rowcount} expired detections from {default}")
+    return dropped
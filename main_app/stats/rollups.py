@@ -0,0 +1,57 @@
+# rollups.py
+import logging
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Recomputes whole hours, so running it again over the same range is harmless.
+# The unique constraint treats NULL users as equal, so unrecognized detections conflict as well.
+ROLLUP_SQL = """
+INSERT INTO stats_detectionhourly (camera_id, user_id, hour, detection_count)
+SELECT camera_id, user_id, date_trunc('hour', time) AS hour, COUNT(*)
+FROM stats_detection
+WHERE time >= %s AND time < %s
+GROUP BY camera_id, user_id, date_trunc('hour', time)
+ON CONFLICT (camera_id, user_id, hour) DO UPDATE SET detection_count = EXCLUDED.detection_count
+"""
+
+
+def truncate_to_hour(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+def rollup_detections(since=None, until=None, lookback_hours=2):
+    """
+    Update the hourly detection rollup.
+
+    Without `since`, the rollup restarts `lookback_hours` before the last rolled up hour, so detections
+    written late (batched or replayed by the detection worker) are still counted. An empty rollup
+    table is backfilled from the first detection.
+
+    Returns:
+        (since, until) range that was rolled up, or None if there was nothing to do.
+    """
+    until = until or timezone.now()
+
+    with connection.cursor() as cursor:
+        if since is None:
+            cursor.execute("SELECT MAX(hour) FROM stats_detectionhourly")
+            last_hour = cursor.fetchone()[0]
+            if last_hour is not None:
+                since = last_hour - timedelta(hours=lookback_hours)
+            else:
+                cursor.execute("SELECT MIN(time) FROM stats_detection")
+                since = cursor.fetchone()[0]
+                if since is None:
+                    return None
+
+        since = truncate_to_hour(since)
+
+        with transaction.atomic():
+            cursor.execute(ROLLUP_SQL, [since, until])
+            rows = cursor.rowcount
+
+    logger.info(f"Detection rollup updated from {since} to {until}, {rows} rows")
+    return since, until
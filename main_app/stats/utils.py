@@ -7,8 +7,10 @@ from django.core.files.storage import default_storage
 from PIL import Image
 import logging
 from django.db.models.functions import Round
-from django.shortcuts import get_object_or_404
 from django.core.exceptions import ValidationError
+from django.db import DEFAULT_DB_ALIAS, connection, transaction
+from django.http import Http404
+from .occupancy import get_occupancy
 
 Detection = apps.get_model('stats', 'Detection')
 Entry = apps.get_model('stats', 'Entry')
@@ -28,42 +30,74 @@ from collections import defaultdict
 
 logger = logging.getLogger(__name__)
 
+# Both statements rely on the stats_entry_one_open_per_user partial unique index:
+# a second open entry for a user is skipped by ON CONFLICT, and only the single open entry can be closed
+RECOGNIZE_ENTRY_SQL = f"""
+WITH recognition AS (
+    SELECT id, time FROM {Recognition._meta.db_table} WHERE id = %s
+), inserted AS (
+    INSERT INTO {Entry._meta.db_table} (user_id, recognition_in_id, recognition_out_id)
+    SELECT %s, id, NULL FROM recognition
+    ON CONFLICT (user_id) WHERE recognition_out_id IS NULL DO NOTHING
+    RETURNING id
+)
+SELECT (SELECT time FROM recognition), (SELECT id FROM inserted)
+"""
+
+RECOGNIZE_EXIT_SQL = f"""
+WITH recognition AS (
+    SELECT id FROM {Recognition._meta.db_table} WHERE id = %s
+), updated AS (
+    UPDATE {Entry._meta.db_table} AS entry SET recognition_out_id = recognition.id
+    FROM recognition
+    WHERE entry.user_id = %s AND entry.recognition_out_id IS NULL
+    RETURNING entry.id, entry.recognition_in_id
+)
+SELECT (SELECT id FROM recognition), (SELECT id FROM updated), (SELECT recognition_in_id FROM updated)
+"""
+
+# Column order of the Entry instances built from the RETURNING values
+ENTRY_FIELDS = ['id', 'user_id', 'recognition_in_id', 'recognition_out_id']
+
 def recognize_entry(recognition_id, user_id):
-    # Get the recognition object
-    recognition = get_object_or_404(Recognition, id=recognition_id)
-    
-    # Check if user already has an active entry (recognition_out is None)
-    active_entry = Entry.objects.filter(
-        user_id=user_id,
-        recognition_out__isnull=True
-    ).first()
-    
-    if active_entry:
+    """
+    Open an entry for the user in a single INSERT ... ON CONFLICT statement, so simultaneous scans
+    at the gate cannot create two open entries.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(RECOGNIZE_ENTRY_SQL, [recognition_id, user_id])
+        entered_at, entry_id = cursor.fetchone()
+
+    if entered_at is None:
+        raise Http404("No Recognition matches the given query.")
+
+    # Conflict with the user's open entry
+    if entry_id is None:
         raise ValidationError("User already has an active entry. Must exit first.")
-    
-    # Create new entry
-    entry = Entry.objects.create(
-        user_id=user_id,
-        recognition_in_id=recognition_id
-    )
-    
+
+    entry = Entry.from_db(DEFAULT_DB_ALIAS, ENTRY_FIELDS, [entry_id, int(user_id), int(recognition_id), None])
+
+    # The raw insert does not send post_save, update the occupancy directly
+    transaction.on_commit(lambda: get_occupancy().enter(entry.user_id, entry.id, entered_at))
+
     return entry
 
 def recognize_exit(recognition_id, user_id):
-    # Get the recognition object
-    recognition = get_object_or_404(Recognition, id=recognition_id)
-    
-    # Find the user's active entry
-    active_entry = Entry.objects.filter(
-        user_id=user_id,
-        recognition_out__isnull=True
-    ).first()
-    
-    if not active_entry:
+    """
+    Close the user's open entry in a single UPDATE ... RETURNING statement.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(RECOGNIZE_EXIT_SQL, [recognition_id, user_id])
+        found_recognition_id, entry_id, recognition_in_id = cursor.fetchone()
+
+    if found_recognition_id is None:
+        raise Http404("No Recognition matches the given query.")
+
+    if entry_id is None:
         raise ValidationError("No active entry found for user. Must enter first.")
-    
-    # Update the entry with exit recognition
-    active_entry.recognition_out = recognition
-    active_entry.save()
-    
-    return active_entry
\ No newline at end of file
+
+    entry = Entry.from_db(DEFAULT_DB_ALIAS, ENTRY_FIELDS, [entry_id, int(user_id), recognition_in_id, int(recognition_id)])
+
+    transaction.on_commit(lambda: get_occupancy().leave(entry.user_id, entry.id))
+
+    return entry
\ No newline at end of file
@@ -7,91 +7,62 @@ import cv2
 from django.apps import apps
 from django.utils import timezone
 from django.apps import apps
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.core.exceptions import ValidationError
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 import json
 from django.contrib.admin.views.decorators import staff_member_required
-from django.db.models import Count, Avg, Max, Min, Q
-from django.db.models.functions import Trunc
+from django.db.models import Count, Q
+from django.db.models.functions import Coalesce, Now, Trunc
 from django.utils import timezone
 from datetime import datetime, timedelta
-from django.db.models import F, ExpressionWrapper, DateTimeField, DurationField
+from django.db.models import F, ExpressionWrapper, DurationField
 from django.shortcuts import get_object_or_404
 from .utils import recognize_entry, recognize_exit
+from .engine import detection_series, detection_summary, entry_summary, format_duration
+from .heatmap import camera_heatmap
+from .exports import EXPORTS, csv_lines, export_range
+from .pagination import keyset_page
+from management.utils import get_settings
 from django.db.models.functions import ExtractWeekDay, ExtractDay
 
 @staff_member_required(login_url='admin:login')    
 def entries_live_list_view(request):
     Entry = apps.get_model('stats', 'Entry')
-    entries = Entry.objects.filter(recognition_out__isnull=True)
 
-    # Create a list to store entry data along with time difference
-    entries_with_time = []
-
-    for entry in entries:
-        # Assuming entry.recognition_in.time is a timezone-aware datetime object
-        entry_time = entry.recognition_in.time
-
-        # Get the current time as a timezone-aware datetime
-        current_time = timezone.now()
-
-        # Calculate the time difference
-        time_inside = current_time - entry_time
-
-        # Extract hours, minutes, and seconds from the time difference
-        hours, remainder = divmod(time_inside.total_seconds(), 3600)
-        minutes, seconds = divmod(remainder, 60)
+    # Open entries with their user and entry recognition, and the time inside computed by the database, in one query
+    entries = Entry.objects.filter(recognition_out__isnull=True).select_related('user', 'recognition_in').annotate(
+        time_inside=ExpressionWrapper(Now() - F('recognition_in__time'), output_field=DurationField())
+    ).order_by('recognition_in__time')
 
-        # Format the time difference as a string
-        time_inside_str = f"{int(hours)} hours, {int(minutes)} minutes, {int(seconds)} seconds"
-
-        # Append the entry and its time difference to the list
-        entries_with_time.append({
+    entries_with_time = [
+        {
             'entry': entry,
-            'time_inside': time_inside_str
-        })
+            'time_inside': format_time_inside(entry.time_inside)
+        }
+        for entry in entries
+    ]
 
     # Pass the list to the template
     return render(request, 'entries_live.html', {'entries': entries_with_time})
 
-@staff_member_required(login_url='admin:login')    
-def entries_list_view(request):
-    Entry = apps.get_model('stats', 'Entry')
-    entries = Entry.objects.all()
-
-    # Create a list to store entry data along with time difference
-    entries_with_time = []
-
-    for entry in entries:
-        # Assuming entry.recognition_in.time is a timezone-aware datetime object
-        entry_time = entry.recognition_in.time
-        exit_time = entry.recognition_out.time
-
-        # Calculate the time difference
-        time_inside = exit_time
-
-        # Extract hours, minutes, and seconds from the time difference
-        hours, remainder = divmod(time_inside.total_seconds(), 3600)
-        minutes, seconds = divmod(remainder, 60)
-
-        # Format the time difference as a string
-        time_inside_str = f"{int(hours)} hours, {int(minutes)} minutes, {int(seconds)} seconds"
-
-        # Append the entry and its time difference to the list
-        entries_with_time.append({
-            'entry': entry,
-            'time_inside': time_inside_str
-        })
-
-    # Pass the list to the template
-    return render(request, 'entries.html', {'entries': entries_with_time})
+def format_time_inside(time_inside):
+    hours, remainder = divmod(time_inside.total_seconds(), 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{int(hours)} hours, {int(minutes)} minutes, {int(seconds)} seconds"
 
 @staff_member_required(login_url='admin:login')    
 def entries_list_view(request):
     Entry = apps.get_model('stats', 'Entry')
-    entries = Entry.objects.all().order_by('-recognition_in__time')
+
+    # Users and both recognitions are fetched in the same query, the time inside is computed by the database
+    entries = Entry.objects.select_related('user', 'recognition_in', 'recognition_out').annotate(
+        time_inside=ExpressionWrapper(
+            Coalesce(F('recognition_out__time'), Now()) - F('recognition_in__time'),
+            output_field=DurationField()
+        )
+    )
 
     # Handle search and filter parameters
     username = request.GET.get('username', '')
@@ -99,6 +70,7 @@ def entries_list_view(request):
     date_to = request.GET.get('date_to', '')
     currently_inside = request.GET.get('currently_inside') == 'on'
     time_filter_type = request.GET.get('time_filter_type', 'in')  # 'in' or 'out'
+    time_field = 'recognition_in__time' if time_filter_type == 'in' else 'recognition_out__time'
 
     if username:
         entries = entries.filter(user__username__icontains=username)
@@ -106,58 +78,65 @@ def entries_list_view(request):
     if currently_inside:
         entries = entries.filter(recognition_out__isnull=True)
 
+    # Whole day ranges on the time column itself so the recognition time index can be used
     if date_from:
         try:
             date_from = datetime.strptime(date_from, '%Y-%m-%d')
-            if time_filter_type == 'in':
-                entries = entries.filter(recognition_in__time__date__gte=date_from)
-            else:
-                entries = entries.filter(recognition_out__time__date__gte=date_from)
+            entries = entries.filter(**{f'{time_field}__gte': timezone.make_aware(date_from)})
         except ValueError:
             pass
 
     if date_to:
         try:
             date_to = datetime.strptime(date_to, '%Y-%m-%d')
-            if time_filter_type == 'in':
-                entries = entries.filter(recognition_in__time__date__lte=date_to)
-            else:
-                entries = entries.filter(recognition_out__time__date__lte=date_to)
+            entries = entries.filter(**{f'{time_field}__lt': timezone.make_aware(date_to + timedelta(days=1))})
         except ValueError:
             pass
 
-    # Process entries and calculate time differences
+    # Keyset pagination on (recognition_in__time, id), newest first
+    page_size = int(get_settings().get("entriesPageSize", "50"))
+    entries, next_cursor = keyset_page(entries, 'recognition_in__time', request.GET.get('cursor'), page_size)
+
     entries_with_time = []
-    current_time = timezone.now()
-    
     for entry in entries:
-        entry_time = entry.recognition_in.time
-        exit_time = entry.recognition_out.time if entry.recognition_out else current_time
-        
-        # Calculate time difference (either until exit or until now)
-        time_inside = exit_time - entry_time
-        
-        # Calculate hours, minutes, seconds
-        total_seconds = time_inside.total_seconds()
-        hours, remainder = divmod(total_seconds, 3600)
-        minutes, seconds = divmod(remainder, 60)
-        
-        # Format string differently for those still inside
-        if entry.recognition_out:
-            time_inside_str = f"{int(hours)} hours, {int(minutes)} minutes, {int(seconds)} seconds"
-        else:
-            time_inside_str = f"{int(hours)} hours, {int(minutes)} minutes, {int(seconds)} seconds (Still inside)"
+        is_inside = entry.recognition_out is None
+        time_inside_str = format_time_inside(entry.time_inside)
+        if is_inside:
+            # Format string differently for those still inside
+            time_inside_str += " (Still inside)"
 
         entries_with_time.append({
             'entry': entry,
             'time_inside': time_inside_str,
-            'entry_time': entry_time,
-            'exit_time': entry.recognition_out.time if entry.recognition_out else None,
-            'is_inside': entry.recognition_out is None
+            'entry_time': entry.recognition_in.time,
+            'exit_time': None if is_inside else entry.recognition_out.time,
+            'is_inside': is_inside
+        })
+
+    # JSON variant for infinite scroll, e.g. /entries/?format=json&cursor=...
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'entries': [
+                {
+                    'id': item['entry'].id,
+                    'username': item['entry'].user.username,
+                    'entry_time': item['entry_time'].isoformat(),
+                    'entry_photo': item['entry'].recognition_in.photo.url if item['entry'].recognition_in.photo else None,
+                    'exit_time': item['exit_time'].isoformat() if item['exit_time'] else None,
+                    'exit_photo': item['entry'].recognition_out.photo.url if not item['is_inside'] and item['entry'].recognition_out.photo else None,
+                    'time_inside': item['time_inside'],
+                    'distance_in': item['entry'].recognition_in.distance,
+                    'distance_out': None if item['is_inside'] else item['entry'].recognition_out.distance,
+                    'is_inside': item['is_inside'],
+                }
+                for item in entries_with_time
+            ],
+            'next_cursor': next_cursor,
         })
 
     return render(request, 'entries.html', {
         'entries': entries_with_time,
+        'next_cursor': next_cursor,
         'username': username,
         'date_from': date_from,
         'date_to': date_to,
@@ -223,7 +202,7 @@ def recognize_exit_view(request):
 @staff_member_required(login_url='admin:login')    
 def detections_view(request):
     Entry = apps.get_model('stats', 'Entry')
-    Detection = apps.get_model('stats', 'Detection')
+    DetectionHourly = apps.get_model('stats', 'DetectionHourly')
     User = apps.get_model('auth', 'User')
     Camera = apps.get_model('management', 'Camera')
 
@@ -241,7 +220,7 @@ def detections_view(request):
     date_to = date_from + timedelta(days=1)
     
     # Base querysets
-    detections = Detection.objects.filter(time__gte=date_from, time__lt=date_to)
+    detections = DetectionHourly.objects.filter(hour__gte=date_from, hour__lt=date_to)
     entries = Entry.objects.filter(
         Q(recognition_in__time__gte=date_from, recognition_in__time__lt=date_to) |
         Q(recognition_out__time__gte=date_from, recognition_out__time__lt=date_to)
@@ -256,69 +235,46 @@ def detections_view(request):
     if camera_id:
         detections = detections.filter(camera_id=camera_id)
     
-    # Calculate detection statistics
-    total_detections = detections.count()
-    
+    # All detection figures in one statement, the time series in a second one
+    summary = detection_summary(detections)
+    total_detections = summary['total']
+
     # Only calculate unrecognized stats if no user filter
     unrecognized_percentage = None
     if not username:
-        unrecognized_detections = detections.filter(user__isnull=True).count()
-        unrecognized_percentage = (unrecognized_detections / total_detections * 100) if total_detections > 0 else 0
-    
+        unrecognized_percentage = (summary['unrecognized'] / total_detections * 100) if total_detections > 0 else 0
+
     # Only calculate user stats if no user filter
     avg_detections_per_user = None
     top_user = None
     bottom_user = None
     if not username:
-        avg_detections_per_user = detections.exclude(user__isnull=True).values('user').annotate(
-            count=Count('id')).aggregate(Avg('count'))['count__avg'] or 0
-        top_user = detections.exclude(user__isnull=True).values('user__username').annotate(
-            count=Count('id')).order_by('-count').first()
-        bottom_user = detections.exclude(user__isnull=True).values('user__username').annotate(
-            count=Count('id')).order_by('count').first()
-    
+        avg_detections_per_user = summary['avg_per_user']
+        top_user = summary['top_user']
+        bottom_user = summary['bottom_user']
+
     # Only calculate camera stats if no camera filter
     avg_detections_per_camera = None
     top_camera = None
     bottom_camera = None
     if not camera_id:
-        avg_detections_per_camera = detections.values('camera').annotate(
-            count=Count('id')).aggregate(Avg('count'))['count__avg'] or 0
-        top_camera = detections.values('camera__name').annotate(
-            count=Count('id')).order_by('-count').first()
-        bottom_camera = detections.values('camera__name').annotate(
-            count=Count('id')).order_by('count').first()
-    
-    # Detection time series (30-minute bins)
-    detection_timeseries = detections.annotate(
-        interval=Trunc('time', 'hour', output_field=DateTimeField())
-    ).values('interval').annotate(count=Count('id')).order_by('interval')
+        avg_detections_per_camera = summary['avg_per_camera']
+        top_camera = summary['top_camera']
+        bottom_camera = summary['bottom_camera']
 
+    # Detection time series (hourly bins from the rollup)
     detection_timeseries = [
         {
-            'interval': item['interval'].isoformat(),
-            'count': item['count']
+            'interval': interval.isoformat(),
+            'count': count
         }
-        for item in detection_timeseries
+        for interval, count in detection_series(detections, 'hour').items()
     ]
-    
+
     # Entry statistics
-    total_entries = entries.count()
-    avg_duration = entries.exclude(recognition_out__isnull=True).annotate(
-        duration=ExpressionWrapper(
-            F('recognition_out__time') - F('recognition_in__time'),
-            output_field=DurationField()
-        )
-    ).aggregate(Avg('duration'))['duration__avg']
-    
-    # Format duration as hours and minutes
-    if avg_duration:
-        total_minutes = avg_duration.total_seconds() / 60
-        avg_duration_hours = int(total_minutes // 60)
-        avg_duration_minutes = int(total_minutes % 60)
-        avg_duration_formatted = f"{avg_duration_hours}h {avg_duration_minutes}m"
-    else:
-        avg_duration_formatted = "0h 0m"
+    entry_stats = entry_summary(entries)
+    total_entries = entry_stats['total']
+    avg_duration_formatted = format_duration(entry_stats['avg_duration'])
 
     def format_hour_float(hour_float):
         if hour_float is None:
@@ -330,11 +286,8 @@ def detections_view(request):
         return f"{hours:02d}:{minutes:02d}"
     
     # Average first entry and last exit times
-    avg_first_entry = entries.aggregate(
-        avg_time=Avg('recognition_in__time__hour'))['avg_time']
-    
-    avg_last_exit = entries.exclude(recognition_out__isnull=True).aggregate(
-        avg_time=Avg('recognition_out__time__hour'))['avg_time']
+    avg_first_entry = entry_stats['avg_first_entry']
+    avg_last_exit = entry_stats['avg_last_exit']
     
     formatted_first_entry = format_hour_float(avg_first_entry)
     formatted_last_exit = format_hour_float(avg_last_exit)
@@ -447,27 +400,8 @@ def camera_detections_view(request):
     elif user_filter:
         detections = detections.filter(user__username__iexact=user_filter)
     
-    # Get values for processing
-    detections = detections.values('x', 'y', 'w', 'h', 'time')
-    
-    # Calculate foot positions (bottom center of bounding box)
-    detection_points = [
-        {
-            'x': d['x'],
-            'y': d['y'] + (d['h'] / 2),  # Bottom center
-            'time': d['time'].isoformat()
-        } for d in detections
-    ]
-    
-    # Create heatmap data
-    # We'll create a 48x27 grid (40px squares for 1920x1080)
-    heatmap_data = [[0 for _ in range(48)] for _ in range(27)]
-    
-    for point in detection_points:
-        # Convert coordinates to grid positions
-        grid_x = min(47, max(0, int(point['x'] * 48 / 1920)))
-        grid_y = min(26, max(0, int(point['y'] * 27 / 1080)))
-        heatmap_data[grid_y][grid_x] += 1
+    # Grid binned in the database and a down-sampled set of points, cached per camera, range and user filter
+    heatmap = camera_heatmap(detections, camera, datetime_from, datetime_to, user_filter)
     
     # Get all cameras for dropdown
     cameras = Camera.objects.filter(enabled=True)
@@ -480,9 +414,9 @@ def camera_detections_view(request):
         'camera': camera,
         'cameras': cameras,
         'user_filter': user_filter,
-        'detection_points': json.dumps(detection_points),
-        'heatmap_data': json.dumps(heatmap_data),
-        'total_detections': len(detection_points)
+        'detection_points': json.dumps(heatmap['points']),
+        'heatmap_data': json.dumps(heatmap['grid']),
+        'total_detections': heatmap['total']
     }
     
     return render(request, 'camera_detections.html', context)
@@ -490,7 +424,7 @@ def camera_detections_view(request):
 @staff_member_required(login_url='admin:login')    
 def detections_weekly_view(request):
     Entry = apps.get_model('stats', 'Entry')
-    Detection = apps.get_model('stats', 'Detection')
+    DetectionHourly = apps.get_model('stats', 'DetectionHourly')
     User = apps.get_model('auth', 'User')
     Camera = apps.get_model('management', 'Camera')
 
@@ -509,12 +443,12 @@ def detections_weekly_view(request):
     week_start = week_start.replace(hour=0, minute=0, second=0, microsecond=0)
     week_end = week_start + timedelta(days=7)
     
-    # Base querysets with distinct to avoid duplicates
-    detections = Detection.objects.filter(time__gte=week_start, time__lt=week_end)
+    # Base querysets
+    detections = DetectionHourly.objects.filter(hour__gte=week_start, hour__lt=week_end)
     entries = Entry.objects.filter(
         recognition_in__time__gte=week_start,
         recognition_in__time__lt=week_end
-    ).distinct()  # Add distinct to avoid duplicates
+    )
     
     # Apply filters if provided
     if username.strip():  # Only filter if username is not empty
@@ -525,49 +459,38 @@ def detections_weekly_view(request):
     if camera_id:
         detections = detections.filter(camera_id=camera_id)
     
-    # Rest of the view remains the same until the context...
-    
-    # Calculate detection statistics
-    total_detections = detections.count()
-    
+    # All detection figures in one statement, the time series in a second one
+    summary = detection_summary(detections)
+    total_detections = summary['total']
+
     # Only calculate unrecognized stats if no user filter
     unrecognized_percentage = None
     if not username.strip():
-        unrecognized_detections = detections.filter(user__isnull=True).count()
-        unrecognized_percentage = (unrecognized_detections / total_detections * 100) if total_detections > 0 else 0
-    
+        unrecognized_percentage = (summary['unrecognized'] / total_detections * 100) if total_detections > 0 else 0
+
     # Only calculate user stats if no user filter
     avg_detections_per_user = None
     top_user = None
     bottom_user = None
     if not username.strip():
-        avg_detections_per_user = detections.exclude(user__isnull=True).values('user').annotate(
-            count=Count('id')).aggregate(Avg('count'))['count__avg'] or 0
-        top_user = detections.exclude(user__isnull=True).values('user__username').annotate(
-            count=Count('id')).order_by('-count').first()
-        bottom_user = detections.exclude(user__isnull=True).values('user__username').annotate(
-            count=Count('id')).order_by('count').first()
-    
+        avg_detections_per_user = summary['avg_per_user']
+        top_user = summary['top_user']
+        bottom_user = summary['bottom_user']
+
     # Only calculate camera stats if no camera filter
     avg_detections_per_camera = None
     top_camera = None
     bottom_camera = None
     if not camera_id:
-        avg_detections_per_camera = detections.values('camera').annotate(
-            count=Count('id')).aggregate(Avg('count'))['count__avg'] or 0
-        top_camera = detections.values('camera__name').annotate(
-            count=Count('id')).order_by('-count').first()
-        bottom_camera = detections.values('camera__name').annotate(
-            count=Count('id')).order_by('count').first()
+        avg_detections_per_camera = summary['avg_per_camera']
+        top_camera = summary['top_camera']
+        bottom_camera = summary['bottom_camera']
     
     # Detection time series (by weekday)
-    detection_timeseries = detections.annotate(
-        weekday=ExtractWeekDay('time')
-    ).values('weekday').annotate(count=Count('id')).order_by('weekday')
+    detection_counts = detection_series(detections, 'weekday')
 
     # Convert to list of weekday names and ensure all days are present
     weekdays = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-    detection_counts = {item['weekday']: item['count'] for item in detection_timeseries}
     detection_timeseries = [
         {
             'weekday': weekdays[i],
@@ -576,23 +499,10 @@ def detections_weekly_view(request):
         for i in range(7)
     ]
     
-    # Entry statistics with distinct count
-    total_entries = entries.count()  # This will now count distinct entries
-    avg_duration = entries.exclude(recognition_out__isnull=True).annotate(
-        duration=ExpressionWrapper(
-            F('recognition_out__time') - F('recognition_in__time'),
-            output_field=DurationField()
-        )
-    ).aggregate(Avg('duration'))['duration__avg']
-    
-    # Format duration as hours and minutes
-    if avg_duration:
-        total_minutes = avg_duration.total_seconds() / 60
-        avg_duration_hours = int(total_minutes // 60)
-        avg_duration_minutes = int(total_minutes % 60)
-        avg_duration_formatted = f"{avg_duration_hours}h {avg_duration_minutes}m"
-    else:
-        avg_duration_formatted = "0h 0m"
+    # Entry statistics
+    entry_stats = entry_summary(entries)
+    total_entries = entry_stats['total']
+    avg_duration_formatted = format_duration(entry_stats['avg_duration'])
     
     # Entry/Exit time series by weekday (with distinct)
     entry_timeseries = entries.annotate(
@@ -655,7 +565,7 @@ def detections_weekly_view(request):
 @staff_member_required(login_url='admin:login')    
 def detections_monthly_view(request):
     Entry = apps.get_model('stats', 'Entry')
-    Detection = apps.get_model('stats', 'Detection')
+    DetectionHourly = apps.get_model('stats', 'DetectionHourly')
     User = apps.get_model('auth', 'User')
     Camera = apps.get_model('management', 'Camera')
 
@@ -677,12 +587,12 @@ def detections_monthly_view(request):
     else:
         month_end = month_start.replace(month=month_start.month + 1)
     
-    # Base querysets with distinct to avoid duplicates
-    detections = Detection.objects.filter(time__gte=month_start, time__lt=month_end)
+    # Base querysets
+    detections = DetectionHourly.objects.filter(hour__gte=month_start, hour__lt=month_end)
     entries = Entry.objects.filter(
         recognition_in__time__gte=month_start,
         recognition_in__time__lt=month_end
-    ).distinct()
+    )
     
     # Apply filters if provided
     if username.strip():
@@ -693,47 +603,38 @@ def detections_monthly_view(request):
     if camera_id:
         detections = detections.filter(camera_id=camera_id)
     
-    # Calculate detection statistics
-    total_detections = detections.count()
-    
+    # All detection figures in one statement, the time series in a second one
+    summary = detection_summary(detections)
+    total_detections = summary['total']
+
     # Only calculate unrecognized stats if no user filter
     unrecognized_percentage = None
     if not username.strip():
-        unrecognized_detections = detections.filter(user__isnull=True).count()
-        unrecognized_percentage = (unrecognized_detections / total_detections * 100) if total_detections > 0 else 0
-    
+        unrecognized_percentage = (summary['unrecognized'] / total_detections * 100) if total_detections > 0 else 0
+
     # Only calculate user stats if no user filter
     avg_detections_per_user = None
     top_user = None
     bottom_user = None
     if not username.strip():
-        avg_detections_per_user = detections.exclude(user__isnull=True).values('user').annotate(
-            count=Count('id')).aggregate(Avg('count'))['count__avg'] or 0
-        top_user = detections.exclude(user__isnull=True).values('user__username').annotate(
-            count=Count('id')).order_by('-count').first()
-        bottom_user = detections.exclude(user__isnull=True).values('user__username').annotate(
-            count=Count('id')).order_by('count').first()
-    
+        avg_detections_per_user = summary['avg_per_user']
+        top_user = summary['top_user']
+        bottom_user = summary['bottom_user']
+
     # Only calculate camera stats if no camera filter
     avg_detections_per_camera = None
     top_camera = None
     bottom_camera = None
     if not camera_id:
-        avg_detections_per_camera = detections.values('camera').annotate(
-            count=Count('id')).aggregate(Avg('count'))['count__avg'] or 0
-        top_camera = detections.values('camera__name').annotate(
-            count=Count('id')).order_by('-count').first()
-        bottom_camera = detections.values('camera__name').annotate(
-            count=Count('id')).order_by('count').first()
+        avg_detections_per_camera = summary['avg_per_camera']
+        top_camera = summary['top_camera']
+        bottom_camera = summary['bottom_camera']
     
     # Detection time series (by day of month)
-    detection_timeseries = detections.annotate(
-        day=ExtractDay('time')
-    ).values('day').annotate(count=Count('id')).order_by('day')
+    detection_counts = detection_series(detections, 'day')
 
     # Ensure all days of the month are present
     days_in_month = (month_end - month_start).days
-    detection_counts = {item['day']: item['count'] for item in detection_timeseries}
     detection_timeseries = [
         {
             'day': i + 1,
@@ -743,22 +644,9 @@ def detections_monthly_view(request):
     ]
     
     # Entry statistics
-    total_entries = entries.count()
-    avg_duration = entries.exclude(recognition_out__isnull=True).annotate(
-        duration=ExpressionWrapper(
-            F('recognition_out__time') - F('recognition_in__time'),
-            output_field=DurationField()
-        )
-    ).aggregate(Avg('duration'))['duration__avg']
-    
-    # Format duration as hours and minutes
-    if avg_duration:
-        total_minutes = avg_duration.total_seconds() / 60
-        avg_duration_hours = int(total_minutes // 60)
-        avg_duration_minutes = int(total_minutes % 60)
-        avg_duration_formatted = f"{avg_duration_hours}h {avg_duration_minutes}m"
-    else:
-        avg_duration_formatted = "0h 0m"
+    entry_stats = entry_summary(entries)
+    total_entries = entry_stats['total']
+    avg_duration_formatted = format_duration(entry_stats['avg_duration'])
     
     # Entry/Exit time series by day
     entry_timeseries = entries.annotate(
@@ -819,3 +707,29 @@ def detections_monthly_view(request):
     
     return render(request, 'detections_monthly.html', context)
 
+@staff_member_required(login_url='admin:login')
+def export_view(request, kind):
+    """
+    Stream detections or entries of a date range as CSV, e.g. /stats/export/detections/?date_from=2025-01-01&date_to=2025-01-31
+    Optional filters: camera (detections only) and username.
+    """
+    if kind not in EXPORTS:
+        return JsonResponse({'error': f'Unknown export {kind}'}, status=404)
+
+    try:
+        since, until = export_range(request.GET.get('date_from', ''), request.GET.get('date_to'))
+    except ValueError:
+        return JsonResponse({'error': 'date_from and date_to must be in the YYYY-MM-DD format'}, status=400)
+
+    columns, rows_function = EXPORTS[kind]
+    filters = {'username': request.GET.get('username') or None}
+    if kind == 'detections' and request.GET.get('camera'):
+        try:
+            filters['camera_id'] = int(request.GET['camera'])
+        except ValueError:
+            return JsonResponse({'error': 'camera must be a camera id'}, status=400)
+
+    # Rows are formatted while they are read from the cursor, nothing is materialised
+    response = StreamingHttpResponse(csv_lines(columns, rows_function(since, until, **filters)), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{kind}_{since:%Y%m%d}_{until - timedelta(days=1):%Y%m%d}.csv"'
+    return response
@@ -0,0 +1,52 @@
+"""
+Settings change listener shared by the entry and detection containers, their Dockerfiles copy it to /usr/src/shared.
+"""
+import select
+import time
+from threading import Thread
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+# Channel the management app NOTIFYs with the key of every changed setting
+SETTINGS_CHANNEL = "settings_changed"
+
+class SettingsListener(Thread):
+    """
+    Background thread LISTENing on SETTINGS_CHANNEL with its own connection, opened with db_settings.
+
+    on_change(keys) is called with the set of changed setting keys, and with None after every (re)connect
+    since notifications sent while disconnected are lost and everything has to be reloaded.
+    """
+    def __init__(self, db_settings, on_change, channel=SETTINGS_CHANNEL, reconnect_delay=5.0):
+        super().__init__(daemon=True)
+        self.db_settings = db_settings
+        self.on_change = on_change
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+
+    def run(self):
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(**self.db_settings)
+                conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {self.channel}")
+                self.on_change(None)
+
+                while True:
+                    # Wake up now and then so a dead connection is noticed by poll()
+                    select.select([conn], [], [], 60)
+                    conn.poll()
+                    keys = set()
+                    while conn.notifies:
+                        keys.add(conn.notifies.pop(0).payload)
+                    if keys:
+                        self.on_change(keys)
+            except Exception as e:
+                print(f"Settings listener error: {e}, reconnecting in {self.reconnect_delay}s")
+                time.sleep(self.reconnect_delay)
+            finally:
+                if conn is not None:
+                    conn.close()